@@ -91,43 +91,108 @@ class Regex(registry.String):
 
 
 class SupybotConfigProxy(object):
+    # The settable_attributes whose values were taken from the
+    # registry into the instance __dict__ (None until they are), and
+    # registry_stamp() when they were.
+    __snapshot = None
+    __stamp = None
+
     def __init__(self, *args, **kwargs):
         """Do the regular default configuration, and sta"""
         OriginalConfig = self.__OriginalConfig
         self.__C = OriginalConfig(*args, **kwargs)
 
+    def __setattr__(self, attrname, value):
+        # A value set on the config itself overrides the registry.
+        snapshot = self.__dict__.get('_SupybotConfigProxy__snapshot')
+        if snapshot is not None:
+            snapshot.discard(attrname)
+        object.__setattr__(self, attrname, value)
+
+    def refresh(self):
+        """Take the values of the settable_attributes for the channel
+        from the Supybot registry again.
+
+        They are kept in the instance __dict__, so that looking them
+        up doesn't go through __getattr__ at all."""
+        M = self.__C.M
+        snapshot = set()
+        for attrname in settable_attributes:
+            if (attrname in self.__dict__ and
+                    attrname not in (self.__snapshot or ())):
+                continue
+            value = M._registryValue(attrname, channel=M.channel)
+            if (isinstance(value, str) or
+                    (sys.version_info < (3,0) and isinstance(value, unicode))):
+                # '.' is used to mean "this is not set, use the default
+                # value from the python config class.
+                if value == '.':
+                    value = getattr(self.__C, attrname)
+                else:
+                    value = value.replace('\\n', '\n')
+            self.__dict__[attrname] = value
+            snapshot.add(attrname)
+        self.__dict__['_SupybotConfigProxy__snapshot'] = snapshot
+        self.__dict__['_SupybotConfigProxy__stamp'] = registry_stamp(M.channel)
+
+    def save(self, *args, **kwargs):
+        """Save with the current registry values."""
+        stamp = registry_stamp(self.__C.M.channel)
+        if self.__snapshot is None or stamp is None or stamp != self.__stamp:
+            self.refresh()
+        return type(self.__C).save(self, *args, **kwargs)
+
     def __getattr__(self, attrname):
         """Try to get the value from the Supybot registry.  If it's in
         the registry, return it.  If it's not, then proxy it to th.
         """
-        if attrname in settable_attributes:
-            value = self.__C.M._registryValue(attrname,
-                                              channel=self.__C.M.channel)
-            if not (isinstance(value, str) or
-                    (sys.version_info < (3,0) and isinstance(value, unicode))):
-                return value
-            # '.' is used to mean "this is not set, use the default
-            # value from the python config class.
-            if value != '.':
-                value = value.replace('\\n', '\n')
-                return value
+        if self.__snapshot is None and attrname in settable_attributes:
+            self.refresh()
+            return self.__dict__[attrname]
         # We don't have this value in the registry.  So, proxy it to
         # the normal config object.  This is also the path that all
         # functions take.
+        # Properties are worked out on the proxy too.
+        attr = getattr(type(self.__C), attrname, None)
+        if isinstance(attr, property):
+            return attr.__get__(self)
         value = getattr(self.__C, attrname)
+        # The instance attributes of the config object are only set
+        # by its __init__ (its methods run on the proxy): keep them.
+        if attrname in self.__C.__dict__:
+            self.__dict__[attrname] = value
+            return value
         # If the value is an instance method, we need to re-bind it to
         # the new config class so that we will get the data values
         # defined in Supybot (otherwise attribute lookups in the
         # method will bypass the Supybot proxy and just use default
-        # values).  This will slow things down a little bit, but
-        # that's just the cost of doing business.
+        # values).  This is done once per method: the bound method is
+        # kept in the instance __dict__.
         if hasattr(value, '__func__'):
             if sys.version_info < (3,0):
-                return types.MethodType(value.__func__, self, value.__self__.__class__)
-            return types.MethodType(value.__func__, self)
+                value = types.MethodType(value.__func__, self, value.__self__.__class__)
+            else:
+                value = types.MethodType(value.__func__, self)
+            self.__dict__[attrname] = value
         return value
 
 
+def registry_stamp(channel):
+    """Return when the registry values of the settable_attributes for
+    channel last changed, or None if the registry doesn't tell."""
+    try:
+        stamps = [ registry._lastModified ]
+        for attrname in settable_attributes:
+            value = MeetBot._children[attrname]
+            stamps.append(value._lastModified)
+            value = value._children.get(channel)
+            if value is not None:
+                stamps.append(value._lastModified)
+    except (AttributeError, KeyError):
+        return None
+    return max(stamps)
+
+
 def is_supybotconfig_enabled(OriginalConfig):
     return (use_supybot_config() and
             not getattr(OriginalConfig, 'dontBotConfig', False))
@@ -28,7 +28,6 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
-import time
 from . import writers
 
 def inbase(i, chars='abcdefghijklmnopqrstuvwxyz', place=0):
@@ -49,7 +48,24 @@ def inbase(i, chars='abcdefghijklmnopqrstuvwxyz', place=0):
 # These are objects which we can add to the meeting minutes.  Mainly
 # they exist to aid in HTML-formatting.
 #
+# There can be many of them, so they only hold their fields, in
+# __slots__: nick, linenum, the time as the minute of the day, and
+# the text fields listed in `textfields`.  The other names the
+# templates use are class attributes, collected once per class.
+#
+_classFields = { }
+
 class _BaseItem(object):
+    __slots__ = ('nick', 'linenum', 'minute')
+    # Fields holding text said in the channel, escaped for the output.
+    textfields = ()
+    # Class attributes available to the templates.
+    classfields = ('itemtype', 'starthtml', 'endhtml', 'startrst', 'endrst',
+                   'starttext', 'endtext', 'startmw', 'endmw',
+                   'startmoin', 'endmoin')
+    # The replacements given to the Template writer.
+    templatefields = ('itemtype', 'line', 'topic', 'url', 'url_quoteescaped',
+                      'nick', 'time', 'link', 'anchor')
     itemtype = None
     starthtml = ''
     endhtml = ''
@@ -61,42 +77,50 @@ class _BaseItem(object):
     endmw = ''
     startmoin = ''
     endmoin = ''
+    def __init__(self, nick, line, linenum, time_):
+        self.nick = nick; self.linenum = int(linenum)
+        self.minute = time_.tm_hour*60 + time_.tm_min
+    @property
+    def time(self):
+        return '%02d:%02d' % divmod(self.minute, 60)
+    @classmethod
+    def _classReplacements(cls):
+        try:
+            return _classFields[cls]
+        except KeyError:
+            repl = _classFields[cls] = dict(
+                (name, getattr(cls, name)) for name in cls.classfields)
+            return repl
     def get_replacements(self, M, escapewith):
-        replacements = { }
-        for name in dir(self):
-            if name[0] == "_": continue
-            replacements[name] = getattr(self, name)
-        replacements['nick'] = escapewith(replacements['nick'])
+        replacements = self._classReplacements().copy()
+        replacements['nick'] = escapewith(self.nick)
+        replacements['linenum'] = self.linenum
+        replacements['time'] = self.time
+        replacements['anchor'] = self.anchor
         replacements['link'] = self.logURL(M)
-        if 'line' in replacements:
-            replacements['line'] = escapewith(replacements['line'])
-        if 'topic' in replacements:
-            replacements['topic'] = escapewith(replacements['topic'])
-        if 'url' in replacements:
-            replacements['url_quoteescaped'] = \
-                                    escapewith(self.url.replace('"', "%22"))
+        for name in self.textfields:
+            replacements[name] = escapewith(getattr(self, name))
         return replacements
     def template(self, M, escapewith):
-        template = { }
-        for k, v in list(self.get_replacements(M, escapewith).items()):
-            if k not in ('itemtype', 'line', 'topic',
-                         'url', 'url_quoteescaped',
-                         'nick', 'time', 'link', 'anchor'):
-                continue
-            template[k] = v
-        return template
-    def makeRSTref(self, M):
+        replacements = self.get_replacements(M, escapewith)
+        return dict((k, replacements[k]) for k in self.templatefields
+                    if k in replacements)
+    def makeRSTref(self, M, rst_refs, rst_urls):
+        """Make a unique reST reference to this item.
+
+        `rst_refs` (references used so far) and `rst_urls` (their
+        targets) belong to the ReST output being formatted."""
         if self.nick[-1] == '_':
             rstref = rstref_orig = "%s%s"%(self.nick, self.time)
         else:
             rstref = rstref_orig = "%s-%s"%(self.nick, self.time)
         count = 0
-        while rstref in M.rst_refs:
+        while rstref in rst_refs:
             rstref = rstref_orig + inbase(count)
             count += 1
         link = self.logURL(M)
-        M.rst_urls.append(".. _%s: %s"%(rstref, link+"#"+self.anchor))
-        M.rst_refs[rstref] = True
+        rst_urls.append(".. _%s: %s"%(rstref, link+"#"+self.anchor))
+        rst_refs[rstref] = True
         return rstref
     @property
     def anchor(self):
@@ -128,9 +152,11 @@ class Topic(_BaseItem):
     endhtml = '</b>'
     startmoin = '=== '
     endmoin = ' ==='
+    __slots__ = ('topic',)
+    textfields = ('topic',)
     def __init__(self, nick, line, linenum, time_):
-        self.nick = nick; self.topic = line; self.linenum = linenum
-        self.time = time.strftime("%H:%M", time_)
+        _BaseItem.__init__(self, nick, line, linenum, time_)
+        self.topic = line
     def _htmlrepl(self, M):
         repl = self.get_replacements(M, escapewith=writers.html)
         repl['link'] = self.logURL(M)
@@ -139,9 +165,9 @@ class Topic(_BaseItem):
         return self.html_template%self._htmlrepl(M)
     def html2(self, M):
         return self.html2_template%self._htmlrepl(M)
-    def rst(self, M):
-        self.rstref = self.makeRSTref(M)
+    def rst(self, M, rst_refs, rst_urls):
         repl = self.get_replacements(M, escapewith=writers.rst)
+        repl['rstref'] = self.makeRSTref(M, rst_refs, rst_urls)
         if repl['topic'] == '': repl['topic'] = ' '
         repl['link'] = self.logURL(M)
         return self.rst_template%repl
@@ -158,6 +184,7 @@ class Topic(_BaseItem):
 
 
 class Subtopic(Topic):
+    __slots__ = ()
     itemtype = 'SUBTOPIC'
     moin_template = """%(startmoin)s%(topic)s%(endmoin)s  (%(nick)s, %(time)s)"""
     starthtml = '<b class="SUBTOPIC">'
@@ -184,9 +211,11 @@ class GenericItem(_BaseItem):
     text_template = """%(itemtype)s: %(starttext)s%(line)s%(endtext)s  (%(nick)s, %(time)s)"""
     mw_template = """''%(itemtype)s:'' %(startmw)s%(line)s%(endmw)s  (%(nick)s, %(time)s)"""
     moin_template = """''%(itemtype)s:'' %(startmoin)s%(line)s%(endmoin)s  (%(nick)s, %(time)s)"""
+    __slots__ = ('line',)
+    textfields = ('line',)
     def __init__(self, nick, line, linenum, time_):
-        self.nick = nick; self.line = line; self.linenum = linenum
-        self.time = time.strftime("%H:%M", time_)
+        _BaseItem.__init__(self, nick, line, linenum, time_)
+        self.line = line
     def _htmlrepl(self, M):
         repl = self.get_replacements(M, escapewith=writers.html)
         repl['link'] = self.logURL(M)
@@ -195,9 +224,9 @@ class GenericItem(_BaseItem):
         return self.html_template%self._htmlrepl(M)
     def html2(self, M):
         return self.html2_template%self._htmlrepl(M)
-    def rst(self, M):
-        self.rstref = self.makeRSTref(M)
+    def rst(self, M, rst_refs, rst_urls):
         repl = self.get_replacements(M, escapewith=writers.rst)
+        repl['rstref'] = self.makeRSTref(M, rst_refs, rst_urls)
         repl['link'] = self.logURL(M)
         return self.rst_template%repl
     def text(self, M):
@@ -213,6 +242,7 @@ class GenericItem(_BaseItem):
 
 
 class Info(GenericItem):
+    __slots__ = ()
     itemtype = 'INFO'
     html2_template = ("""<span class="%(itemtype)s">"""
                       """%(starthtml)s%(line)s%(endhtml)s</span> """
@@ -225,22 +255,30 @@ class Info(GenericItem):
     mw_template = """%(startmw)s%(line)s%(endmw)s  (%(nick)s, %(time)s)"""
     moin_template = """%(startmoin)s%(line)s%(endmoin)s  (%(nick)s, %(time)s)"""
 class Idea(GenericItem):
+    __slots__ = ()
     itemtype = 'IDEA'
 class Agreed(GenericItem):
+    __slots__ = ()
     itemtype = 'AGREED'
 class Action(GenericItem):
+    __slots__ = ()
     itemtype = 'ACTION'
 class Help(GenericItem):
+    __slots__ = ()
     itemtype = 'HELP'
 class Done(GenericItem):
+    __slots__ = ()
     itemtype = 'DONE'
 class Vote(GenericItem):
+    __slots__ = ()
     itemtype = 'VOTE'
 class Accepted(GenericItem):
+    __slots__ = ()
     itemtype = 'ACCEPTED'
     starthtml = '<font color="green">'
     endhtml = '</font>'
 class Rejected(GenericItem):
+    __slots__ = ()
     itemtype = 'REJECTED'
     starthtml = '<font color="red">'
     endhtml = '</font>'
@@ -264,13 +302,23 @@ class Link(_BaseItem):
     text_template = """%(itemtype)s: %(starttext)s%(url)s %(line)s%(endtext)s  (%(nick)s, %(time)s)"""
     mw_template = """''%(itemtype)s:'' %(startmw)s%(url)s %(line)s%(endmw)s  (%(nick)s, %(time)s)"""
     moin_template = """''%(itemtype)s:'' %(startmoin)s%(url)s %(line)s%(endmoin)s  (%(nick)s, %(time)s)"""
+    __slots__ = ('url', 'line')
+    textfields = ('line',)
     def __init__(self, nick, line, linenum, time_):
-        self.nick = nick; self.linenum = linenum
-        self.time = time.strftime("%H:%M", time_)
+        _BaseItem.__init__(self, nick, line, linenum, time_)
         self.url, self.line = (line+' ').split(' ', 1)
-        # URL sanitization
-        self.url_readable = self.url # readable line version
         self.line = self.line.rstrip()
+    @property
+    def url_readable(self):
+        # readable line version
+        return self.url
+    def get_replacements(self, M, escapewith):
+        replacements = _BaseItem.get_replacements(self, M, escapewith)
+        replacements['url'] = self.url
+        replacements['url_readable'] = self.url_readable
+        replacements['url_quoteescaped'] = \
+                                escapewith(self.url.replace('"', "%22"))
+        return replacements
     def _htmlrepl(self, M):
         repl = self.get_replacements(M, escapewith=writers.html)
         # special: replace doublequote only for the URL.
@@ -282,9 +330,9 @@ class Link(_BaseItem):
         return self.html_template%self._htmlrepl(M)
     def html2(self, M):
         return self.html2_template%self._htmlrepl(M)
-    def rst(self, M):
-        self.rstref = self.makeRSTref(M)
+    def rst(self, M, rst_refs, rst_urls):
         repl = self.get_replacements(M, escapewith=writers.rst)
+        repl['rstref'] = self.makeRSTref(M, rst_refs, rst_urls)
         repl['link'] = self.logURL(M)
         #repl['url'] = writers.rst(self.url)
         return self.rst_template%repl
@@ -0,0 +1,229 @@
+###
+# Copyright (c) 2009, Richard Darst
+# Copyright (c) 2018, Krytarik Raido
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""Crash-safe journal of the meetings in progress.
+
+The minutes only exist in memory until the meeting is saved, so a
+crash or restart of the bot in the middle of a meeting would lose
+them.  To avoid that, everything that goes into a Meeting (lines said
+in the channel, the bot's own lines, private votes, chairs added by
+the admin) is first appended to a journal file, one JSON list per
+line.  When the bot starts again, restore() feeds the same input to a
+new Meeting to rebuild it.  The IRC callbacks (replies, topic) are
+not attached during this replay, and nothing is saved, so it has no
+side effects.
+
+Each record is written to the OS straight away, which is enough to
+survive the bot crashing.  fsync(), which is needed to also survive
+the machine crashing, is done at most once per `syncInterval`
+seconds.
+"""
+
+import os, time
+import json
+import urllib.parse
+import supybot.log as supylog
+
+from . import meeting
+
+# Journal file format version, recorded in the start record.
+VERSION = 1
+EXTENSION = '.journal'
+
+def journalFilename(directory, channel, network):
+    """Return the journal filename for the meeting on (channel, network)."""
+    return os.path.join(directory, "%s.%s%s" % (
+        urllib.parse.quote(network, safe=''),
+        urllib.parse.quote(channel, safe=''), EXTENSION))
+
+def listJournals(directory):
+    """Return the journal files in directory."""
+    if not os.path.isdir(directory):
+        return [ ]
+    return sorted(os.path.join(directory, name)
+                  for name in os.listdir(directory)
+                  if name.endswith(EXTENSION))
+
+
+class Journal(object):
+    """The append-only journal of one meeting."""
+    def __init__(self, filename, syncInterval=1.0, scheduleEvent=None):
+        self.filename = filename
+        self.syncInterval = syncInterval
+        self._scheduleEvent = scheduleEvent
+        self._f = open(filename, 'ab')
+        self.lastSync = time.time()
+        self.pending = False
+        self.records = 0
+        self.syncs = 0
+
+    @classmethod
+    def create(cls, directory, M, **kwargs):
+        """Start a new journal for the meeting M, in directory."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filename = journalFilename(directory, M.channel, M.network)
+        # An old journal of this channel is of a meeting which is
+        # over (or which was not restored), so start over.
+        open(filename, 'wb').close()
+        self = cls(filename, **kwargs)
+        starttime = getattr(M, 'starttime', None)
+        self.record('start', {
+            'version': VERSION,
+            'channel': M.channel,
+            'network': M.network,
+            'owner': M.owner,
+            'botIsOp': M.botIsOp,
+            'oldtopic': M.oldtopic,
+            'starttime': starttime and M.timeZone.timestamp(starttime),
+            'filename': getattr(M, '_filename', None),
+            })
+        self.sync()
+        return self
+
+    def record(self, *event):
+        """Append an event to the journal."""
+        if self._f is None:
+            return
+        try:
+            self._f.write(json.dumps(event, separators=(',', ':'))
+                          .encode('ascii') + b'\n')
+            self._f.flush()
+        except EnvironmentError:
+            # A full disk shouldn't stop the meeting, only its journal.
+            supylog.exception("MeetBot: can't write to the journal %s, "
+                              "closing it" % self.filename)
+            self.close()
+            return
+        self.records += 1
+        now = time.time()
+        if now >= self.lastSync + self.syncInterval:
+            self.sync()
+        elif not self.pending and self._scheduleEvent is not None:
+            self.pending = True
+            self._scheduleEvent(self._delayedSync,
+                                self.lastSync + self.syncInterval)
+
+    def _delayedSync(self):
+        self.pending = False
+        self.sync()
+
+    def sync(self):
+        """fsync() the journal."""
+        if self._f is None:
+            return
+        try:
+            os.fsync(self._f.fileno())
+        except EnvironmentError:
+            supylog.exception("MeetBot: can't sync the journal %s"
+                              % self.filename)
+        self.lastSync = time.time()
+        self.syncs += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def remove(self):
+        """The meeting is saved (or aborted): delete the journal."""
+        self.close()
+        try:
+            os.unlink(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+def load(filename):
+    """Return the list of events in a journal file.
+
+    A record cut short by a crash ends the journal; it is removed from
+    the file, so that new records can be appended after it."""
+    events = [ ]
+    good = 0
+    with open(filename, 'rb') as f:
+        data = f.read()
+    for line in data.split(b'\n')[:-1]:
+        try:
+            events.append(json.loads(line.decode('ascii')))
+        except ValueError:
+            break
+        good += len(line) + 1
+    if good < len(data):
+        with open(filename, 'r+b') as f:
+            f.truncate(good)
+    return events
+
+def restore(filename, syncInterval=1.0, scheduleEvent=None, **kwargs):
+    """Rebuild the Meeting journaled in filename.
+
+    Returns None if the journal doesn't hold a meeting.  The journal
+    is attached to the new meeting, to keep recording.  kwargs are
+    passed on to Meeting(), except that the IRC callbacks given are
+    only attached once the meeting is rebuilt."""
+    events = load(filename)
+    if not events or events[0][0] != 'start' or \
+            events[0][1].get('version') != VERSION:
+        return None
+    callbacks = { }
+    for name in ('setTopic', 'sendReply', 'sendPrivateReply',
+                 'channelNicks'):
+        if kwargs.get(name) is not None:
+            callbacks['_'+name] = kwargs.pop(name)
+    info = events[0][1]
+    M = meeting.Meeting(channel=info['channel'], network=info['network'],
+                        owner=info['owner'], botIsOp=info['botIsOp'],
+                        oldtopic=info['oldtopic'],
+                        filename=info['filename'],
+                        scheduleEvent=scheduleEvent, **kwargs)
+    if info['starttime'] is not None:
+        M.starttime = M.timeZone.localtime(info['starttime'])
+    M._restoring = True
+    try:
+        for event in events[1:]:
+            kind, args = event[0], event[1:]
+            if kind == 'line':
+                nick, line, isop, t = args
+                M.addline(nick, line, isop, time_=t)
+            elif kind == 'raw':
+                nick, line, t = args
+                M.addrawline(nick, line, time_=t)
+            elif kind == 'vote':
+                nick, line, t = args
+                M.doCastVote(nick, line, t, private=True)
+            elif kind == 'chair':
+                M.addchair(args[0])
+    finally:
+        M._restoring = False
+    for name, callback in callbacks.items():
+        setattr(M, name, callback)
+    M.journal = Journal(filename, syncInterval=syncInterval,
+                        scheduleEvent=scheduleEvent)
+    return M
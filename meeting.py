@@ -30,6 +30,17 @@
 
 import os, sys, re
 import time, stat
+import array
+import io
+import datetime
+import zoneinfo
+import tempfile
+import hashlib
+import codecs
+import itertools
+import copy
+import functools
+import concurrent.futures
 import supybot.utils as utils
 import supybot.log as supylog
 
@@ -64,6 +75,10 @@ class Config(object):
     UrlProtocols = ['http:', 'https:', 'irc:', 'ftp:', 'mailto:', 'ssh:']
     # Regular expression for parsing commands.
     command_RE = re.compile(r'^#(\w+)(?:\s+(.*?)|)\s*$')
+    # More #commands, by name.  Each is a function taking the same
+    # arguments as the do_* methods of MeetingCommands, the meeting
+    # first; set its chairOnly attribute to True to keep it for chairs.
+    extraCommands = { }
     # Regular expressions for parsing loglines.
     logline_RE = re.compile(r'^\[?([0-9:]+)\]?\s*<[@%&+ ]?([^>]+)>\s*(.*?)\s*$')
     loglineAction_RE = re.compile(r'^\[?([0-9:]+)\]?\s*\*\s*(\S+)\s*(.*?)\s*$')
@@ -73,8 +88,8 @@ class Config(object):
     # HTML irc log highlighting style.  `pygmentize -L styles` to list.
     pygmentizeStyle = 'friendly'
     # Timezone setting.  You can use friendly names like 'US/Eastern', etc.
-    # Check /usr/share/zoneinfo/ or `man timezone`; this is the content
-    # of the TZ environment variable.
+    # Check /usr/share/zoneinfo/ or `man timezone`.  Each meeting keeps
+    # its own; the TZ of the bot process is left alone.
     timeZone = 'UTC'
     # These are the start and end meeting messages, respectively.
     # Some replacements are done before they are used, using the
@@ -107,13 +122,38 @@ class Config(object):
         return text
     # Write out select logfiles
     update_realtime = True
+    # Realtime updates are coalesced: the select logfiles are written
+    # at most once per this many seconds (0 writes on every line).
+    realtimeSaveInterval = 5
     # CSS configs
     cssFile_log      = 'default'
     cssEmbed_log     = True
     cssFile_minutes  = 'default'
     cssEmbed_minutes = True
+    # Write embedded stylesheets once, to logFileDir, and link to them
+    cssAssets = False
     # Include full log in MoinMoin output
     moinFullLogs = True
+    # Seconds the ReST to HTML conversion (HTMLfromReST) may take, in
+    # a worker process.  0 runs it in the bot, without a limit.
+    rstTimeout = 0
+    # Seconds to wait for the web server when #replay fetches a log.
+    replayTimeout = 60
+    # How the writers are run on full saves: 'serial' or 'thread' (a
+    # thread pool).
+    renderMode = 'serial'
+    # Number of threads used, 0 means one per CPU.
+    renderWorkers = 0
+    # Where meetings in progress are journaled, so that they can be
+    # restored if the bot crashes.  '' means the MeetBot directory in
+    # the Supybot data directory, 'none' turns the journal off.
+    journalDir = ''
+    # The journal is fsync()ed at most once per this many seconds.
+    journalSyncInterval = 1.0
+    # How hard to try to get the outputs to disk: 'none' (leave it to
+    # the OS), 'file' (fsync each file and its directory) or 'batch'
+    # (fsync each file, and each directory once per save).
+    writeDurability = 'none'
 
     # This tells which writers write out which to extensions.
     writer_map = {
@@ -132,10 +172,27 @@ class Config(object):
         self.M = M
         self.writeRawLog = writeRawLog
         self.safeMode = safeMode
+        # extension -> (append handle, filename, position written)
+        self._appendState = {}
+        # writers.RenderContext of the save in progress, if any
+        self._renderContext = None
+        # directories to fsync at the end of the save
+        self._unsyncedDirs = set()
+        # filename -> fingerprint of what was last written to it
+        self._fingerprints = {}
+        # extension -> (inputsVersion, text) of the last render
+        self._renderCache = {}
+        self.writes = 0
+        self.writesSkipped = 0
+        self.bytesWritten = 0
         # Update config values with anything we may have
         for k, v in list(extraConfig.items()):
             setattr(self, k, v)
 
+    def refresh(self):
+        """Take the settings which come from outside of this class
+        again (see config.SupybotConfigProxy).  There are none here."""
+
     def setWriters(self):
         self.writers = {}
         if self.writeRawLog:
@@ -144,6 +201,11 @@ class Config(object):
             self.writers[extension] = writer(self.M)
 
     def filename(self, url=False):
+        # During a save, use the names worked out at its start.
+        if self._renderContext is not None:
+            if url:
+                return self._renderContext.urlBasename
+            return self._renderContext.filename
         # provide a way to override the filename.  If it is
         # overridden, it must be a full path (and the URL-part may not
         # work.):
@@ -177,17 +239,43 @@ class Config(object):
 
     @property
     def basename(self):
+        if self._renderContext is not None:
+            return self._renderContext.basename
         return os.path.basename(self.M.config.filename())
 
-    def save(self, realtime_update=False):
+    def save(self, realtime_update=False, texts=True):
         """Write all output files.
 
         If `realtime_update` is true, then this isn't a complete save,
         it will only update those writers with the realtime_update
-        attribute true."""
+        attribute true.
+
+        Returns the outputs by extension.  If `texts` is false, the
+        caller doesn't need them, and the outputs of streaming writers
+        are written to their file piece by piece, as they are
+        rendered: their entry is then the name of the file."""
         if realtime_update and not hasattr(self.M, 'starttime'):
             return
-        rawname = self.filename()
+        # Nothing is written while a meeting is restored from its
+        # journal: the files are already there.
+        if self.M._restoring:
+            return {}
+        # A bulk replay saves once, when all its lines are in.
+        if self.M._bulkReplay:
+            return {}
+        # A full save writes everything a pending realtime update would.
+        if not realtime_update:
+            self.M.realtimeSaver.clear()
+        # Everything the writers share is worked out once, in the
+        # render context, instead of once per writer.
+        self._renderContext = writers.RenderContext(self.M)
+        try:
+            return self._save(realtime_update, texts)
+        finally:
+            self._renderContext = None
+
+    def _save(self, realtime_update, texts):
+        rawname = self._renderContext.filename
         # We want to write the rawlog (.log.txt) first in case the
         # other methods break.  That way, we have saved enough to
         # replay.
@@ -195,6 +283,8 @@ class Config(object):
             self.setWriters()
         writer_names = list(self.writers.keys())
         results = {}
+        outputs = [ ]
+        jobs = [ ]
         if '.log.txt' in writer_names:
             writer_names.remove('.log.txt')
             writer_names.insert(0, '.log.txt')
@@ -216,36 +306,660 @@ class Config(object):
             else:
                 args = {}
 
-            text = writer.format(extension, **args)
-            results[extension] = text
-            # If the writer returns a string or unicode object, then
-            # we should write it to a filename with that extension.
-            # If it doesn't, then it's assumed that the write took
-            # care of writing (or publishing or emailing or wikifying)
-            # it itself.
-            if isinstance(text, str) or \
-                    (sys.version_info < (3,0) and isinstance(text, unicode)):
-                # Have a way to override saving, so no disk files are written.
-                if getattr(self, "dontSave", False):
+            # Append-only outputs (the raw log) only get the new
+            # lines appended on realtime updates, instead of having
+            # the whole file rewritten for every line said.
+            if getattr(writer, 'update_append', False) and \
+                    not getattr(self, "dontSave", False):
+                results[extension] = self.appendOutput(
+                    writer, extension, rawname+extension, realtime_update,
+                    texts)
+                continue
+            # Streaming writers write their output to the file as
+            # they render it, when the caller doesn't want the text.
+            stream = (not texts and getattr(writer, 'streaming', False)
+                      and not getattr(self, "dontSave", False))
+            # Outputs whose inputs haven't changed since they were
+            # last rendered are not rendered again.  Streamed outputs
+            # are cached without their text: the file has it.
+            inputs = self.inputsVersion(writer, extension, args)
+            cached = self._renderCache.get(extension)
+            if cached is not None and cached[0] == inputs:
+                if cached[1] is not None:
+                    outputs.append((writer, extension, args, inputs,
+                                    False, cached[1]))
+                    continue
+                if stream and self.isCurrent(rawname+extension):
+                    self.writesSkipped += 1
+                    results[extension] = rawname+extension
+                    continue
+            outputs.append((writer, extension, args, inputs, stream, None))
+            if not stream:
+                jobs.append((writer, extension, args))
+
+        rendered = self.renderWriters(jobs, realtime_update)
+        try:
+            for writer, extension, args, inputs, stream, text in outputs:
+                if stream:
+                    # Written out here, while the other jobs render.
+                    filename = rawname+extension
+                    self.writeChunks(writer.iterformat(extension, **args),
+                                     filename)
+                    self._renderCache[extension] = (inputs, None)
+                    results[extension] = filename
                     continue
-                self.writeToFile(self.enc(text), rawname+extension)
+                if text is None:
+                    text = next(rendered)
+                    if isinstance(text, str):
+                        self._renderCache[extension] = (inputs, text)
+                results[extension] = text
+                # If the writer returns a string or unicode object, then
+                # we should write it to a filename with that extension.
+                # If it doesn't, then it's assumed that the write took
+                # care of writing (or publishing or emailing or wikifying)
+                # it itself.
+                if isinstance(text, str) or \
+                        (sys.version_info < (3,0) and isinstance(text, unicode)):
+                    # Have a way to override saving, so no disk files are written.
+                    if getattr(self, "dontSave", False):
+                        continue
+                    self.writeToFile(self.enc(text), rawname+extension)
+        finally:
+            rendered.close()
+            self.syncDirectories()
         return results
 
-    def writeToFile(self, string, filename):
-        """Write a given string to a file."""
+    def inputsVersion(self, writer, extension=None, args={}):
+        """Return the versions of everything the output of writer
+        depends on.
+
+        Writers list the parts of Meeting.versions they use in their
+        `depends` attribute; writers without it depend on everything.
+        All of them depend on the settings, and on the files listed by
+        their inputFiles() method.  The output can only have changed
+        if this has."""
+        M = self.M
+        depends = getattr(writer, 'depends', None) or sorted(M.versions)
+        version = tuple([M.versions[part] for part in depends])
+        version += (self._renderContext.configVersion,)
+        inputFiles = getattr(writer, 'inputFiles', None)
+        if inputFiles is not None:
+            version += tuple([fileVersion(filename) for filename
+                              in inputFiles(extension, **args)])
+        if 'meta' in depends:
+            version += (getattr(M, 'starttime', None),
+                        getattr(M, 'endtime', None),
+                        self._renderContext.filename,
+                        self._renderContext.urlBasename)
+        return version
+
+    def configVersion(self):
+        """Return the values of the settings, the public data
+        attributes of Config.
+
+        They are looked up on this config, so values set on it, or
+        taken from the Supybot registry, are the ones used."""
+        return tuple([copy.copy(getattr(self, attrname))
+                      for attrname in settingNames(Config)])
+
+    def renderWriters(self, jobs, realtime_update=False):
+        """Format the (writer, extension, args) jobs, yielding the
+        results in order.
+
+        Full saves run the writers concurrently if `renderMode` says
+        so.  The results are the same as in serial mode either way,
+        and still come in order, so outputs get written as soon as
+        the ones before them are done."""
+        if realtime_update or len(jobs) < 2 or self.renderMode != 'thread':
+            for writer, extension, args in jobs:
+                yield writer.format(extension, **args)
+            return
+        workers = min(self.renderWorkers or os.cpu_count() or 1, len(jobs))
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+        futures = [executor.submit(writer.format, extension, **args)
+                   for writer, extension, args in jobs]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+    def encode(self, string):
+        """Return string as bytes in the output codec."""
+        if isinstance(string, bytes):
+            return string
+        return string.encode(self.output_codec, 'replace')
+
+    def writeToFile(self, string, filename, restrict=None):
+        """Write a given string to a file.
+
+        The string is written to a temporary file, which is then
+        renamed to filename, so that the file is never seen half
+        written (by a web server, or after a crash).  Nothing is
+        written if the file already has this content.
+
+        The file has restricted permissions if `restrict` is true, or
+        if it is None (the default) and the meeting is #restrictlogs."""
         # The reason we have this method just for this is to proxy
         # through the _restrictPermissions logic.
-        f = open(filename, 'w')
-        if self.M._restrictlogs:
-            self.restrictPermissions(f)
-        f.write(string)
-        f.close()
+        if restrict is None:
+            restrict = self.M._restrictlogs
+        data = self.encode(string)
+        fingerprint = (len(data), hashlib.sha1(data).digest(), restrict)
+        if self._fingerprints.get(filename) == fingerprint and \
+                os.path.exists(filename):
+            self.writesSkipped += 1
+            return
+        tmpname = self.writeTemporary(filename, (data,), restrict)
+        self.replaceFile(tmpname, filename, fingerprint)
+
+    def writeChunks(self, chunks, filename):
+        """Write the text chunks to a file, as they come.
+
+        Like writeToFile(), but the whole text is never held in
+        memory: chunks are encoded and written to the temporary file
+        one by one.  If the file turns out to already have this
+        content, the temporary file is dropped."""
+        encoder = codecs.getincrementalencoder(self.output_codec)('replace')
+        digest = hashlib.sha1()
+        size = 0
+        def encoded():
+            nonlocal size
+            for chunk in chunks:
+                data = encoder.encode(chunk)
+                digest.update(data)
+                size += len(data)
+                yield data
+            data = encoder.encode('', True)
+            digest.update(data)
+            size += len(data)
+            yield data
+        tmpname = self.writeTemporary(filename, encoded())
+        fingerprint = (size, digest.digest(), self.M._restrictlogs)
+        if self._fingerprints.get(filename) == fingerprint and \
+                os.path.exists(filename):
+            os.unlink(tmpname)
+            self.writesSkipped += 1
+            return
+        self.replaceFile(tmpname, filename, fingerprint)
+
+    def isCurrent(self, filename):
+        """Return whether filename is as last written by this Config,
+        permissions included."""
+        fingerprint = self._fingerprints.get(filename)
+        return (fingerprint is not None and
+                fingerprint[2] == self.M._restrictlogs and
+                os.path.exists(filename))
+
+    def writeTemporary(self, filename, chunks, restrict=None):
+        """Write the bytes chunks to a new temporary file next to
+        filename, returning its name.  `restrict` is as for
+        writeToFile()."""
+        if restrict is None:
+            restrict = self.M._restrictlogs
+        dirname = os.path.dirname(filename) or '.'
+        # Keep the mode of the file we replace, like writing to it
+        # would, or the mode a new file would get.
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_umask
+        fd, tmpname = tempfile.mkstemp(
+            dir=dirname, prefix='.'+os.path.basename(filename)+'.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.chmod(tmpname, mode)
+                for data in chunks:
+                    f.write(data)
+                if restrict:
+                    self.restrictPermissions(f, tmpname)
+                if self.writeDurability in ('file', 'batch'):
+                    f.flush()
+                    os.fsync(f.fileno())
+        except:
+            os.unlink(tmpname)
+            raise
+        return tmpname
+
+    def replaceFile(self, tmpname, filename, fingerprint):
+        """Rename the temporary file tmpname over filename."""
+        try:
+            os.replace(tmpname, filename)
+        except:
+            os.unlink(tmpname)
+            raise
+        self._fingerprints[filename] = fingerprint
+        self.writes += 1
+        self.bytesWritten += fingerprint[0]
+        dirname = os.path.dirname(filename) or '.'
+        if self.writeDurability == 'file':
+            fsyncDirectory(dirname)
+        elif self.writeDurability == 'batch':
+            self._unsyncedDirs.add(dirname)
+
+    def syncDirectories(self):
+        """fsync the directories written to by this save ('batch'
+        writeDurability)."""
+        while self._unsyncedDirs:
+            fsyncDirectory(self._unsyncedDirs.pop())
+
+    def appendOutput(self, writer, extension, filename, realtime_update,
+                     texts=True):
+        """Write an append-only output, returning the text written.
+
+        The whole output is written on full saves, and whenever the
+        filename has changed (#meetingname).  On realtime updates,
+        only the part added since the last write is appended, through
+        an append handle kept open for the rest of the meeting.
+
+        Whole outputs of streaming writers are written out piece by
+        piece if `texts` is false, the filename being returned."""
+        f, oldname, position = self._appendState.get(extension,
+                                                     (None, None, 0))
+        if realtime_update and oldname == filename:
+            text, position = writer.formatAppend(position)
+            if text:
+                if f is None:
+                    f = open(filename, 'ab')
+                    if self.M._restrictlogs:
+                        self.restrictPermissions(f)
+                data = self.encode(text)
+                f.write(data)
+                f.flush()
+                self._fingerprints.pop(filename, None)
+                self.writes += 1
+                self.bytesWritten += len(data)
+                if self.writeDurability in ('file', 'batch'):
+                    os.fsync(f.fileno())
+        else:
+            if f is not None:
+                f.close()
+                f = None
+            if texts or not getattr(writer, 'streaming', False):
+                text, position = writer.formatAppend(0)
+                self.writeToFile(self.enc(text), filename)
+            else:
+                chunks, position = writer.iterformatAppend(0)
+                self.writeChunks(chunks, filename)
+                text = filename
+        self._appendState[extension] = (f, filename, position)
+        return text
 
-    def restrictPermissions(self, f):
+    def writeStats(self):
+        """Return a one-line summary of the file writes."""
+        return "%d files written (%d bytes), %d unchanged skipped" % (
+            self.writes, self.bytesWritten, self.writesSkipped)
+
+    def closeAppendFiles(self):
+        """Close any append handles left open by realtime updates."""
+        for extension, (f, filename, position) in \
+                list(self._appendState.items()):
+            if f is not None:
+                f.close()
+            self._appendState[extension] = (None, filename, position)
+
+    def restrictPermissions(self, f, filename=None):
         """Remove the permissions given in the variable RestrictPerm."""
         f.flush()
-        newmode = os.stat(f.name).st_mode & (~self.RestrictPerm)
-        os.chmod(f.name, newmode)
+        filename = filename or f.name
+        newmode = os.stat(filename).st_mode & (~self.RestrictPerm)
+        os.chmod(filename, newmode)
+
+
+class TimeZone(object):
+    """The local time of a timezone, for epoch seconds.
+
+    Meetings keep their times as epoch seconds, and convert them with
+    one of these rather than with the process-wide TZ, so meetings in
+    different timezones can run at once.  Conversions are cached by
+    (timezone, minute), since a meeting has many lines a minute.
+    """
+    # (timezone name, epoch minute) -> (struct_time, minute of the day),
+    # or None if the offset of the timezone is not whole minutes then
+    _minutes = { }
+    maxCached = 4096
+
+    def __init__(self, name):
+        self.name = name
+        try:
+            self.zone = zoneinfo.ZoneInfo(name)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            supylog.warning("Unknown timeZone %r, using UTC" % name)
+            self.zone = datetime.timezone.utc
+
+    def _minute(self, t):
+        key = (self.name, int(t // 60))
+        try:
+            return self._minutes[key]
+        except KeyError:
+            pass
+        if len(self._minutes) >= self.maxCached:
+            self._minutes.clear()
+        tm = datetime.datetime.fromtimestamp(key[1]*60, self.zone).timetuple()
+        # Offsets of old local mean times (as in the 1900 dates of
+        # replayed logs) are not whole minutes: the local minutes
+        # don't start with the epoch ones.
+        if tm.tm_sec:
+            entry = None
+        else:
+            entry = (tm, tm.tm_hour*60 + tm.tm_min)
+        self._minutes[key] = entry
+        return entry
+
+    def minute(self, t):
+        """Return the minute of the day of epoch seconds t."""
+        entry = self._minute(t)
+        if entry is None:
+            tm = self.localtime(t)
+            return tm.tm_hour*60 + tm.tm_min
+        return entry[1]
+
+    def localtime(self, t=None):
+        """Return the struct_time of epoch seconds t (default: now)."""
+        if t is None:
+            t = time.time()
+        entry = self._minute(t)
+        if entry is None:
+            return datetime.datetime.fromtimestamp(t, self.zone).timetuple()
+        tm = entry[0]
+        seconds = int(t % 60)
+        if not seconds:
+            return tm
+        return time.struct_time(tm[:5] + (seconds,) + tm[6:])
+
+    def timestamp(self, tm):
+        """Return the epoch seconds of struct_time tm, taken as a time
+        in this timezone."""
+        return datetime.datetime(*tm[:6], tzinfo=self.zone).timestamp()
+
+
+class LineStore(object):
+    """The log of a meeting, kept as columns.
+
+    Each line is stored as its minute of the day, the id of its nick
+    (nicks are only stored once), its text and whether it is an
+    ACTION.  Writers can get these fields with record(); indexing and
+    iterating give the lines in their text form, "HH:MM <nick> text"
+    or "HH:MM * nick text", which is only built when asked for.
+    """
+    def __init__(self):
+        self.minutes = array.array('H')
+        self.nickIds = array.array('I')
+        self.texts = [ ]
+        self.actions = bytearray()
+        self.nicks = [ ]
+        self._nickIds = { }
+
+    def append(self, minute, nick, text, action=False):
+        """Add a line said by nick at minute (of the day)."""
+        nickId = self._nickIds.get(nick)
+        if nickId is None:
+            nickId = self._nickIds[nick] = len(self.nicks)
+            self.nicks.append(nick)
+        self.minutes.append(minute)
+        self.nickIds.append(nickId)
+        self.texts.append(text)
+        self.actions.append(action)
+
+    def record(self, i):
+        """Return the (minute, nick, text, action) fields of line i."""
+        return (self.minutes[i], self.nicks[self.nickIds[i]],
+                self.texts[i], bool(self.actions[i]))
+
+    def records(self, start=0):
+        """Iterate over the fields of the lines from index start on."""
+        nicks = self.nicks
+        for i in range(start, len(self.texts)):
+            yield (self.minutes[i], nicks[self.nickIds[i]],
+                   self.texts[i], bool(self.actions[i]))
+
+    @staticmethod
+    def formatLine(minute, nick, text, action):
+        """Return the text form of a line from its fields."""
+        if action:
+            return "%02d:%02d * %s %s" % (minute//60, minute%60, nick, text)
+        return "%02d:%02d <%s> %s" % (minute//60, minute%60, nick, text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self.formatLine(*self.record(j))
+                     for j in range(len(self))[i] ]
+        return self.formatLine(*self.record(i))
+
+    def __iter__(self):
+        for record in self.records():
+            yield self.formatLine(*record)
+
+    def __eq__(self, other):
+        if isinstance(other, LineStore):
+            return list(self.records()) == list(other.records())
+        return NotImplemented
+
+
+class VoteTally(object):
+    """One vote of a meeting: its ballots, and their running counts.
+
+    A ballot is +1, -1 or 0 (a line starting with +1, -1, 0, +0 or
+    -0).  Voting again changes a voter's ballot.  The counts are kept
+    up to date as ballots are cast, so the results are known at any
+    time without going over the ballots again."""
+    __slots__ = ('question', 'name', 'startLine', 'ballots', 'counts',
+                 'publicVoters', 'summary')
+    ballot_RE = re.compile(r'([+-]1|[+-]?0)\b')
+    # "#vote name: question" names a vote, for ballots to refer to.
+    name_RE = re.compile(r'^(\w[\w-]*):\s+\S')
+
+    def __init__(self, question, startLine):
+        self.question = question
+        m = self.name_RE.match(question)
+        self.name = m.group(1).lower() if m else None
+        # The number of lines before the vote, for linking to the log.
+        self.startLine = startLine
+        # nick -> ballot
+        self.ballots = { }
+        # The number of each ballot: counts[ballot], that is 0 (abstain),
+        # 1 (for) and -1 (against) in that order.
+        self.counts = [0, 0, 0]
+        # The nicks who voted in the channel, in order (the values are
+        # unused).
+        self.publicVoters = { }
+        # The result, once the vote is over.
+        self.summary = None
+
+    @classmethod
+    def parseBallot(cls, line):
+        """Return the ballot which line starts with, or None."""
+        m = cls.ballot_RE.match(line)
+        if m is None:
+            return None
+        return int(m.group(1))
+
+    def cast(self, nick, ballot, public=True):
+        """Count the ballot of nick, in place of their previous one."""
+        previous = self.ballots.get(nick)
+        if previous is not None:
+            self.counts[previous] -= 1
+        self.ballots[nick] = ballot
+        self.counts[ballot] += 1
+        if public:
+            self.publicVoters[nick] = None
+
+    @property
+    def votesFor(self):
+        return self.counts[1]
+    @property
+    def votesAgainst(self):
+        return self.counts[-1]
+    @property
+    def abstentions(self):
+        return self.counts[0]
+
+    def status(self):
+        return "Votes for: %d, Votes against: %d, Abstentions: %d" % (
+            self.votesFor, self.votesAgainst, self.abstentions)
+
+    def close(self, votesrequired):
+        """End the vote.  Returns the result: "Carried" or "Denied"."""
+        if self.votesFor - self.votesAgainst >= votesrequired:
+            result = "Carried"
+        else:
+            result = "Denied"
+        self.summary = "Motion %s (For: %d, Against: %d, Abstained: %d)" % (
+            result.lower(), self.votesFor, self.votesAgainst,
+            self.abstentions)
+        return result
+
+
+class RealtimeSaver(object):
+    """Coalesce the realtime updates of a meeting.
+
+    New lines only mark the meeting dirty.  The realtime writers are
+    then run at most once every `realtimeSaveInterval` seconds, either
+    on a later line or from a delayed event, if the meeting was given
+    a way to schedule one (`scheduleEvent`).  Full saves (#save,
+    #endmeeting) write everything, and so clear the pending update.
+    """
+    def __init__(self, M):
+        self.M = M
+        self.written = 0        # lines written out so far
+        self.firstDirty = None  # when the oldest pending line was seen
+        self.lastFlush = 0
+        self.pending = False    # is a delayed flush scheduled?
+        self.closed = False     # is the meeting gone?
+        # Statistics, for the savestats admin command.
+        self.flushes = 0
+        self.linesFlushed = 0
+        self.maxBatch = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+        self.totalFlushTime = 0.0
+
+    @property
+    def dirty(self):
+        """Number of lines not written out yet."""
+        return len(self.M.lines) - self.written
+
+    def markDirty(self):
+        """Note that lines were added, and flush if it is time to."""
+        if (self.closed or not self.dirty or self.M._restoring
+                or self.M._bulkReplay):
+            return
+        now = time.time()
+        if self.firstDirty is None:
+            self.firstDirty = now
+        nextFlush = self.lastFlush + self.M.config.realtimeSaveInterval
+        if now >= nextFlush:
+            self.flush()
+        elif not self.pending and \
+                getattr(self.M, '_scheduleEvent', None) is not None:
+            self.pending = True
+            self.M._scheduleEvent(self._delayedFlush, nextFlush)
+
+    def _delayedFlush(self):
+        self.pending = False
+        self.flush()
+
+    def flush(self):
+        """Run the realtime writers now, if any lines are pending."""
+        batch = self.dirty
+        if self.closed or not batch or not hasattr(self.M, 'starttime'):
+            return
+        firstDirty = self.firstDirty
+        start = time.time()
+        self.clear()
+        self.M.config.save(realtime_update=True, texts=False)
+        end = self.lastFlush = time.time()
+        self.flushes += 1
+        self.linesFlushed += batch
+        self.maxBatch = max(self.maxBatch, batch)
+        latency = end - (firstDirty or start)
+        self.totalLatency += latency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.totalFlushTime += end - start
+
+    def clear(self):
+        """Forget the pending lines (they are being written)."""
+        self.written = len(self.M.lines)
+        self.firstDirty = None
+
+    def close(self):
+        """The meeting is aborted or deleted: a delayed flush which is
+        still scheduled must not save it again."""
+        self.closed = True
+        self.clear()
+
+    def stats(self):
+        """Return a one-line summary of the flush statistics."""
+        if not self.flushes:
+            return "no flushes, %d lines pending" % self.dirty
+        return ("%d flushes, %.1f lines/flush (max %d), "
+                "latency %.0f ms avg (max %.0f ms), "
+                "%.1f ms/flush, %d lines pending" % (
+                    self.flushes, self.linesFlushed/float(self.flushes),
+                    self.maxBatch,
+                    1000*self.totalLatency/self.flushes,
+                    1000*self.maxLatency,
+                    1000*self.totalFlushTime/self.flushes, self.dirty))
+
+
+def _readUmask():
+    """Return the umask of the process from /proc, where reading it
+    doesn't change it, or None if it can't be read there."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (EnvironmentError, ValueError, IndexError):
+        pass
+    return None
+
+# The umask, for giving new files the mode open() would.  Without
+# /proc, it is read by setting it and putting it back, which changes
+# it for every thread for a moment: that is only done when the module
+# is first loaded, not when it is reloaded in a running bot.
+_procUmask = _readUmask()
+if _procUmask is not None:
+    _umask = _procUmask
+elif '_umask' not in globals():
+    _umask = os.umask(0)
+    os.umask(_umask)
+
+def fileVersion(filename):
+    """Return the (mtime, size, inode) of a file, None if it's not
+    there."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+# The names of the settings of each Config class.
+_settingNames = { }
+def settingNames(cls):
+    """Return the names of the settings of the Config class cls:
+    its public attributes, other than methods and properties."""
+    names = _settingNames.get(cls)
+    if names is None:
+        names = _settingNames[cls] = tuple([
+            attrname for attrname in sorted(dir(cls))
+            if attrname[0] != '_' and
+            not callable(getattr(cls, attrname)) and
+            not isinstance(getattr(cls, attrname), property)])
+    return names
+
+def fsyncDirectory(dirname):
+    """fsync a directory, making the renames in it durable."""
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 # Load local configuration
@@ -258,7 +972,31 @@ except ImportError:
     pass
 
 
+def chairOnly(func):
+    """Make a command one for the chairs of the meeting only.
+
+    The command does nothing when given by someone else, whether it
+    comes through addline() or its method is called directly."""
+    @functools.wraps(func)
+    def command(self, nick, *args, **kwargs):
+        if not self.isChair(nick):
+            return
+        return func(self, nick, *args, **kwargs)
+    command.chairOnly = True
+    return command
+
+
 class MeetingCommands(object):
+    # The #commands, by name: every do_* method, aliases included.  It
+    # is worked out once per class, not on each command.
+    commands = { }
+    def __init_subclass__(cls, **kwargs):
+        cls.commands = cls._findCommands()
+    @classmethod
+    def _findCommands(cls):
+        return dict((name[3:], getattr(cls, name)) for name in dir(cls)
+                    if name.startswith('do_'))
+
     # Command definitions
     # generic parameters to these functions:
     #  nick=
@@ -271,6 +1009,7 @@ class MeetingCommands(object):
         # In case of replay
         if not self.owner:
             self.owner = nick
+            self.changed('meta')
         if not getattr(self, "starttime", None):
             self.starttime = time_
         repl = self.replacements()
@@ -281,17 +1020,16 @@ class MeetingCommands(object):
         for chair in self.chairs:
             self.do_private_commands(chair)
         self.do_commands()
-        if line:
+        if line and self.isChair(nick):
             self.do_meetingtopic(nick=nick, line=line, time_=time_, **kwargs)
 
+    @chairOnly
     def do_endmeeting(self, nick, line, time_, **kwargs):
         """End the meeting."""
-        if not self.isChair(nick): return
         # Close any open votes
-        if self.activeVote:
-            endVoteKwargs = {"linenum": kwargs.get("linenum", "0"),
-                 "time_": time.localtime()}
-            self.do_endvote(nick=nick, line=line, **endVoteKwargs)
+        for vote in list(self.openVotes):
+            self.endvote(vote, nick=nick, linenum=kwargs.get("linenum", "0"),
+                         time_=self.timeZone.localtime())
         self.topic(self.oldtopic)
         self.endtime = time_
         self._meetingIsOver = True
@@ -305,68 +1043,70 @@ class MeetingCommands(object):
         """Begin a replay."""
         pass
 
+    @chairOnly
     def do_topic(self, nick, line, **kwargs):
         """Set a new topic in the channel."""
-        if not self.isChair(nick): return
         self.currenttopic = line
         m = items.Topic(nick=nick, line=line, **kwargs)
         self.additem(m)
         self.settopic()
 
+    @chairOnly
     def do_subtopic(self, nick, **kwargs):
         """This is like a topic but less so."""
-        if not self.isChair(nick): return
         m = items.Subtopic(nick=nick, **kwargs)
         self.additem(m)
     do_progress = do_subtopic
 
+    @chairOnly
     def do_meetingtopic(self, nick, line, **kwargs):
         """Set a meeting topic (included in all topics)."""
-        if not self.isChair(nick): return
         if not line or line.lower() in ('none', 'unset'):
             self._meetingTopic = None
         else:
             self._meetingTopic = line
+        self.changed('meta')
         self.settopic()
 
+    @chairOnly
     def do_save(self, nick, time_, **kwargs):
         """Save the meeting logs by force."""
-        if not self.isChair(nick): return
         self.endtime = time_
-        self.config.save()
+        self.config.refresh()
+        self.config.save(texts=False)
 
+    @chairOnly
     def do_done(self, nick, **kwargs):
         """Add done item to the minutes - chairs only."""
-        if not self.isChair(nick): return
         m = items.Done(nick=nick, **kwargs)
         self.additem(m)
 
+    @chairOnly
     def do_agreed(self, nick, **kwargs):
         """Add agreement to the minutes - chairs only."""
-        if not self.isChair(nick): return
         m = items.Agreed(nick=nick, **kwargs)
         self.additem(m)
         if self.config.beNoisy:
             self.reply("AGREED: " + m.line)
     do_agree = do_agreed
 
+    @chairOnly
     def do_accepted(self, nick, **kwargs):
         """Add agreement to the minutes - chairs only."""
-        if not self.isChair(nick): return
         m = items.Accepted(nick=nick, **kwargs)
         self.additem(m)
     do_accept = do_accepted
 
+    @chairOnly
     def do_rejected(self, nick, **kwargs):
         """Add agreement to the minutes - chairs only."""
-        if not self.isChair(nick): return
         m = items.Rejected(nick=nick, **kwargs)
         self.additem(m)
     do_reject = do_rejected
 
+    @chairOnly
     def do_chair(self, nick, line, **kwargs):
         """Add a chair to the meeting."""
-        if not self.isChair(nick): return
         for chair in re.split('[, ]+', line):
             if not chair: continue
             if chair not in self.chairs:
@@ -378,126 +1118,93 @@ class MeetingCommands(object):
                 self.do_private_commands(chair)
         self.reply("Current chairs: " + ', '.join(sorted(set(list(self.chairs.keys()) + [self.owner]))))
 
+    @chairOnly
     def do_unchair(self, nick, line, **kwargs):
         """Remove a chair from the meeting (founder cannot be removed)."""
-        if not self.isChair(nick): return
         for chair in re.split('[, ]+', line):
             if not chair: continue
             if chair in self.chairs:
                 del self.chairs[chair]
         self.reply("Current chairs: " + ', '.join(sorted(set(list(self.chairs.keys()) + [self.owner]))))
 
+    @chairOnly
     def do_undo(self, nick, **kwargs):
         """Remove the last item from the minutes."""
-        if not self.isChair(nick): return
         if not self.minutes: return
         self.reply("Removing item from minutes: " + str(self.minutes[-1].itemtype))
         del self.minutes[-1]
+        self.changed('minutes')
 
+    @chairOnly
     def do_restrictlogs(self, nick, **kwargs):
         """When saved, remove permissions from the files."""
-        if not self.isChair(nick): return
         self._restrictlogs = True
         self.reply("Restricting permissions on minutes: -%s on next #save" % \
                    oct(RestrictPerm))
 
+    @chairOnly
     def do_lurk(self, nick, **kwargs):
         """Don't interact in the channel."""
-        if not self.isChair(nick): return
         self._lurk = True
 
+    @chairOnly
     def do_unlurk(self, nick, **kwargs):
         """Do interact in the channel."""
-        if not self.isChair(nick): return
         self._lurk = False
 
+    @chairOnly
     def do_meetingname(self, nick, line, **kwargs):
         """Set the variable (meetingname) which can be used in save.
 
         If this isn't set, it defaults to the channel name."""
-        if not self.isChair(nick): return
         meetingname = "_".join(line.lower().split())
         self._meetingname = meetingname
+        self.changed('meta')
         self.reply("Meeting name set to: " + meetingname)
 
+    @chairOnly
     def do_vote(self, nick, line, **kwargs):
-        """Start a voting process."""
-        if not self.isChair(nick): return
-        if self.activeVote:
-            self.reply("Voting still open on: " + self.activeVote)
-            return
-        self.activeVote = line
-        self.currentVote = {}
-        self.publicVoters[self.activeVote] = []
-        #Need the line number for linking to the html output
-        self.currentVoteStartLine = len(self.lines)
-        #need to set up a structure to hold vote results
-        #people can vote by saying +1, -1 or +0
+        """Start a voting process.
+
+        Several votes can be open at once: "#vote name: question" names
+        one, so that ballots can say which one they are for."""
+        vote = VoteTally(line, len(self.lines))
+        for other in self.openVotes:
+            if other.question == line or \
+                   (vote.name is not None and other.name == vote.name):
+                self.reply("Voting still open on: " + other.question)
+                return
         #if voters have been specified then only they can vote
         #there can be multiple votes called in a meeting
-        self.reply("Please vote on: " + self.activeVote)
+        self.openVotes.append(vote)
+        self.changed('votes')
+        self.reply("Please vote on: " + vote.question)
         self.reply(("Public votes can be registered by saying +1, -1 or +0 in channel "
             "(for private voting, private message me with 'vote +1|-1|+0 #channelname')"))
 
+    @chairOnly
     def do_votesrequired(self, nick, line, **kwargs):
         """Set the number of votes required to pass a motion -
         useful for council votes where 3 of 5 people need to +1 for example."""
-        if not self.isChair(nick): return
         try:
             self.votesrequired = int(line)
         except ValueError:
             self.votesrequired = 0
         self.reply("Votes now need %d to be passed" % self.votesrequired)
 
+    @chairOnly
     def do_endvote(self, nick, line, **kwargs):
-        """This vote is over, record the results."""
-        if not self.isChair(nick): return
-        if not self.activeVote:
+        """This vote is over, record the results.
+
+        The rest of the line can name the vote, if several are open."""
+        vote = self.findVote(line.split())
+        if vote is None:
             self.reply("No vote in progress")
             return
+        self.endvote(vote, nick=nick, **kwargs)
 
-        self.reply("Voting ended on: " + self.activeVote)
-        #should probably just store the summary of the results
-        vfor = 0
-        vagainst = 0
-        vabstain = 0
-        for v in list(self.currentVote.values()):
-            if re.match(r'\+1\b', v):
-                vfor += 1
-            elif re.match(r'-1\b', v):
-                vagainst += 1
-            elif re.match(r'[+-]?0\b', v):
-                vabstain += 1
-
-        self.reply("Votes for: %d, Votes against: %d, Abstentions: %d" % (vfor, vagainst, vabstain))
-        if vfor - vagainst >= self.votesrequired:
-            self.reply("Motion carried")
-            voteResult = "Carried"
-            motion = "Motion carried"
-        elif vfor - vagainst < self.votesrequired:
-            self.reply("Motion denied")
-            voteResult = "Denied"
-            motion = "Motion denied"
-        elif not self.votesrequired:
-            self.reply("Deadlock, casting vote may be used")
-            voteResult = "Deadlock"
-            motion = "Motion deadlocked"
-        #store the results
-        voteSummary = "%s (For: %d, Against: %d, Abstained: %d)" % (motion, vfor, vagainst, vabstain)
-        self.votes[self.activeVote] = (voteSummary, self.currentVoteStartLine)
-
-        """Add informational item to the minutes."""
-        voteResultLog = "%s (%s)" % (self.activeVote, voteResult)
-        m = items.Vote(nick=nick, line=voteResultLog, **kwargs)
-        self.additem(m)
-
-        #allow another vote to be called
-        self.activeVote = ""
-        self.currentVote = {}
-        self.currentVoteStartLine = 0
-
+    @chairOnly
     def do_voters(self, nick, line, **kwargs):
-        if not self.isChair(nick): return
         """Provide a list of authorised voters."""
         #possibly should provide a means to change voters to everyone
         for voter in re.split('[, ]+', line):
@@ -516,7 +1223,7 @@ class MeetingCommands(object):
         self.reply("Current voters: " + ', '.join(sorted(set(list(self.voters.keys()) + [self.owner]))))
 
     def do_private_commands(self, nick, **kwargs):
-        commands = sorted(["#"+x[3:] for x in dir(self) if x[:3] == "do_"])
+        commands = sorted("#"+name for name in self.commands)
         message = "Available commands: " + ', '.join(commands)
         self.privateReply(nick, message)
 
@@ -558,19 +1265,37 @@ class MeetingCommands(object):
         """Add informational item to the minutes."""
         m = items.Link(**kwargs)
         self.additem(m)
+    def do_votestatus(self, line, **kwargs):
+        """Tell how the open votes (or the one named) are going."""
+        votes = self.openVotes
+        if not votes:
+            self.reply("No vote in progress")
+            return
+        vote = self.findVote(line.split(), default=False)
+        if vote is not None:
+            votes = [vote]
+        for vote in votes:
+            self.reply("Voting on: %s (%s)" % (vote.question, vote.status()))
     def do_commands(self, **kwargs):
         commands = sorted(["action", "info", "idea", "nick", "link", "commands"])
         self.reply("Available commands: " + ', '.join(commands))
+MeetingCommands.commands = MeetingCommands._findCommands()
 
 
 class Meeting(MeetingCommands, object):
     _lurk = False
     _restrictlogs = False
+    # journal.Journal recording the input of this meeting, if any
+    journal = None
+    # True while the meeting is rebuilt from its journal
+    _restoring = False
+    # True during a bulk replay of a log: saving waits for its end
+    _bulkReplay = False
     def __init__(self, channel, owner, botIsOp=False, oldtopic='',
                  filename=None, writeRawLog=False,
                  setTopic=None, sendReply=None, sendPrivateReply=None,
                  getRegistryValue=None,
-                 safeMode=False, channelNicks=None,
+                 safeMode=False, channelNicks=None, scheduleEvent=None,
                  extraConfig={}, network='nonetwork'):
 
         # Load configuration
@@ -579,6 +1304,10 @@ class Meeting(MeetingCommands, object):
             self.config = config.get_config_proxy(self.config)
         self.config = self.config(self, writeRawLog=writeRawLog, safeMode=safeMode,
                                   extraConfig=extraConfig)
+        if self.config.extraCommands:
+            self.commands = dict(self.commands)
+            self.commands.update((name.lower(), function) for name, function
+                                 in self.config.extraCommands.items())
 
         if getRegistryValue is not None:
             self._registryValue = getRegistryValue
@@ -588,6 +1317,9 @@ class Meeting(MeetingCommands, object):
             self._sendPrivateReply = sendPrivateReply
         if setTopic is not None:
             self._setTopic = setTopic
+        if scheduleEvent is not None:
+            self._scheduleEvent = scheduleEvent
+        self.realtimeSaver = RealtimeSaver(self)
         self.owner = owner
         self.botIsOp = botIsOp
         self.channel = channel
@@ -596,15 +1328,25 @@ class Meeting(MeetingCommands, object):
         self.oldtopic = oldtopic
         if self.oldtopic:
             self.oldtopic = self.config.dec(self.oldtopic)
-        self.lines = []
+        self.lines = LineStore()
         self.minutes = []
+        # Incremented when a part of the meeting state changes, so
+        # that outputs are only rendered again when they may change:
+        # lines (the log), minutes, attendees, votes, and meta (the
+        # owner, meeting topic and name).
+        self.versions = dict.fromkeys(
+            ('lines', 'minutes', 'attendees', 'votes', 'meta'), 0)
         self.attendees = {}
         self.chairs = {}
         self.voters = {}
-        self.publicVoters = {}
+        # The open votes (VoteTally), oldest first, and the closed ones
+        # by question.
+        self.openVotes = []
+        self.voteTallies = {}
+        # The results of the closed votes by question, as (summary,
+        # startLine).
         self.votes = {}
         self.votesrequired = 0
-        self.activeVote = ""
         self._writeRawLog = writeRawLog
         self._meetingTopic = None
         self._meetingname = ""
@@ -612,10 +1354,7 @@ class Meeting(MeetingCommands, object):
         self._channelNicks = channelNicks
         if filename:
             self._filename = filename
-
-        # Set the timezone
-        os.environ['TZ'] = self.config.timeZone
-        time.tzset()
+        self.timeZone = TimeZone(self.config.timeZone)
 
     # These commands are callbacks to manipulate the IRC protocol.
     # Set self._sendReply and self._setTopic to a callback to do these things.
@@ -647,34 +1386,101 @@ class Meeting(MeetingCommands, object):
             topic += ' | Current topic: '
         topic += self.currenttopic
         self.topic(topic)
+    def changed(self, *parts):
+        """Note that these parts of the meeting state changed."""
+        for part in parts:
+            self.versions[part] += 1
     def addnick(self, nick, lines=1):
         """This person has spoken, lines=<how many lines>"""
         self.attendees[nick] = self.attendees.get(nick, 0) + lines
+        self.changed('attendees')
     def isChair(self, nick):
         """Is the nick a chair?"""
         return (nick == self.owner or nick in self.chairs or self.isop)
     def endmeeting(self):
         """The remaining meeting end bits."""
-        self.config.save()
+        # A bulk replay saves, and removes the journal, after its last
+        # line instead.
+        if not self._bulkReplay:
+            self.config.save(texts=False)
+            # Everything is saved, the journal isn't needed any more.
+            if self.journal is not None:
+                self.journal.remove()
         repl = self.replacements()
         message = self.config.endMeetingMessage % repl
         for messageline in message.split('\n'):
             self.reply(messageline)
         for nickToPM in self.config.endMeetingNotificationList:
             self.privateReply(nickToPM, self.config.endMeetingNotification % repl)
+    def openReplay(self, url):
+        """Open the log to replay, as a binary file object.
+
+        `url` is fetched from the web (http or https only), unless it
+        is a path, or a URL under logUrlPrefix: that log is read from
+        under logFileDir, and must not be outside of it."""
+        prefix = self.config.logUrlPrefix
+        if prefix and url.startswith(prefix):
+            url = url[len(prefix):].lstrip('/')
+        elif re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', url):
+            if not re.match(r'^https?://', url, re.I):
+                raise ValueError("Can only replay logs over http(s): %s"
+                                 % url)
+            return utils.web.getUrlFd(url, timeout=self.config.replayTimeout)
+        logFileDir = os.path.realpath(self.config.logFileDir)
+        path = os.path.realpath(os.path.join(logFileDir, url))
+        if os.path.commonpath((logFileDir, path)) != logFileDir:
+            raise ValueError("Can only replay logs under logFileDir: %s"
+                             % url)
+        return open(path, 'rb')
     def replay(self, url):
-        """Begin a replay."""
+        """Begin a replay.  Returns the report of how it went, which
+        is also sent as a reply."""
         self.reply("Looking for meetings at: '%s'" % url)
-        htmlSource = utils.web.getUrl(url).decode('utf-8')
-        self.process_meeting(content=htmlSource)
+        start = time.time()
+        return self.replayLines(self.fetchReplay(url), start)
+    def fetchReplay(self, url):
+        """Fetch and parse the log to replay, returning its lines (see
+        parseLog).  The meeting itself is left alone, so this can be
+        done in another thread."""
+        fd = self.openReplay(url)
+        try:
+            return list(self.parseLog(io.TextIOWrapper(fd,
+                                                       encoding='utf-8')))
+        finally:
+            fd.close()
+    def replayLines(self, lines, start):
+        """Add the lines of a replay fetched since `start` (epoch
+        seconds) in bulk.  Returns the report of how it went, which is
+        also sent as a reply."""
+        count = self.addLines(lines, bulk=True)
+        elapsed = time.time() - start
+        report = "Replayed %d lines in %.1fs (%d lines/s)" % (
+            count, elapsed, count / max(elapsed, 0.001))
+        self.reply(report)
+        return report
     def save(self, **kwargs):
         return self.config.save(**kwargs)
 
+    def timestamp(self, time_=None):
+        """Return time_ as epoch seconds.  It can be given as epoch
+        seconds, or as a struct_time in the timezone of the meeting
+        (as in logs being replayed); the default is now."""
+        if time_ is None:
+            return time.time()
+        if isinstance(time_, (int, float)):
+            return time_
+        return self.timeZone.timestamp(time_)
+
     # Primary entry point for new lines in the log
     def addline(self, nick, line, isop=False, time_=None):
-        """This is the way to add lines to the Meeting object."""
-        if not time_: time_ = time.localtime()
-        linenum = self.addrawline(nick, line, time_)
+        """This is the way to add lines to the Meeting object.
+
+        time_ is in epoch seconds (or see timestamp()); commands get
+        it as a struct_time in the timezone of the meeting."""
+        time_ = self.timestamp(time_)
+        if self.journal is not None:
+            self.journal.record('line', nick, line, isop, time_)
+        linenum = self._addrawline(nick, line, time_)
         nick = self.config.dec(nick)
         line = self.config.dec(line)
         self.isop = isop
@@ -684,59 +1490,128 @@ class Meeting(MeetingCommands, object):
             command, line = matchobj.groups('')
             command = command.lower()
             # to define new commands, define a method do_commandname
-            if hasattr(self, "do_"+command):
-                getattr(self, "do_"+command)(nick=nick, line=line,
-                                             linenum=linenum, time_=time_)
+            # (or add them to the extraCommands option)
+            function = self.commands.get(command)
+            # Commands decorated with chairOnly check the nick
+            # themselves, extra commands may only have the attribute.
+            if function is not None and not (
+                    getattr(function, 'chairOnly', False)
+                    and not self.isChair(nick)):
+                function(self, nick=nick, line=line, linenum=linenum,
+                         time_=self.timeZone.localtime(time_))
         else:
             # Detect URLs automatically
             if line.split('//')[0] in self.config.UrlProtocols:
-                self.do_link(nick=nick, line=line,
-                             linenum=linenum, time_=time_)
-        self.save(realtime_update=True)
-        if re.match(r'([+-]1|[+-]?0)\b', line):
+                self.do_link(nick=nick, line=line, linenum=linenum,
+                             time_=self.timeZone.localtime(time_))
+        self.realtimeSaver.markDirty()
+        if self.openVotes:
             self.doCastVote(nick, line, time_)
 
+    @property
+    def publicVoters(self):
+        """The nicks who voted in the channel, by question, for the
+        closed and open votes."""
+        return dict((vote.question, list(vote.publicVoters)) for vote in
+                    itertools.chain(self.voteTallies.values(),
+                                    self.openVotes))
+
+    @property
+    def activeVote(self):
+        """The question of the latest open vote, or ""."""
+        if self.openVotes:
+            return self.openVotes[-1].question
+        return ""
+
+    def findVote(self, words, default=True):
+        """Return the open vote named by one of words (its name, or
+        its whole question), else the latest one if default is true."""
+        if not self.openVotes:
+            return None
+        question = " ".join(words)
+        for vote in self.openVotes:
+            if vote.question == question:
+                return vote
+        for word in words:
+            word = word.rstrip(':,.').lower()
+            for vote in self.openVotes:
+                if vote.name == word:
+                    return vote
+        if default:
+            return self.openVotes[-1]
+        return None
+
     def doCastVote(self, nick, line, time_=None, private=False):
-        """If a vote is under way and the nick is a registered voter
-        and has not already voted in this vote, add the voter name and record the vote.
-
-        If the voter has already voted, should it reject the second vote,
-        or allow them to change their vote?"""
-        if not self.voters or nick in self.voters:
-            if self.activeVote:
-                self.currentVote[nick] = line
-                if not private:
-                    self.publicVoters[self.activeVote].append(nick)
-                    self.reply("%s received from %s" % (line, nick))
-
-        #if the vote was in a private message - how do we do that??
-        #self.reply(line + " received from a private vote")
-        #we do record the voter name in the voting structure even if private, so they can't vote twice
+        """If a vote is under way and the nick is a registered voter,
+        record their ballot; voting again changes it.
+
+        The ballot goes to the open vote named in the line, else to the
+        latest one.  Returns the vote it went to, or None."""
+        if private and self.journal is not None:
+            self.journal.record('vote', nick, line, self.timestamp(time_))
+        if not self.openVotes:
+            return None
+        if self.voters and nick not in self.voters:
+            return None
+        ballot = VoteTally.parseBallot(line)
+        if ballot is None:
+            return None
+        vote = self.findVote(line.split()[1:])
+        # Private ballots are counted without naming the voter.
+        vote.cast(nick, ballot, public=not private)
+        if not private:
+            self.changed('votes')
+            self.reply("%s received from %s" % (line, nick))
+        return vote
+
+    def endvote(self, vote, nick, **kwargs):
+        """Close the open vote, record and announce its results."""
+        self.reply("Voting ended on: " + vote.question)
+        self.reply(vote.status())
+        voteResult = vote.close(self.votesrequired)
+        self.reply("Motion %s" % voteResult.lower())
+        self.openVotes.remove(vote)
+        self.voteTallies[vote.question] = vote
+        self.votes[vote.question] = (vote.summary, vote.startLine)
+        self.changed('votes')
+        # Add informational item to the minutes.
+        voteResultLog = "%s (%s)" % (vote.question, voteResult)
+        m = items.Vote(nick=nick, line=voteResultLog, **kwargs)
+        self.additem(m)
 
     def addrawline(self, nick, line, time_=None):
         """This adds a line to the log, bypassing command execution."""
+        time_ = self.timestamp(time_)
+        if self.journal is not None:
+            self.journal.record('raw', nick, line, time_)
+        return self._addrawline(nick, line, time_)
+
+    def _addrawline(self, nick, line, time_):
         nick = self.config.dec(nick)
         line = self.config.dec(line)
         self.addnick(nick)
         line = line.strip('\x01') # \x01 is present in ACTIONs
-        # Setting a custom time is useful when replaying logs,
-        # otherwise use our current time
-        if not time_: time_ = time.localtime()
 
         # Handle the logging of the line
+        minute = self.timeZone.minute(time_)
         if line[:6] == 'ACTION':
-            logline = "%s * %s %s" % (time.strftime("%H:%M", time_),
-                                nick, line[7:].lstrip())
+            self.lines.append(minute, nick, line[7:].lstrip(), True)
         else:
-            logline = "%s <%s> %s" % (time.strftime("%H:%M", time_),
-                                nick, line)
-        self.lines.append(logline)
+            self.lines.append(minute, nick, line)
+        self.changed('lines')
         linenum = len(self.lines)
         return linenum
 
     def additem(self, m):
         """Add an item to the meeting minutes list."""
         self.minutes.append(m)
+        self.changed('minutes')
+
+    def addchair(self, nick):
+        """Make nick a chair, without a #chair command."""
+        if self.journal is not None:
+            self.journal.record('chair', nick)
+        self.chairs.setdefault(nick, True)
 
     def replacements(self):
         repl = {
@@ -761,27 +1636,95 @@ class Meeting(MeetingCommands, object):
             repl['endtime'] = time.strftime("%H:%M:%S", self.endtime)
         return repl
 
-    def process_meeting(self, content, dontSave=False):
-        def parse_time(time_):
-            try: return time.strptime(time_, "%H:%M")
-            except ValueError: pass
-            try: return time.strptime(time_, "%H:%M:%S")
-            except ValueError: pass
+    def process_meeting(self, content, dontSave=False, bulk=False):
+        """Replay a meeting log, given as a string or a file object.
+
+        Said lines and /me lines, as matched by logline_RE and
+        loglineAction_RE, are added to the meeting; the rest is
+        ignored.  With `bulk`, nothing is saved while the lines are
+        added, and the meeting is saved once at the end instead.
+        Returns the number of lines added."""
         if dontSave:
             self.config.dontSave = True
-        # process all lines
-        for line in content.split('\n'):
-            # match regular spoken lines
-            m = self.config.logline_RE.match(line)
-            if m:
-                time_ = parse_time(m.group(1))
-                nick = m.group(2)
-                line = m.group(3)
+        return self.addLines(self.parseLog(content), bulk=bulk)
+
+    def parseLog(self, content):
+        """Yield the said lines and /me lines of a meeting log, given
+        as a string or a file object, as (nick, line, time) tuples."""
+        said_RE = self.config.logline_RE
+        action_RE = self.config.loglineAction_RE
+        # Both patterns as one, so that each line is matched once.  The
+        # groups of the action pattern come after those of the said one.
+        saidGroups = said_RE.groups
+        try:
+            line_RE = re.compile('(?:%s)|(?:%s)' % (said_RE.pattern,
+                                                   action_RE.pattern),
+                                 said_RE.flags)
+        except re.error:
+            line_RE = None
+        if said_RE.flags != action_RE.flags or not saidGroups:
+            line_RE = None
+        # A log has few distinct timestamps: parse each one once.
+        times = { }
+        def parse_time(time_):
+            try:
+                return times[time_]
+            except KeyError:
+                pass
+            parsed = None
+            for format in ("%H:%M", "%H:%M:%S"):
+                try:
+                    parsed = self.timeZone.timestamp(
+                        time.strptime(time_, format))
+                    break
+                except ValueError:
+                    pass
+            times[time_] = parsed
+            return parsed
+        if isinstance(content, str):
+            content = io.StringIO(content)
+        for line in content:
+            line = line.rstrip('\n')
+            if line_RE is not None:
+                m = line_RE.match(line)
+                if m is None:
+                    continue
+                if m.lastindex > saidGroups:
+                    # a /me line
+                    time_, nick, line = m.group(saidGroups+1,
+                                                saidGroups+2,
+                                                saidGroups+3)
+                    line = "ACTION "+line
+                else:
+                    time_, nick, line = m.group(1, 2, 3)
+            else:
+                m = said_RE.match(line)
+                if m:
+                    time_, nick, line = m.group(1, 2, 3)
+                else:
+                    m = action_RE.match(line)
+                    if m is None:
+                        continue
+                    time_, nick, line = m.group(1, 2, 3)
+                    line = "ACTION "+line
+            yield nick, line, parse_time(time_)
+
+    def addLines(self, lines, bulk=False):
+        """Add the (nick, line, time) lines to the meeting, saving as
+        process_meeting() does.  Returns the number of lines added."""
+        count = 0
+        self._bulkReplay = bulk
+        try:
+            for nick, line, time_ in lines:
                 self.addline(nick, line, time_=time_)
-            # match /me lines
-            m = self.config.loglineAction_RE.match(line)
-            if m:
-                time_ = parse_time(m.group(1))
-                nick = m.group(2)
-                line = m.group(3)
-                self.addline(nick, "ACTION "+line, time_=time_)
+                count += 1
+        finally:
+            self._bulkReplay = False
+        if bulk and self._meetingIsOver:
+            self.config.save(texts=False)
+            if self.journal is not None:
+                self.journal.remove()
+        elif bulk:
+            # The meeting goes on: only the realtime outputs are due.
+            self.realtimeSaver.flush()
+        return count
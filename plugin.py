@@ -29,21 +29,71 @@
 ###
 
 from supybot.commands import *
+import supybot.conf as conf
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
+import supybot.schedule as schedule
 import supybot.log as supylog
 
 import re, time
+import threading
 from . import meeting
+from . import journal
+
+class MeetingCache(dict):
+    """The running meetings, by (channel, network).
+
+    They are also indexed by network and channel name, folded with the
+    IRC casemapping, so that the channel named in a private vote finds
+    its meeting with one lookup.  Meetings must be added and removed
+    with item assignment and del, which keep the index up to date."""
+    def __init__(self, meetings=()):
+        dict.__init__(self)
+        self.byChannel = { }
+        for key, M in dict(meetings).items():
+            self[key] = M
+
+    @staticmethod
+    def channelKey(channel, network):
+        return (network, ircutils.toLower(channel))
+
+    def __setitem__(self, key, M):
+        dict.__setitem__(self, key, M)
+        self.byChannel[self.channelKey(*key)] = key
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        del self.byChannel[self.channelKey(*key)]
+
+    def find(self, channel, network):
+        """Return the meeting in channel on network, or None."""
+        key = self.byChannel.get(self.channelKey(channel, network))
+        if key is None:
+            return None
+        return self[key]
+
+# The channel and start time of a meeting, in the URL of its logs.
+logfile_RE = re.compile(r'^.*/([^.]+)\.([0-9]{4}(-[0-9]{2}){3}(\.[0-9]{2}){1,2})\..*$')
+def parseLogfileTime(time_):
+    try: return time.strptime(time_, "%Y-%m-%d-%H.%M")
+    except ValueError: pass
+    try: return time.strptime(time_, "%Y-%m-%d-%H.%M.%S")
+    except ValueError: pass
 
 # By doing this, we can not lose all of our meetings across plugin
 # reloads.  But, of course, you can't change the source too
-# drastically if you do that!
-try:               meeting_cache
-except NameError:  meeting_cache = {}
+# drastically if you do that!  (The cache is made again from the
+# meetings, so that it has the index of this version.)
+try:               meeting_cache = MeetingCache(meeting_cache)
+except NameError:  meeting_cache = MeetingCache()
 try:               recent_meetings
 except NameError:  recent_meetings = []
+# Meetings being replayed in the background, by (channel, network).
+# They go to meeting_cache when their replay is done.
+try:               replaying
+except NameError:  replaying = {}
 
 
 class MeetBot(callbacks.Plugin):
@@ -53,6 +103,82 @@ class MeetBot(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(MeetBot, self)
         self.__parent.__init__(irc)
+        self._restoreMeetings()
+
+    def die(self):
+        # Write out any coalesced realtime updates before unloading.
+        # Meetings carried over from an older version of the plugin
+        # (across a reload) may have no realtime saver or journal.
+        try:
+            for M in list(meeting_cache.values()):
+                saver = getattr(M, 'realtimeSaver', None)
+                if saver is not None:
+                    saver.flush()
+                if getattr(M, 'journal', None) is not None:
+                    M.journal.sync()
+            meeting.writers.stopDocutils()
+        finally:
+            self.__parent.die()
+
+    def _journalDir(self):
+        """Return the directory of the meeting journals, or None."""
+        directory = meeting.Config.journalDir
+        if directory.lower() == 'none':
+            return None
+        if not directory:
+            directory = conf.supybot.directories.data.dirize('MeetBot')
+        return directory
+
+    def _startJournal(self, M):
+        """Journal the meeting M, if journals are enabled."""
+        directory = self._journalDir()
+        if not directory:
+            return
+        try:
+            M.journal = journal.Journal.create(directory, M,
+                syncInterval=M.config.journalSyncInterval,
+                scheduleEvent=schedule.addEvent)
+        except EnvironmentError:
+            supylog.exception("MeetBot: can't journal the meeting in %s"
+                              % M.channel)
+
+    def _restoreMeetings(self):
+        """Restore the meetings left in the journal by a crash."""
+        directory = self._journalDir()
+        if not directory:
+            return
+        # Meetings kept across a plugin reload are still running.
+        running = set(M.journal.filename for M in meeting_cache.values()
+                      if getattr(M, 'journal', None) is not None)
+        for filename in journal.listJournals(directory):
+            if filename in running:
+                continue
+            try:
+                M = journal.restore(filename,
+                    syncInterval=meeting.Config.journalSyncInterval,
+                    scheduleEvent=schedule.addEvent,
+                    writeRawLog=True, safeMode=True,
+                    getRegistryValue=self.registryValue)
+            except Exception:
+                supylog.exception("MeetBot: can't restore the meeting "
+                                  "journaled in %s" % filename)
+                continue
+            if M is None:
+                continue
+            if M._meetingIsOver:
+                # The bot went down while saving it.
+                M.endmeeting()
+                continue
+            Mkey = (M.channel, M.network)
+            meeting_cache[Mkey] = M
+            recent_meetings.append(
+                (M.channel, M.network, time.ctime()))
+            if len(recent_meetings) > 10:
+                del recent_meetings[0]
+            # Bring the realtime outputs up to date.
+            M.realtimeSaver.markDirty()
+            supylog.info("MeetBot: restored the meeting in %s (%s), "
+                         "%d lines" % (M.channel, M.network, len(M.lines)))
 
     # Instead of using real Supybot commands, I just listen to ALL
     # messages coming in and respond to those beginning with our
@@ -60,34 +186,60 @@ class MeetBot(callbacks.Plugin):
     # standpoint (as well as other things).  Ask me if you have more
     # questions.
 
-    # This captures all messages coming into the bot.
-    def doPrivmsg(self, irc, msg):
-        nick = msg.nick
-        channel = msg.channel
-        network = irc.network
-        payload = msg.args[1].strip()
-
-        # These callbacks are used to send data to the channel
-        def _setTopic(x):
+    def _channelCallbacks(self, irc, channel):
+        """The callbacks a meeting uses to talk to its channel, as
+        keyword arguments of meeting.Meeting."""
+        def setTopic(x):
             irc.queueMsg(ircmsgs.topic(channel, x))
-        def _sendReply(x):
+        def sendReply(x):
             irc.queueMsg(ircmsgs.privmsg(channel, x))
-        def _sendPrivateReply(nick, x):
+        def sendPrivateReply(nick, x):
             irc.queueMsg(ircmsgs.privmsg(nick, x))
-        def _channelNicks():
+        def channelNicks():
             return irc.state.channels[channel].users
+        return {'setTopic': setTopic, 'sendReply': sendReply,
+                'sendPrivateReply': sendPrivateReply,
+                'channelNicks': channelNicks,
+                'scheduleEvent': schedule.addEvent}
+
+    def _attachChannel(self, M, irc, channel):
+        """Let the meeting M talk to its channel."""
+        for name, callback in self._channelCallbacks(irc, channel).items():
+            setattr(M, '_'+name, callback)
+
+    def _dropMeeting(self, M):
+        """Stop the realtime updates and remove the journal of M,
+        whose logs won't be saved any more."""
+        saver = getattr(M, 'realtimeSaver', None)
+        if saver is not None:
+            saver.close()
+            M.config.closeAppendFiles()
+        if getattr(M, 'journal', None) is not None:
+            M.journal.remove()
+
+    def _isChair(self, irc, channel, M, nick):
+        """Is the nick a chair?"""
+        return (nick == M.owner or nick in M.chairs or
+                nick in irc.state.channels[channel].ops)
 
-        def isChair(nick):
-            """Is the nick a chair?"""
-            return (nick == M.owner or nick in M.chairs or
-                    nick in irc.state.channels[channel].ops)
-
-        logfile_RE = re.compile(r'^.*/([^.]+)\.([0-9]{4}(-[0-9]{2}){3}(\.[0-9]{2}){1,2})\..*$')
-        def parse_time(time_):
-            try: return time.strptime(time_, "%Y-%m-%d-%H.%M")
-            except ValueError: pass
-            try: return time.strptime(time_, "%Y-%m-%d-%H.%M.%S")
-            except ValueError: pass
+    # This captures all messages coming into the bot.
+    def doPrivmsg(self, irc, msg):
+        # Get our Meeting object, if one exists.  Have to keep track
+        # of different servers/channels.
+        # (channel, network) tuple is our lookup key.
+        channel = msg.channel
+        Mkey = (channel, irc.network)
+        M = meeting_cache.get(Mkey)
+        # This is called for every line said in every channel the bot
+        # is in: the lines of channels without a meeting which aren't
+        # commands (and private messages) are done with right away.
+        if M is None and (channel is None or
+                          msg.args[1].lstrip()[:1] != '#'):
+            return
+        nick = msg.nick
+        network = irc.network
+        payload = msg.args[1].strip()
+        command = payload[:13].lower()
 
         # The following is for debugging.  It's excellent to get an
         # interactive interperter inside of the live bot.  use
@@ -96,15 +248,14 @@ class MeetBot(callbacks.Plugin):
         #if payload == 'interact':
         #    from rkddp.interact import interact ; interact()
 
-        # Get our Meeting object, if one exists.  Have to keep track
-        # of different servers/channels.
-        # (channel, network) tuple is our lookup key.
-        Mkey = (channel, network)
-        M = meeting_cache.get(Mkey, None)
+        if M is not None and not hasattr(M, '_sendReply'):
+            # Restored from its journal at startup, when there was no
+            # channel to talk to yet.
+            self._attachChannel(M, irc, channel)
 
         # Start meeting if we are requested
-        if payload[:13].lower() == '#startmeeting':
-            if M:
+        if command == '#startmeeting':
+            if M or Mkey in replaying:
                 irc.error("Can't start another meeting, one is in progress",
                           private=True)
                 return
@@ -113,57 +264,96 @@ class MeetBot(callbacks.Plugin):
                                 oldtopic=irc.state.channels[channel].topic,
                                 writeRawLog=True, safeMode=True,
                                 getRegistryValue=self.registryValue,
-                                setTopic=_setTopic, sendReply=_sendReply,
-                                sendPrivateReply=_sendPrivateReply,
-                                channelNicks=_channelNicks)
+                                **self._channelCallbacks(irc, channel))
             meeting_cache[Mkey] = M
+            self._startJournal(M)
             recent_meetings.append(
                 (channel, network, time.ctime()))
             if len(recent_meetings) > 10:
                 del recent_meetings[0]
         # Replay meeting
-        elif payload[:7].lower() == '#replay':
-            if M:
+        elif command[:7] == '#replay':
+            if M or Mkey in replaying:
                 irc.error("Can't replay logs while a meeting is in progress",
                           private=True)
                 return
+            url = payload[7:].split()
+            if not url:
+                return
+            url = url[0]
             M = meeting.Meeting(channel=channel, network=network, owner=None,
                                 botIsOp=irc.state.channels[channel].isOp(irc.nick),
                                 oldtopic=irc.state.channels[channel].topic,
                                 writeRawLog=True, safeMode=True,
                                 getRegistryValue=self.registryValue)
-            meeting_cache[Mkey] = M
             recent_meetings.append(
                 (channel, network, time.ctime()))
             if len(recent_meetings) > 10:
                 del recent_meetings[0]
-            url = payload[7:].strip().split()[0]
-            if url:
-                m = logfile_RE.match(url)
-                if m:
-                    M.channel = "#"+m.group(1)
-                    M.starttime = parse_time(m.group(2))
-                M.replay(url)
+            m = logfile_RE.match(url)
+            if m:
+                M.channel = "#"+m.group(1)
+                M.starttime = parseLogfileTime(m.group(2))
+            self._startJournal(M)
+            replaying[Mkey] = M
+            M.reply("Looking for meetings at: '%s'" % url)
+            start = time.time()
+            # Fetching and parsing the log can take a while: it's done
+            # in a thread.  The lines are added to the meeting (which
+            # saves it, and writes its journal) back in the main loop.
+            def finish(lines, error=None):
+                # The replay may have been aborted in the meantime.
+                if replaying.get(Mkey) is not M:
+                    return
+                del replaying[Mkey]
+                if error is None:
+                    try:
+                        report = M.replayLines(lines, start)
+                    except Exception as e:
+                        supylog.exception("MeetBot: replay of %s failed"
+                                          % url)
+                        error = e
+                if error is not None:
+                    self._dropMeeting(M)
+                    irc.queueMsg(ircmsgs.privmsg(channel,
+                                 "Replay of %s failed: %s" % (url, error)))
+                    return
                 if not M._meetingIsOver:
-                    M._setTopic=_setTopic; M._sendReply=_sendReply
-                    M._sendPrivateReply=_sendPrivateReply
-                    M._channelNicks=_channelNicks
-                else:
-                    del meeting_cache[Mkey]
+                    self._attachChannel(M, irc, channel)
+                    meeting_cache[Mkey] = M
+                irc.queueMsg(ircmsgs.privmsg(channel, report))
+            def fetch():
+                lines = error = None
+                try:
+                    lines = M.fetchReplay(url)
+                except Exception as e:
+                    supylog.exception("MeetBot: replay of %s failed" % url)
+                    error = e
+                schedule.addEvent(lambda: finish(lines, error), time.time())
+            threading.Thread(target=fetch, daemon=True,
+                             name="MeetBot replay %s" % channel).start()
             return
         # End meeting on issues with saving the logs
-        elif payload[:11].lower() == '#endmeeting' \
-                and M and M._meetingIsOver and isChair(nick):
+        elif command[:11] == '#endmeeting' and M and M._meetingIsOver \
+                and self._isChair(irc, channel, M, nick):
             M.endmeeting()
             del meeting_cache[Mkey]
-        elif payload[:13].lower() == '#abortmeeting' \
-                and M and isChair(nick):
+        elif command == '#abortmeeting' \
+                and M and self._isChair(irc, channel, M, nick):
             if not M._meetingIsOver:
                 M.topic(M.oldtopic)
-                M.endtime = time.localtime()
+                M.endtime = M.timeZone.localtime()
                 M._meetingIsOver = True
+            self._dropMeeting(M)
             del meeting_cache[Mkey]
             irc.reply("Meeting ended without saving its logs")
+        elif command == '#abortmeeting' and not M and Mkey in replaying \
+                and self._isChair(irc, channel, replaying[Mkey], nick):
+            # Whatever comes of the replay now is dropped.
+            M = replaying.pop(Mkey)
+            self._dropMeeting(M)
+            irc.reply("Replay dropped without saving its logs")
+            return
 
         # If there is no meeting going on, then we quit
         if not M or M._meetingIsOver: return
@@ -174,31 +364,26 @@ class MeetBot(callbacks.Plugin):
         if M._meetingIsOver:
             del meeting_cache[Mkey]
 
-    def vote(self, irc, msg, args):
-        """<+1|-1|+0> <channel>
+    def vote(self, irc, msg, args, ballot, channel, name):
+        """<+1|-1|+0> <channel> [<vote name>]
 
         Vote by private message."""
-        nick = msg.nick
-        channel = msg.channel
-        network = irc.network
-        payload = msg.args[1].strip()
-
-        """ substring to remove 'vote ' from payload """
-        payload = payload[5:]
-
-        """ private voting system """
-        if channel[0] != '#' and re.match(r'([+-]1|[+-]?0)\b', payload):
-            for key in list(meeting_cache.keys()):
-                if payload.endswith(key[0]):
-                    voteMeeting = meeting_cache.get(key, None)
-                    if voteMeeting:
-                        time_ = time.localtime()
-                        private = True
-                        voteMeeting.doCastVote(nick, payload, time_, private)
-                        irc.reply("Received for vote: " + voteMeeting.activeVote)
-                    else:
-                        irc.reply("No active meetings in this channel")
-    vote = wrap(vote, ["something", "channel"])
+        if msg.channel or meeting.VoteTally.parseBallot(ballot) is None:
+            return
+        voteMeeting = meeting_cache.find(channel, irc.network)
+        if voteMeeting is None:
+            irc.reply("No active meetings in this channel")
+            return
+        line = " ".join((ballot, name)).strip()
+        vote = voteMeeting.doCastVote(msg.nick, line, time.time(),
+                                      private=True)
+        if vote is not None:
+            irc.reply("Received for vote: " + vote.question)
+        elif voteMeeting.openVotes:
+            irc.reply("You are not a voter in this meeting")
+        else:
+            irc.reply("No vote in progress")
+    vote = wrap(vote, ["something", "channel", additional("text", "")])
 
     def outFilter(self, irc, msg):
         """Log outgoing messages from Supybot."""
@@ -240,13 +425,30 @@ class MeetBot(callbacks.Plugin):
         """
 
         Save all currently active meetings."""
-        for M in list(meeting_cache.items()):
+        for M in list(meeting_cache.values()):
             if not M._meetingIsOver:
-                M.endtime = time.localtime()
-            M.config.save()
+                M.endtime = M.timeZone.localtime()
+            M.config.save(texts=False)
         irc.reply("Saved %d meetings" % len(list(meeting_cache.items())))
     savemeetings = wrap(savemeetings, ['admin'])
 
+    def savestats(self, irc, msg, args):
+        """
+
+        Show the save statistics of all active meetings."""
+        reply = []
+        for Mkey, M in sorted(meeting_cache.items()):
+            if getattr(M, 'realtimeSaver', None) is None:
+                reply.append("%s: no statistics" % (Mkey,))
+                continue
+            reply.append("%s: %s, %s" % (Mkey, M.realtimeSaver.stats(),
+                                         M.config.writeStats()))
+        if not reply:
+            irc.reply("No currently active meetings")
+        else:
+            irc.reply("; ".join(reply))
+    savestats = wrap(savestats, ['admin'])
+
     def addchair(self, irc, msg, args, channel, network, nick):
         """<channel> <network> <nick>
 
@@ -257,7 +459,7 @@ class MeetBot(callbacks.Plugin):
             irc.reply("Meeting on channel %s, network %s not found" % (
                 channel, network))
             return
-        M.chairs.setdefault(nick, True)
+        M.addchair(nick)
         irc.reply("Chair added: %s on (%s, %s)" % (nick, channel, network))
     addchair = wrap(addchair, ['admin', "channel", "something", "nick"])
 
@@ -267,15 +469,21 @@ class MeetBot(callbacks.Plugin):
         Delete a meeting from the cache.  If save is given, save the
         meeting first, defaults to saving."""
         Mkey = (channel, network)
+        if Mkey in replaying:
+            M = replaying.pop(Mkey)
+            self._dropMeeting(M)
+            irc.reply("Dropped the replay on (%s, %s)" % (channel, network))
+            return
         if Mkey not in meeting_cache:
             irc.reply("Meeting on channel %s, network %s not found" % (
                 channel, network))
             return
+        M = meeting_cache[Mkey]
         if save:
-            M = meeting_cache[Mkey]
             if not M._meetingIsOver:
-                M.endtime = time.localtime()
-            M.config.save()
+                M.endtime = M.timeZone.localtime()
+            M.config.save(texts=False)
+        self._dropMeeting(M)
         del meeting_cache[Mkey]
         irc.reply("Deleted meeting on (%s, %s)" % (channel, network))
     deletemeeting = wrap(deletemeeting, ['admin', "channel", "something",
@@ -354,7 +562,7 @@ class MeetBot(callbacks.Plugin):
 #        # Disabled for now.  Uncomment this if you want to use this.
 #        raise AttributeError
 #
-#        if not hasattr(meeting.Meeting, "do_"+name):
+#        if name not in meeting.Meeting.commands:
 #            raise AttributeError
 #
 #        def wrapped_function(self, irc, msg, args, message):
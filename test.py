@@ -80,5 +80,91 @@ class MeetBotTestCase(ChannelPluginTestCase):
                                'line "%s" gives output "%s"'%(line, reply)
         test_script.close()
 
+    def testReplay(self):
+        import tempfile, threading
+        import supybot.schedule as schedule
+        from . import meeting
+        logdir = tempfile.mkdtemp()
+        with open(os.path.join(logdir, 'old.log.txt'), 'w') as f:
+            f.write("10:10 <test> #startmeeting\n"
+                    "10:11 <test> #info replayed offline\n")
+        Config = meeting.Config
+        oldLogFileDir, Config.logFileDir = Config.logFileDir, logdir
+        try:
+            self.feedMsg('#replay old.log.txt')
+            # The log is fetched in a thread, and the meeting replayed
+            # (and saved) through the scheduler.
+            for thread in threading.enumerate():
+                if thread.name.startswith('MeetBot replay'):
+                    thread.join()
+            self.assertEqual(os.listdir(logdir), ['old.log.txt'])
+            schedule.run()
+            self.assertNotEqual(os.listdir(logdir), ['old.log.txt'])
+            reply = self.irc.takeMsg()
+            assert reply and 'Replayed 2 lines' in reply.args[1], reply
+            self.assertError('#startmeeting')
+        finally:
+            Config.logFileDir = oldLogFileDir
+            self.feedMsg('#endmeeting')
+            while self.irc.takeMsg():
+                pass
+
+    def testAbortReplay(self):
+        from . import meeting, plugin
+        # A replay whose web server never answers.
+        Mkey = (self.channel, self.irc.network)
+        plugin.replaying[Mkey] = meeting.Meeting(channel=self.channel,
+                                                 owner=self.nick)
+        try:
+            self.assertError('#startmeeting')
+            self.feedMsg('#abortmeeting')
+            reply = self.irc.takeMsg()
+            assert reply and 'Replay dropped' in reply.args[1], reply
+            self.assertNotIn(Mkey, plugin.replaying)
+        finally:
+            plugin.replaying.pop(Mkey, None)
+
+    def testCarriedOverMeeting(self):
+        import tempfile
+        from . import meeting, plugin
+        # A meeting from before realtime saves were coalesced, kept
+        # across a reload of the plugin.
+        M = meeting.Meeting(channel=self.channel, owner=self.nick,
+                            network=self.irc.network,
+                            extraConfig={'logFileDir': tempfile.mkdtemp()})
+        del M.realtimeSaver
+        Mkey = (self.channel, self.irc.network)
+        plugin.meeting_cache[Mkey] = M
+        try:
+            self.irc.getCallback('MeetBot').die()
+            self.assertRegexp('savestats', 'no statistics')
+            self.assertRegexp('deletemeeting %s %s False'
+                              % (self.channel, self.irc.network),
+                              'Deleted meeting')
+        finally:
+            plugin.meeting_cache.pop(Mkey, None)
+
+    def testPrivateVote(self):
+        import tempfile
+        from . import meeting
+        Config = meeting.Config
+        oldLogFileDir, Config.logFileDir = Config.logFileDir, tempfile.mkdtemp()
+        try:
+            for line in ('#startmeeting', '#vote Ship it?'):
+                self.feedMsg(line)
+                while self.irc.takeMsg():
+                    pass
+            # Channel names are matched with the IRC casemapping.
+            self.assertResponse('vote +1 #TestChannel',
+                                'Received for vote: Ship it?', private=True)
+            self.assertResponse('vote -1 #testchannel2',
+                                'No active meetings in this channel',
+                                private=True)
+        finally:
+            Config.logFileDir = oldLogFileDir
+            self.feedMsg('#endmeeting')
+            while self.irc.takeMsg():
+                pass
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,525 @@
+"""Benchmarks for the meeting save path.
+
+Run from the directory containing the MeetBot plugin, for example:
+    python -m MeetBot.tests.benchmark
+    python -m MeetBot.tests.benchmark render_modes
+"""
+import os, sys
+import tempfile
+import time
+
+os.environ['MEETBOT_RUNNING_TESTS'] = '1'
+from .. import meeting
+from .. import writers
+from .. import journal
+from .. import items
+from .. import plugin
+
+full_writer_map = {
+    '.log.html':    writers.HTMLlog2,
+    '.log.1.html':  writers.HTMLlog1,
+    '.1.html':      writers.HTML1,
+    '.html':        writers.HTML2,
+    '.rst':         writers.ReST,
+    '.rst.html':    writers.HTMLfromReST,
+    '.txt':         writers.Text,
+    '.mw':          writers.MediaWiki,
+    '.moin.txt':    writers.Moin,
+    '.tmp.txt|template=+template.txt':   writers.Template,
+    '.tmp.html|template=+template.html': writers.Template,
+    }
+
+def synthetic_meeting(lines=5000, nicks=50, extraConfig={}, **kwargs):
+    """Return a meeting of `lines` lines said by `nicks` people.
+
+    Every tenth line is a minutes item (topics, actions naming
+    attendees, infos, links)."""
+    config = {'logFileDir': tempfile.mkdtemp(),
+              'writer_map': full_writer_map,
+              'update_realtime': False}
+    config.update(extraConfig)
+    M = meeting.Meeting(channel='#bench', owner='nick0', writeRawLog=True,
+                        extraConfig=config, **kwargs)
+    start = time.mktime((2020, 1, 1, 10, 0, 0, 0, 0, -1))
+    names = ['nick%d' % i for i in range(nicks)]
+    M.addline('nick0', '#startmeeting benchmark',
+              time_=time.localtime(start))
+    commands = ['#topic topic %d', '#action %s and %s do thing %d',
+                '#info information <b>%d</b> & co', '#idea idea %d',
+                '#link http://example.com/%d a link', '#agreed agree %d']
+    for i in range(1, lines):
+        nick = names[i % nicks]
+        if i % 10:
+            line = '%s: what about line %d?' % (names[(i*7) % nicks], i)
+        else:
+            command = commands[(i // 10) % len(commands)]
+            if '%s' in command:
+                line = command % (names[(i*3) % nicks],
+                                  names[(i*5) % nicks], i)
+            else:
+                line = command % i
+            nick = 'nick0'
+        M.addline(nick, line, time_=time.localtime(start + i))
+    M.endtime = time.localtime(start + lines)
+    return M
+
+def full_save(M):
+    """Save M, rendering and writing all the outputs even if nothing
+    changed."""
+    M.config._renderCache.clear()
+    M.config._fingerprints.clear()
+    return M.save()
+
+def best_of(func, repeat=3):
+    """Return the best wall clock time of `repeat` runs of func()."""
+    times = [ ]
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_render_modes(lines=5000):
+    """Full save of a large meeting in each renderMode."""
+    M = synthetic_meeting(lines)
+    reference = None
+    for mode in ('serial', 'thread'):
+        M.config.renderMode = mode
+        results = full_save(M)
+        if reference is None:
+            reference = results
+        assert results == reference, "%s results differ" % mode
+        print("%-8s %7.3f s" % (mode, best_of(lambda: full_save(M))))
+
+
+def bench_action_assignments(actions=80):
+    """Sorting action items by attendee, the index against a regex
+    per (nick, action) pair."""
+    import re
+    class Item(object):
+        def __init__(self, line):
+            self.line = line
+    for nicks in (30, 300, 1000):
+        names = ['nick%d' % i for i in range(nicks)]
+        items = [Item('%s and %s to follow up on item %d'
+                      % (names[(i*7) % nicks], names[(i*13) % nicks], i))
+                 for i in range(actions)]
+        def regex():
+            for nick in names:
+                for m in items:
+                    re.match(r'.*\b%s\b.*' % re.escape(nick), m.line, re.I)
+        def index():
+            writers.ActionAssignments(names, items)
+        print("%5d nicks x %d actions: regex %7.4f s, index %7.4f s"
+              % (nicks, actions, best_of(regex), best_of(index)))
+
+
+def bench_htmllog_realtime(lines=3000, every=10):
+    """Rendering the HTML log after every `every` lines of a meeting,
+    with the fragment cache and with a fresh writer each time."""
+    M = synthetic_meeting(lines)
+    allLines = M.lines
+    records = list(allLines.records())
+    def run(cached):
+        M.lines = meeting.LineStore()
+        writer = writers.HTMLlog2(M)
+        for n in range(0, len(records), every):
+            for record in records[n:n+every]:
+                M.lines.append(*record)
+            if not cached:
+                writer = writers.HTMLlog2(M)
+            writer.format('.log.html')
+        M.lines = allLines
+    print("fresh   %7.3f s" % best_of(lambda: run(False), 1))
+    print("cached  %7.3f s" % best_of(lambda: run(True), 1))
+
+
+def bench_htmllog1(lines=3000, saves=30):
+    """Repeated renders of the pygments HTML log: the time of each
+    should stay flat, and the shared IrcLogsLexer rules unchanged."""
+    from pygments.lexers import IrcLogsLexer
+    M = synthetic_meeting(lines)
+    rules = len(IrcLogsLexer.tokens['msg'])
+    times = [ ]
+    for i in range(saves):
+        start = time.time()
+        writers.HTMLlog1(M).format('.log.1.html')
+        times.append(time.time() - start)
+    for n in (1, 2, saves//2, saves):
+        print("render %2d  %7.3f s" % (n, times[n-1]))
+    print("IrcLogsLexer msg rules: %d -> %d"
+          % (rules, len(IrcLogsLexer.tokens['msg'])))
+
+
+def bench_journal(lines=2000):
+    """Cost per line of journaling a meeting, by fsync interval."""
+    def run(syncInterval):
+        M = meeting.Meeting(channel='#bench', owner='nick0',
+                            extraConfig={'logFileDir': tempfile.mkdtemp(),
+                                         'update_realtime': False})
+        if syncInterval is not None:
+            M.journal = journal.Journal.create(tempfile.mkdtemp(), M,
+                                               syncInterval=syncInterval)
+        M.addline('nick0', '#startmeeting benchmark')
+        start = time.time()
+        for i in range(lines):
+            M.addline('nick%d' % (i % 50), 'what about line %d?' % i)
+        return (time.time() - start) / lines
+    base = run(None)
+    print("no journal        %8.1f us/line" % (1e6*base))
+    for syncInterval in (0, 0.1, 1.0):
+        cost = run(syncInterval) - base
+        print("fsync every %-4ss %8.1f us/line extra" % (syncInterval,
+                                                          1e6*cost))
+
+
+def bench_write_durability(lines=2000):
+    """Full save in each writeDurability mode."""
+    M = synthetic_meeting(lines)
+    for durability in ('none', 'batch', 'file'):
+        M.config.writeDurability = durability
+        print("%-6s %7.3f s" % (durability,
+                                best_of(lambda: full_save(M))))
+
+
+def bench_dirty_tracking(lines=2000):
+    """Saving a meeting again: after a #undo (only the minutes
+    changed), with nothing changed, and rendering everything."""
+    M = synthetic_meeting(lines)
+    M.save()
+    def undo():
+        M.do_undo(nick='nick0')
+        M.save()
+    print("undo     %7.3f s" % best_of(undo))
+    print("none     %7.3f s" % best_of(M.save))
+    print("all      %7.3f s" % best_of(lambda: full_save(M)))
+
+
+def bench_line_store(lines=20000):
+    """Memory of a long log, as text lines and in the LineStore, and
+    rendering the HTML log from each."""
+    import tracemalloc
+    M = synthetic_meeting(10)
+    start = time.mktime((2020, 1, 1, 10, 0, 0, 0, 0, -1))
+    def fill():
+        for i in range(lines):
+            M._addrawline('nick%d' % (i % 50), 'what about line %d?' % i,
+                          start + i)
+    for name in ('text', 'store'):
+        M.lines = meeting.LineStore()
+        tracemalloc.start()
+        fill()
+        if name == 'text':
+            M.lines = list(M.lines)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        writer = writers.HTMLlog2(M)
+        if name == 'text':
+            render = lambda: [writer.formatLine(n+1, l)
+                              for n, l in enumerate(M.lines)]
+        else:
+            render = lambda: [writer.formatRecord(n+1, *r)
+                              for n, r in enumerate(M.lines.records())]
+        print("%-6s %6.1f bytes/line, HTML log %6.3f s"
+              % (name, size / lines, best_of(render)))
+
+
+def bench_supybot_config(lines=300):
+    """Saving, with the configuration from the Supybot registry
+    (enableSupybotBasedConfig) and without."""
+    import supybot.conf as conf
+    from .. import config
+    if not config.settable_attributes:
+        config.setup_config(meeting.Config)
+    group = conf.supybot.plugins.MeetBot
+    lookups = [0]
+    def registryValue(name, channel=None):
+        lookups[0] += 1
+        return group.get(name).getSpecific(channel=channel)()
+    # The registry has the writers of the Config class.
+    extraConfig = {'writer_map': meeting.Config.writer_map}
+    for name, enabled in (('off', False), ('on', True)):
+        config.use_supybot_config.setValue(enabled)
+        try:
+            M = synthetic_meeting(lines, extraConfig=extraConfig,
+                                  getRegistryValue=registryValue)
+        finally:
+            config.use_supybot_config.setValue(False)
+        lookups[0] = 0
+        full_save(M)
+        count = lookups[0]
+        print("%-4s %7.2f ms/save, %4d registry lookups/save"
+              % (name, 1e3*best_of(lambda: full_save(M), 50), count))
+
+
+def bench_time_zones(lines=20000, zones=('UTC', 'America/New_York')):
+    """Adding lines, at the current time, to meetings in different
+    timezones at once."""
+    config = {'logFileDir': tempfile.mkdtemp(), 'update_realtime': False,
+              'dontSave': True}
+    meetings = [ ]
+    for timeZone in zones:
+        M = meeting.Meeting(channel='#chan', owner='nick0',
+                            extraConfig=dict(config, timeZone=timeZone))
+        meetings.append(M)
+    def run():
+        for i in range(lines):
+            meetings[i % len(meetings)].addline('nick%d' % (i % 50),
+                                                'what about line %d?' % i)
+    print("addline  %7.2f us/line" % (1e6*best_of(run)/lines))
+
+
+def bench_streaming(lines=50000):
+    """Peak memory and time of writing the logs of a long meeting,
+    with the whole texts and streamed."""
+    import tracemalloc
+    M = synthetic_meeting(lines, extraConfig={'writer_map': {
+        '.log.html': writers.HTMLlog2, '.log.txt': writers.TextLog}})
+    M.save()
+    for texts in (True, False):
+        def save():
+            M.config._renderCache.clear()
+            M.config._fingerprints.clear()
+            M.config.save(texts=texts)
+        tracemalloc.start()
+        save()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-8s peak %6.1f MB, %7.3f s"
+              % (texts and 'texts' or 'streamed', peak / 2.0**20,
+                 best_of(save)))
+
+
+def bench_templates(lines=2000):
+    """Rendering the two included templates, parsing them each time
+    and from the template cache."""
+    M = synthetic_meeting(lines)
+    template = writers.Template(M)
+    def render():
+        M.config._renderContext = writers.RenderContext(M)
+        try:
+            template.format('.tmp.txt', template='+template.txt')
+            template.format('.tmp.html', template='+template.html')
+        finally:
+            M.config._renderContext = None
+    def uncached():
+        writers._compiledTemplates.clear()
+        render()
+    print("parsed   %7.4f s" % best_of(uncached, 5))
+    print("cached   %7.4f s" % best_of(render, 5))
+
+
+def bench_css(lines=200, reads=1000):
+    """Size of the HTML outputs of a short meeting with embedded and
+    asset stylesheets, and the cost of getting the stylesheet."""
+    M = synthetic_meeting(lines, extraConfig={'writer_map': {
+        '.log.html': writers.HTMLlog2, '.html': writers.HTML2}})
+    for assets in (False, True):
+        M.config.cssAssets = assets
+        results = full_save(M)
+        print("cssAssets=%-5s %6d bytes of HTML" % (
+            assets, sum(len(results[e]) for e in ('.log.html', '.html'))))
+    writer = writers.HTML2(M)
+    M.config.cssAssets = False
+    def read():
+        writers._stylesheets.clear()
+        writer.getCSS('minutes')
+    print("read     %7.2f us" % (1e6*best_of(lambda: [read() for i in
+                                                      range(reads)])/reads))
+    print("cached   %7.2f us" % (1e6*best_of(lambda: [writer.getCSS('minutes')
+                                  for i in range(reads)])/reads))
+
+
+def bench_rst(lines=2000):
+    """Saving the ReST and HTML-from-ReST minutes, with docutils run
+    in the bot and in its worker process."""
+    M = synthetic_meeting(lines, extraConfig={'writer_map': {
+        '.rst': writers.ReST, '.rst.html': writers.HTMLfromReST}})
+    for timeout in (0, 60):
+        M.config.rstTimeout = timeout
+        print("rstTimeout=%-3s %7.3f s"
+              % (timeout, best_of(lambda: full_save(M))))
+    writers.stopDocutils()
+
+
+def bench_items(count=3000):
+    """Memory per minutes item, and rendering them in each format."""
+    import tracemalloc
+    M = synthetic_meeting(10)
+    kinds = [items.Topic, items.Info, items.Action, items.Link,
+             items.Agreed, items.Subtopic]
+    def make():
+        t = time.localtime()
+        return [kinds[i % len(kinds)](nick='nick%d' % (i % 50),
+                    line='http://example.com/%d line <%d> & co' % (i, i),
+                    linenum=i+1, time_=t)
+                for i in range(count)]
+    make()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    minutes = make()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("memory   %7.0f bytes/item" % ((after - before) / count))
+    M.config._renderContext = writers.RenderContext(M)
+    try:
+        for name, escape in (('html2', None), ('text', None),
+                             ('mw', None), ('moin', None),
+                             ('template', writers.html)):
+            if escape:
+                render = lambda m: m.template(M, escape)
+            else:
+                render = lambda m, name=name: getattr(m, name)(M)
+            seconds = best_of(lambda: [render(m) for m in minutes])
+            print("%-8s %7.2f us/item" % (name, 1e6*seconds/count))
+    finally:
+        M.config._renderContext = None
+
+
+def bench_replay(lines=5000):
+    """Replaying a meeting log line by line, with realtime updates
+    every 5 seconds or on every line, and in bulk."""
+    import io
+    M = synthetic_meeting(lines)
+    M.addline('nick0', '#endmeeting', time_=M.endtime)
+    contents = "\n".join(M.lines) + "\n"
+    writer_map = {'.log.html': writers.HTMLlog2,
+                  '.log.txt': writers.TextLog,
+                  '.html': writers.HTML2}
+    for name, interval, bulk in (('lines', 5, False),
+                                 ('every', 0, False),
+                                 ('bulk', 5, True)):
+        def replay():
+            M = meeting.Meeting(channel='#bench', owner='nick0',
+                                extraConfig={
+                                    'logFileDir': tempfile.mkdtemp(),
+                                    'writer_map': writer_map,
+                                    'realtimeSaveInterval': interval})
+            M.process_meeting(io.StringIO(contents), bulk=bulk)
+        seconds = best_of(replay)
+        print("%-8s %7.3f s, %8.0f lines/s"
+              % (name, seconds, lines / seconds))
+
+def bench_commands(lines=20000, chairs=20):
+    """Dispatching #commands, and listing them to the chairs as
+    #startmeeting does."""
+    M = synthetic_meeting(10, extraConfig={'dontSave': True})
+    M._sendPrivateReply = lambda nick, x: None
+    for i in range(chairs):
+        M.chairs['chair%d' % i] = True
+    def dispatch():
+        for i in range(lines):
+            M.addline('nick0', '#idea %d' % i)
+    print("dispatch %7.2f us/line" % (1e6*best_of(dispatch)/lines))
+    def listing():
+        for nick in [M.owner] + list(M.chairs):
+            M.do_private_commands(nick)
+    print("listing  %7.2f us/chair" % (1e6*best_of(listing)/(chairs+1)))
+
+def bench_votes(voters=2000, statuses=200):
+    """Casting ballots (each voter votes twice), asking for the running
+    tally, and ending the vote."""
+    M = synthetic_meeting(10, extraConfig={'dontSave': True})
+    M._sendReply = lambda x: None
+    M.addline('nick0', '#vote the question')
+    def cast():
+        for i in range(2*voters):
+            M.addline('voter%d' % (i % voters), ('+1', '-1', '0')[i % 3])
+    print("cast     %7.2f us/ballot" % (1e6*best_of(cast, 1)/(2*voters)))
+    def status():
+        for i in range(statuses):
+            M.addline('nick1', '#votestatus')
+    print("status   %7.2f us" % (1e6*best_of(status)/statuses))
+    start = time.time()
+    M.addline('nick0', '#endvote')
+    print("endvote  %7.2f us" % (1e6*(time.time() - start)))
+
+def bench_vote_routing(meetings=500, networks=4, lookups=20000):
+    """Finding the meeting a private vote is for, among many running
+    meetings: the scan of every channel name, and the channel index."""
+    cache = plugin.MeetingCache()
+    for i in range(meetings):
+        cache[('#Chan%d' % i, 'net%d' % (i % networks))] = i
+    keys = [('#chan%d' % (i*7 % meetings), 'net%d' % (i*7 % meetings
+                                                     % networks))
+            for i in range(lookups)]
+    def scan():
+        for channel, network in keys:
+            payload = '+1 ' + channel
+            for key in list(cache.keys()):
+                if payload.endswith(key[0]):
+                    break
+    def index():
+        for channel, network in keys:
+            cache.find(channel, network)
+    print("scan     %7.2f us/vote" % (1e6*best_of(scan, 1)/lookups))
+    print("index    %7.2f us/vote" % (1e6*best_of(index)/lookups))
+
+class FakeIrc(object):
+    """Just enough of a supybot Irc for MeetBot.doPrivmsg."""
+    class ChannelState(object):
+        topic = ''
+        def __init__(self):
+            self.users = set(['nick0', 'nick1'])
+            self.ops = set(['nick0'])
+        def isOp(self, nick):
+            return nick in self.ops
+    class State(object):
+        pass
+    network = 'benchnet'
+    nick = 'meetbot'
+    def __init__(self, channels):
+        self.state = self.State()
+        self.state.channels = dict((channel, self.ChannelState())
+                                   for channel in channels)
+        self.queued = [ ]
+    def queueMsg(self, msg):
+        self.queued.append(msg)
+    def error(self, s, **kwargs):
+        self.queued.append(s)
+    reply = error
+
+def bench_privmsg(channels=300, meetings=2, lines=30000):
+    """Per message cost of doPrivmsg, for channels without a meeting
+    (lines and #hashtags) and for a channel with a meeting."""
+    import supybot.ircmsgs as ircmsgs
+    names = ['#chan%d' % i for i in range(channels)]
+    irc = FakeIrc(names)
+    journalDir, meeting.Config.journalDir = meeting.Config.journalDir, 'none'
+    try:
+        bot = plugin.MeetBot(irc)
+    finally:
+        meeting.Config.journalDir = journalDir
+    def message(channel, text):
+        msg = ircmsgs.privmsg(channel, text, prefix='nick1!user@host')
+        msg.channel = channel
+        return msg
+    config = {'logFileDir': tempfile.mkdtemp(), 'update_realtime': False,
+              'dontSave': True}
+    for channel in names[:meetings]:
+        M = meeting.Meeting(channel=channel, owner='nick0',
+                            network=irc.network, extraConfig=config)
+        plugin.meeting_cache[(channel, irc.network)] = M
+    try:
+        for name, text, first in (('quiet', 'just talking', meetings),
+                                  ('hashtag', '#notacommand', meetings),
+                                  ('meeting', 'in the meeting', 0)):
+            msgs = [message(names[first + i % (channels - first)
+                                  if first else i % meetings], text)
+                    for i in range(lines)]
+            def run():
+                for msg in msgs:
+                    bot.doPrivmsg(irc, msg)
+            print("%-8s %7.2f us/message"
+                  % (name, 1e6*best_of(run)/lines))
+    finally:
+        for channel in names[:meetings]:
+            del plugin.meeting_cache[(channel, irc.network)]
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(name[6:] for name in list(globals())
+                                   if name.startswith('bench_'))
+    for name in names:
+        print("== %s" % name)
+        globals()['bench_'+name]()
@@ -1,11 +1,16 @@
+import io
 import os, sys
 #import re
 import tempfile
+import time
 import unittest
 
 os.environ['MEETBOT_RUNNING_TESTS'] = '1'
 from .. import meeting
 from .. import writers
+from .. import journal
+from .. import items
+from .. import plugin
 
 running_tests = True
 
@@ -219,6 +224,849 @@ class MeetBotTest(unittest.TestCase):
         self.assertTrue('<link rel="stylesheet" ' not in results['.log.html'])
         self.assertTrue('<style type="text/css" ' not in results['.log.html'])
 
+    def test_css_assets(self):
+        """Stylesheets can be written once, as shared assets."""
+        import re
+        logdir = tempfile.mkdtemp()
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'logFileDir': logdir,
+                                         'cssAssets': True,
+                                         'update_realtime': False,
+                                         'writer_map': {
+            '.log.html':    writers.HTMLlog2,
+            '.html':        writers.HTML2,
+            }})
+        # The assets are shared: a #restrictlogs meeting doesn't
+        # restrict them.
+        M._restrictlogs = True
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        results = M.save()
+        outputDir = os.path.dirname(M.config.filename())
+        openMode = 0o666 & ~meeting._umask
+        for extension, name in (('.log.html', 'log'), ('.html', 'minutes')):
+            self.assertEqual(os.stat(M.config.filename() + extension).st_mode
+                             & 0o777, openMode & ~M.config.RestrictPerm)
+            self.assertNotIn('<style', results[extension])
+            href = re.search(r'<link rel="stylesheet" type="text/css" '
+                             r'href="([^"]+)">', results[extension]).group(1)
+            asset = os.path.normpath(os.path.join(outputDir, href))
+            self.assertEqual(os.path.dirname(asset), logdir)
+            self.assertEqual(os.stat(asset).st_mode & 0o777, openMode)
+            default = os.path.join(os.path.dirname(writers.__file__),
+                                   'css-%s-default.css' % name)
+            with open(asset) as f, open(default) as g:
+                self.assertEqual(f.read(), g.read())
+        # Stylesheets are read again, to a new asset, when they change.
+        cssfile = os.path.join(logdir, 'style.css')
+        with open(cssfile, 'w') as f:
+            f.write('body { color: red; }\n')
+        css, digest = writers.readCSS(cssfile)
+        self.assertEqual(writers.readCSS(cssfile), (css, digest))
+        with open(cssfile, 'w') as f:
+            f.write('body { color: blue; }\n')
+        self.assertNotEqual(writers.readCSS(cssfile)[1], digest)
+        M.config.cssFile_log = cssfile
+        M.addline('x', 'more')
+        M.save()
+        self.assertEqual(len([n for n in os.listdir(logdir)
+                              if n.startswith('css-')]), 3)
+
+    def test_realtime_append(self):
+        """Realtime updates append to the raw log instead of rewriting it."""
+        logdir = tempfile.mkdtemp()
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            writeRawLog=True,
+                            extraConfig={'logFileDir': logdir,
+                                         'writer_map': {},
+                                         'realtimeSaveInterval': 0})
+        M.addline('x', '#startmeeting')
+        rawname = M.config.filename()+'.log.txt'
+        for i in range(5):
+            M.addline('y', 'line %d' % i)
+            self.assertEqual(open(rawname).read(), "\n".join(M.lines))
+        # The append handle stays open between realtime updates.
+        self.assertTrue(M.config._appendState['.log.txt'][0] is not None)
+        M.addline('x', '#meetingname renamed')
+        M.addline('y', 'after rename')
+        rawname = M.config.filename()+'.log.txt'
+        self.assertEqual(open(rawname).read(), "\n".join(M.lines))
+        M.addline('x', '#endmeeting')
+        self.assertEqual(open(rawname).read(), "\n".join(M.lines))
+        self.assertTrue(M.config._appendState['.log.txt'][0] is None)
+
+    def test_realtime_coalescing(self):
+        """Realtime updates are written at most once per interval."""
+        logdir = tempfile.mkdtemp()
+        events = [ ]
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            writeRawLog=True,
+                            scheduleEvent=lambda f, t: events.append(f),
+                            extraConfig={'logFileDir': logdir,
+                                         'writer_map': {},
+                                         'realtimeSaveInterval': 3600})
+        M.addline('x', '#startmeeting')
+        rawname = M.config.filename()+'.log.txt'
+        for i in range(200):
+            M.addline('y', 'line %d' % i)
+        # Only the first line was written, one flush was scheduled.
+        self.assertEqual(open(rawname).read(), M.lines[0])
+        self.assertEqual(len(events), 1)
+        self.assertEqual(M.realtimeSaver.dirty, 200)
+        events.pop()()
+        self.assertEqual(open(rawname).read(), "\n".join(M.lines))
+        self.assertEqual(M.realtimeSaver.flushes, 2)
+        self.assertEqual(M.realtimeSaver.maxBatch, 200)
+        # #save writes immediately, and clears the pending lines.
+        M.addline('y', 'one more')
+        M.addline('x', '#save')
+        self.assertEqual(M.realtimeSaver.dirty, 0)
+        # A flush scheduled before the meeting is aborted does nothing.
+        M.addline('y', 'last words')
+        self.assertEqual(len(events), 1)
+        M.realtimeSaver.close()
+        M.config.closeAppendFiles()
+        writes = M.config.writes
+        events.pop()()
+        self.assertEqual(M.config.writes, writes)
+        self.assertTrue(M.config._appendState['.log.txt'][0] is None)
+
+    def test_render_modes(self):
+        """Concurrent rendering gives the same results as serial."""
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp(),
+                                         'writer_map': {
+            '.log.html':    writers.HTMLlog2,
+            '.html':        writers.HTML2,
+            '.rst':         writers.ReST,
+            '.rst.html':    writers.HTMLfromReST,
+            '.txt':         writers.Text,
+            '.moin.txt':    writers.Moin,
+            '.tmp.html|template=+template.html': writers.Template,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        serial = M.save()
+        M.config.renderMode = 'thread'
+        M.config._renderCache.clear()
+        results = M.save()
+        self.assertEqual(list(results.keys()), list(serial.keys()))
+        self.assertEqual(results, serial)
+
+    def test_render_context(self):
+        """The writers of a save share one RenderContext."""
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp(),
+                                         'writer_map': {
+            '.html':        writers.HTML2,
+            '.txt':         writers.Text,
+            '.mw':          writers.PmWiki,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        calls = [ ]
+        def filename(url=False):
+            calls.append(url)
+            return meeting.Config.filename(M.config, url)
+        M.config.filename = filename
+        results = M.save()
+        # Only the context works out the file names, once per save.
+        self.assertEqual(calls, [False, True])
+        self.assertTrue(M.config._renderContext is None)
+        # Nothing is kept from one save to the next.
+        M.addline('x', '#action x runs the next save')
+        self.assertNotEqual(M.save(), results)
+        self.assertIn('x runs the next save', M.save()['.mw'])
+
+    def test_htmllog_incremental(self):
+        """The HTML log only renders new lines, with the same result."""
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp(),
+                                         'writer_map': {
+            '.log.html':    writers.HTMLlog2,
+            }})
+        M.config.setWriters()
+        writer = M.config.writers['.log.html']
+        rendered = [ ]
+        formatRecord = writer.formatRecord
+        def countingFormatRecord(lineNumber, *record):
+            rendered.append(lineNumber)
+            return formatRecord(lineNumber, *record)
+        writer.formatRecord = countingFormatRecord
+        lines = [line.strip() for line in
+                 self.all_commands_test_contents.split("\n")]
+        half = len(lines) // 2
+        M.process_meeting("\n".join(lines[:half]))
+        M.save()
+        M.process_meeting("\n".join(lines[half:]))
+        incremental = M.save()['.log.html']
+        self.assertEqual(rendered, list(range(1, len(M.lines)+1)))
+        self.assertEqual(incremental,
+                         writers.HTMLlog2(M).format('.log.html'))
+
+    def test_template_cache(self):
+        """Templates are parsed once, until their file changes, and
+        share their data."""
+        tmpdir = tempfile.mkdtemp()
+        template = os.path.join(tmpdir, 'template.txt')
+        with open(template, 'w') as f:
+            f.write('Title: ${meeting.title}\n')
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tmpdir,
+                                         'writer_map': {
+            '.a.txt|template=%s' % template: writers.Template,
+            '.b.txt|template=+template.txt': writers.Template,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        calls = [ ]
+        get_template2 = writers._BaseWriter.get_template2
+        def counting(self, *args, **kwargs):
+            calls.append(self)
+            return get_template2(self, *args, **kwargs)
+        writers._BaseWriter.get_template2 = counting
+        M.config._renderCache.clear()
+        try:
+            results = M.save()
+        finally:
+            writers._BaseWriter.get_template2 = get_template2
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results['.a.txt'], 'Title: #somechannel meeting\n')
+        self.assertIn('h6k4orkac', results['.b.txt'])
+        tmpl = writers.Template.compiledTemplate(template)
+        self.assertTrue(writers.Template.compiledTemplate(template) is tmpl)
+        with open(template, 'w') as f:
+            f.write('Owned by: ${meeting.owner}\n')
+        self.assertEqual(M.save()['.a.txt'], 'Owned by: x\n')
+        self.assertRaises(IOError, writers.Template.compiledTemplate,
+                          os.path.join(tmpdir, 'missing.txt'))
+
+    def test_html_from_rest(self):
+        """HTMLfromReST converts the ReST of the same save, in a worker
+        process with a time limit."""
+        try:
+            import docutils
+        except ImportError:
+            return
+        logdir = tempfile.mkdtemp()
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'logFileDir': logdir,
+                                         'filenamePattern': 'meeting',
+                                         'update_realtime': False,
+                                         'writer_map': {
+            '.rst':         writers.ReST,
+            '.rst.html':    writers.HTMLfromReST,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        rendered = [ ]
+        render = writers.ReST.render
+        def counting(self):
+            rendered.append(self)
+            return render(self)
+        writers.ReST.render = counting
+        try:
+            M.config._renderCache.clear()
+            results = M.save()
+        finally:
+            writers.ReST.render = render
+        self.assertEqual(len(rendered), 1)
+        filename = os.path.join(logdir, 'meeting.rst.html')
+        with open(filename) as f:
+            self.assertEqual(f.read(), results['.rst.html'])
+        self.assertIn('h6k4orkac', results['.rst.html'])
+        # By default, docutils runs in the bot.
+        self.assertIsNone(writers._docutilsPool)
+        # Too slow: the last output is kept, or an error raised.
+        M.config.rstTimeout = 1e-6
+        M.addline('x', '#info too slow')
+        try:
+            M.config.safeMode = True
+            self.assertEqual(M.save()['.rst.html'], None)
+            with open(filename) as f:
+                self.assertEqual(f.read(), results['.rst.html'])
+            M.config.safeMode = False
+            self.assertRaises(TimeoutError, writers.HTMLfromReST(M).format)
+            # In time, the worker gives what the bot would.
+            M.config.rstTimeout = 60
+            inWorker = writers.HTMLfromReST(M).format()
+        finally:
+            writers.stopDocutils()
+        self.assertIsNone(writers._docutilsPool)
+        M.config.rstTimeout = 0
+        self.assertEqual(writers.HTMLfromReST(M).format(), inWorker)
+
+    def test_htmllog1(self):
+        """The pygments log is rendered the same each time, without
+        changing the shared pygments lexer."""
+        try:
+            from pygments.lexers import IrcLogsLexer
+        except ImportError:
+            return
+        rules = list(IrcLogsLexer.tokens['msg'])
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp()})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        writer = writers.HTMLlog1(M)
+        out = writer.format('.log.1.html')
+        self.assertTrue(isinstance(out, str))
+        self.assertIn('white-space: pre-wrap;', out)
+        self.assertIn('h6k4orkac', out)
+        # Chunks split anywhere give the same.
+        writer.chunkLines = 3
+        self.assertEqual(writer.format('.log.1.html'), out)
+        self.assertEqual(IrcLogsLexer.tokens['msg'], rules)
+
+    def test_journal_restore(self):
+        """A meeting is rebuilt from its journal, without side effects."""
+        extraConfig = {'logFileDir': tempfile.mkdtemp(),
+                       'update_realtime': False}
+        directory = tempfile.mkdtemp()
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            network='somenetwork', oldtopic='old topic',
+                            extraConfig=extraConfig)
+        M.journal = journal.Journal.create(directory, M, syncInterval=0)
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")
+                          if '#endmeeting' not in line))
+        M.addline('x', '#vote are we done?')
+        M.doCastVote('y', '+1', private=True)
+        M.addrawline('bot', 'said by the bot')
+        M.addchair('z')
+        M.journal.close()
+        filename = journal.journalFilename(directory, '#somechannel',
+                                           'somenetwork')
+        self.assertEqual(journal.listJournals(directory), [filename])
+        # A record cut short by a crash is dropped.
+        with open(filename, 'ab') as f:
+            f.write(b'["line","x","#topic hal')
+
+        replies = [ ]
+        M2 = journal.restore(filename, sendReply=replies.append,
+                             setTopic=replies.append,
+                             extraConfig=extraConfig)
+        self.assertEqual(replies, [ ])
+        self.assertEqual(M2.lines, M.lines)
+        self.assertEqual([m.get_replacements(M, str) for m in M2.minutes],
+                         [m.get_replacements(M, str) for m in M.minutes])
+        for attr in ('channel', 'network', 'owner', 'oldtopic',
+                     'attendees', 'chairs', 'activeVote'):
+            self.assertEqual(getattr(M2, attr), getattr(M, attr), attr)
+        for vote, vote2 in zip(M.openVotes, M2.openVotes):
+            for attr in ('question', 'ballots', 'counts', 'publicVoters'):
+                self.assertEqual(getattr(vote2, attr), getattr(vote, attr))
+        self.assertEqual(len(M2.openVotes), 1)
+        self.assertEqual(M2.starttime[:6], M.starttime[:6])
+        # The restored meeting goes on recording, after the good records.
+        M2.addline('x', '#endmeeting')
+        self.assertFalse(os.path.exists(filename))
+
+    def test_write_atomic(self):
+        """Outputs are replaced by renaming, keeping their mode."""
+        import stat
+        logdir = tempfile.mkdtemp()
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'logFileDir': logdir,
+                                         'filenamePattern': 'meeting',
+                                         'writer_map': {
+            '.txt':         writers.Text,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        filename = os.path.join(logdir, 'meeting.txt')
+        os.chmod(filename, 0o640)
+        inode = os.stat(filename).st_ino
+        for durability in ('none', 'file', 'batch'):
+            M.config.writeDurability = durability
+            M.addline('x', '#action x tests %s' % durability)
+            M.save()
+            with open(filename) as f:
+                self.assertIn('x tests %s' % durability, f.read())
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o640)
+        self.assertNotEqual(os.stat(filename).st_ino, inode)
+        M._restrictlogs = True
+        M.save()
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o600)
+        self.assertEqual(sorted(os.listdir(logdir)),
+                         ['meeting.txt'])
+        # The umask for new files is read from /proc where there is one,
+        # without setting it.
+        umask = os.umask(0o027)
+        try:
+            self.assertIn(meeting._readUmask(), (None, 0o027))
+        finally:
+            os.umask(umask)
+
+    def test_write_skip_unchanged(self):
+        """Files whose content didn't change aren't written again."""
+        logdir = tempfile.mkdtemp()
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'logFileDir': logdir,
+                                         'filenamePattern': 'meeting',
+                                         'update_realtime': False,
+                                         'writer_map': {
+            '.txt':         writers.Text,
+            '.html':        writers.HTML2,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        C = M.config
+        self.assertEqual((C.writes, C.writesSkipped), (2, 0))
+        M.save()
+        self.assertEqual((C.writes, C.writesSkipped), (2, 2))
+        # Deleted files are written again, and so are all the files
+        # when their permissions are to change.
+        os.unlink(os.path.join(logdir, 'meeting.txt'))
+        M.save()
+        self.assertEqual((C.writes, C.writesSkipped), (3, 3))
+        M._restrictlogs = True
+        M.save()
+        self.assertEqual((C.writes, C.writesSkipped), (5, 3))
+        self.assertEqual(C.bytesWritten,
+                         2 * os.path.getsize(os.path.join(logdir, 'meeting.html'))
+                         + 3 * os.path.getsize(os.path.join(logdir, 'meeting.txt')))
+
+    def test_write_streamed(self):
+        """Streaming writers write the same files piece by piece."""
+        logdir = tempfile.mkdtemp()
+        writer_map = {
+            '.log.html':    writers.HTMLlog2,
+            '.txt':         writers.Text,
+            '.moin.txt':    writers.Moin,
+            }
+        try:
+            import pygments
+            writer_map['.log.1.html'] = writers.HTMLlog1
+        except ImportError:
+            pass
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            writeRawLog=True,
+                            extraConfig={'logFileDir': logdir,
+                                         'filenamePattern': 'meeting',
+                                         'update_realtime': False,
+                                         'moinFullLogs': True,
+                                         'writer_map': writer_map})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        M.addline('y', '\x01ACTION says caf\xe9\x01')
+        C = M.config
+        C.output_codec = 'utf-16'
+        texts = M.save()
+        C._fingerprints.clear()
+        C._renderCache.clear()
+        results = C.save(texts=False)
+        streamed = ['.log.txt', '.log.html', '.moin.txt']
+        if '.log.1.html' in writer_map:
+            streamed.append('.log.1.html')
+        for extension in streamed:
+            filename = os.path.join(logdir, 'meeting'+extension)
+            self.assertEqual(results[extension], filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), texts[extension].encode('utf-16'))
+        self.assertEqual(results['.txt'], texts['.txt'])
+        # Unchanged streamed outputs aren't rendered or written again.
+        writes = C.writes
+        C.writers['.log.html'].iterformat = None
+        C.save(texts=False)
+        self.assertEqual(C.writes, writes)
+        self.assertEqual(sorted(os.listdir(logdir)),
+                         sorted(['meeting'+e for e in streamed+['.txt']]))
+
+    def test_bulk_replay(self):
+        """A bulk replay saves once, and writes what a replay does."""
+        contents = "\n".join(line.strip() for line in
+                             self.all_commands_test_contents.split("\n"))
+        contents = contents.replace("<x> #endmeeting",
+                                    "* y waves\n10:10:10 <x> #endmeeting")
+        outputs = [ ]
+        for bulk in (False, True):
+            logdir = tempfile.mkdtemp()
+            M = meeting.Meeting(channel='#somechannel', owner='x',
+                                extraConfig={'logFileDir': logdir,
+                                             'filenamePattern': 'meeting',
+                                             'writer_map': {
+                '.log.html':    writers.HTMLlog2,
+                '.txt':         writers.Text,
+                }})
+            saves = [ ]
+            save = M.config.save
+            def countingSave(**kwargs):
+                saves.append(kwargs)
+                return save(**kwargs)
+            M.config.save = countingSave
+            if bulk:
+                count = M.process_meeting(io.StringIO(contents), bulk=True)
+                self.assertEqual(saves, [{'texts': False}])
+                self.assertEqual(count, len(M.lines))
+            else:
+                M.process_meeting(contents)
+                self.assertTrue(len(saves) > 1)
+            self.assertTrue(M.lines[-2].endswith('* y waves'))
+            files = { }
+            for name in os.listdir(logdir):
+                with open(os.path.join(logdir, name), 'rb') as f:
+                    files[name] = f.read()
+            outputs.append(files)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_replay_local(self):
+        """Logs under logFileDir are replayed from the disk."""
+        logdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(logdir, 'old'))
+        with open(os.path.join(logdir, 'old', 'meeting.log.txt'), 'w') as f:
+            f.write("\n".join(line.strip() for line in
+                              self.all_commands_test_contents.split("\n")))
+        def replay(url):
+            M = meeting.Meeting(channel='#somechannel', owner=None,
+                                extraConfig={'logFileDir': logdir,
+                                             'logUrlPrefix':
+                                                 'http://logs.example/',
+                                             'filenamePattern': 'meeting',
+                                             'writer_map': {
+                '.txt':         writers.Text,
+                }})
+            report = M.replay(url)
+            self.assertTrue(M._meetingIsOver)
+            return report
+        self.assertTrue(replay('old/meeting.log.txt').startswith(
+            'Replayed 17 lines'))
+        replay('http://logs.example/old/meeting.log.txt')
+        replay(os.path.join(logdir, 'old', 'meeting.log.txt'))
+        with open(os.path.join(logdir, 'meeting.txt')) as f:
+            self.assertTrue('h6k4orkac' in f.read())
+        self.assertRaises(ValueError, replay, '../meeting.log.txt')
+        self.assertRaises(ValueError, replay, '/etc/passwd')
+        self.assertRaises(ValueError, replay, 'file:///etc/passwd')
+
+    def test_render_changed_only(self):
+        """Outputs are only rendered again when their inputs changed."""
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp(),
+                                         'update_realtime': False,
+                                         'writer_map': {
+            '.log.html':    writers.HTMLlog2,
+            '.txt':         writers.Text,
+            }})
+        M.process_meeting("\n".join(line.strip() for line in
+                          self.all_commands_test_contents.split("\n")))
+        rendered = [ ]
+        for extension, writer in M.config.writers.items():
+            def format(extension, format=writer.format):
+                rendered.append(extension)
+                return format(extension)
+            writer.format = format
+        results = M.save()
+        self.assertEqual(rendered, [ ])
+        # The log doesn't show the minutes...
+        M.do_undo(nick='x')
+        self.assertNotEqual(M.save()['.txt'], results['.txt'])
+        self.assertEqual(rendered, ['.txt'])
+        # ...the minutes show everyone who said something.
+        M.addline('y', 'said by y')
+        M.save()
+        self.assertEqual(rendered, ['.txt', '.log.html', '.txt'])
+        M.save()
+        self.assertEqual(len(rendered), 3)
+        # The text minutes list the results of votes, but not the votes.
+        M.changed('votes')
+        M.save()
+        self.assertEqual(len(rendered), 3)
+        # Everything depends on the settings (which may come from the
+        # registry)...
+        cssfile = os.path.join(M.config.logFileDir, 'log.css')
+        with open(cssfile, 'w') as f:
+            f.write('body { }\n')
+        M.config.cssFile_log = cssfile
+        M.save()
+        self.assertEqual(sorted(rendered[3:]), ['.log.html', '.txt'])
+        # ...and on the files it is made from.
+        with open(cssfile, 'w') as f:
+            f.write('body { color: black; }\n')
+        self.assertIn('color: black', M.save()['.log.html'])
+        self.assertEqual(rendered[5:], ['.log.html'])
+        # Every writer says what it depends on.
+        for name in dir(writers):
+            writer = getattr(writers, name)
+            if isinstance(writer, type) and \
+                    issubclass(writer, writers._BaseWriter) and \
+                    writer is not writers._BaseWriter:
+                self.assertTrue(set(writer.depends) <= set(M.versions), name)
+
+    def test_action_assignments(self):
+        """The assignment index agrees with matching r'\bnick\b'."""
+        import re
+        class Item(object):
+            def __init__(self, line):
+                self.line = line
+        nicks = ['bob', 'Bobby', 'BOB', 'al', 'alice', '[x]', 'x', 'a_b',
+                 'b-c', 'zoë', 'q|away']
+        actions = [Item(line) for line in (
+            'bob and alice do it', 'Bobby: look', 'bobbin along',
+            'ask [x] or x', 'a[x]b', 'a_b and b-c', 'a_bc', 'x-b-c-',
+            'ZOË will', 'ping q|away', 'nobody', '', 'al,bob')]
+        index = writers.ActionAssignments(nicks, actions)
+        self.assertEqual([nick for nick, items in index.byNick], nicks)
+        for nick, items in index.byNick:
+            expected = [m for m in actions
+                        if re.match(r'.*\b%s\b.*' % re.escape(nick),
+                                    m.line, re.I)]
+            self.assertEqual(list(items), expected, nick)
+        self.assertEqual([m.line for m in index.unassigned],
+                         ['bobbin along', 'a_bc', 'nobody', ''])
+
+    def test_commands(self):
+        """Commands are found in the registry, local ones included."""
+        commands = meeting.Meeting.commands
+        self.assertTrue(commands['agree'] is commands['agreed'])
+        self.assertTrue(commands['halp'] is commands['help'])
+        self.assertTrue(commands['progress'] is commands['subtopic'])
+        self.assertTrue(commands['topic'].chairOnly)
+        self.assertFalse(hasattr(commands['info'], 'chairOnly'))
+        calls = [ ]
+        def do_ping(M, nick, line, **kwargs):
+            calls.append((nick, line))
+        @meeting.chairOnly
+        def do_secret(M, nick, line, **kwargs):
+            calls.append((nick, 'secret'))
+        replies = [ ]
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            sendPrivateReply=lambda nick, x:
+                                replies.append((nick, x)),
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp(),
+                                         'update_realtime': False,
+                                         'extraCommands': {
+                                             'Ping': do_ping,
+                                             'secret': do_secret}})
+        M.addline('x', '#startmeeting')
+        self.assertTrue('#ping' in replies[0][1])
+        self.assertTrue('#secret' in replies[0][1])
+        self.assertFalse('ping' in meeting.Meeting.commands)
+        M.addline('y', '#PING a b')
+        M.addline('y', '#secret')
+        M.addline('y', '#topic nope')
+        M.addline('x', '#secret')
+        self.assertEqual(calls, [('y', 'a b'), ('x', 'secret')])
+        self.assertEqual(M.currenttopic, '')
+        M.addline('x', '#topic yes')
+        self.assertEqual(M.currenttopic, 'yes')
+        # The chairs are checked when the methods are called directly.
+        M.do_topic(nick='y', line='nope', linenum=0, time_=None)
+        do_secret(M, 'y', '')
+        M.do_endmeeting('y', '', time.localtime())
+        self.assertEqual(M.currenttopic, 'yes')
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(M._meetingIsOver)
+        # Subclasses have their own registry.
+        class Sub(meeting.Meeting):
+            def do_extra(self, **kwargs):
+                pass
+        self.assertTrue('extra' in Sub.commands)
+        self.assertFalse('extra' in meeting.Meeting.commands)
+
+    def test_votes(self):
+        """Ballots are tallied as they come, in several open votes."""
+        replies = [ ]
+        M = meeting.Meeting(channel='#somechannel', owner='x',
+                            sendReply=replies.append,
+                            extraConfig={'dontSave': True,
+                                         'logFileDir': tempfile.mkdtemp(),
+                                         'update_realtime': False})
+        M.addline('x', '#startmeeting')
+        M.addline('x', '#vote docs: Adopt the docs policy?')
+        M.addline('x', '#vote Ship it?')
+        M.addline('x', '#vote docs: again')
+        self.assertEqual(replies[-1], 'Voting still open on: '
+                                      'docs: Adopt the docs policy?')
+        docs, ship = M.openVotes
+        M.addline('a', '+1')
+        M.addline('b', '-1 docs please no')
+        M.addline('a', '+0 wait, no')
+        M.addline('c', '+1 for docs')
+        M.doCastVote('d', '-1 #somechannel', private=True)
+        self.assertEqual((ship.votesFor, ship.votesAgainst,
+                          ship.abstentions), (0, 1, 1))
+        self.assertEqual(list(ship.publicVoters), ['a'])
+        self.assertEqual(ship.ballots, {'a': 0, 'd': -1})
+        self.assertEqual(docs.counts, [0, 1, 1])
+        del replies[:]
+        M.addline('y', '#votestatus')
+        self.assertEqual(replies, [
+            'Voting on: docs: Adopt the docs policy? '
+            '(Votes for: 1, Votes against: 1, Abstentions: 0)',
+            'Voting on: Ship it? '
+            '(Votes for: 0, Votes against: 1, Abstentions: 1)'])
+        M.addline('x', '#endvote docs')
+        self.assertEqual(M.openVotes, [ship])
+        self.assertEqual(M.activeVote, 'Ship it?')
+        self.assertEqual(replies[-1], 'Motion carried')
+        M.addline('x', '#endmeeting')
+        self.assertEqual(M.openVotes, [ ])
+        self.assertEqual(M.minutes[-1].line, 'Ship it? (Denied)')
+        context = writers.RenderContext(M)
+        self.assertEqual(context.votes, (
+            ('docs: Adopt the docs policy?',
+             'Motion carried (For: 1, Against: 1, Abstained: 0)', 2,
+             ('b', 'c')),
+            ('Ship it?',
+             'Motion denied (For: 0, Against: 1, Abstained: 1)', 3,
+             ('a',))))
+        # The results and voters are also there in their old form.
+        self.assertEqual(M.votes, {
+            'docs: Adopt the docs policy?':
+                ('Motion carried (For: 1, Against: 1, Abstained: 0)', 2),
+            'Ship it?':
+                ('Motion denied (For: 0, Against: 1, Abstained: 1)', 3)})
+        self.assertEqual(M.publicVoters, {
+            'docs: Adopt the docs policy?': ['b', 'c'], 'Ship it?': ['a']})
+
+    def test_meeting_cache(self):
+        """The channel index of running meetings follows the cache."""
+        cache = plugin.MeetingCache({('#a', 'net'): 'a'})
+        cache[('#ba', 'net')] = 'ba'
+        cache[('#A[x]', 'other')] = 'other'
+        self.assertEqual(cache.find('#A', 'net'), 'a')
+        self.assertEqual(cache.find('#bA', 'net'), 'ba')
+        self.assertEqual(cache.find('#a{X}', 'other'), 'other')
+        self.assertEqual(cache.find('#a', 'other'), None)
+        del cache[('#a', 'net')]
+        self.assertEqual(cache.find('#a', 'net'), None)
+        self.assertEqual(plugin.MeetingCache(cache).byChannel,
+                         cache.byChannel)
+
+    def test_time_zones(self):
+        """Meetings in different timezones run at once, without
+        changing the TZ of the process."""
+        oldTZ = os.environ.get('TZ')
+        t = 1577869500  # 2020-01-01 09:05:00 UTC
+        meetings = [ ]
+        for timeZone in ('UTC', 'America/New_York', 'Asia/Kolkata'):
+            M = meeting.Meeting(channel='#chan', owner='x',
+                                extraConfig={'timeZone': timeZone,
+                                             'logFileDir': tempfile.mkdtemp(),
+                                             'update_realtime': False})
+            M.addline('x', '#startmeeting', time_=t + 7)
+            meetings.append(M)
+        for M in meetings:
+            M.addline('x', 'hello', time_=t + 61)
+        self.assertEqual([M.lines[1] for M in meetings],
+                         ['09:06 <x> hello', '04:06 <x> hello',
+                          '14:36 <x> hello'])
+        self.assertEqual([time.strftime("%H:%M:%S", M.starttime)
+                          for M in meetings],
+                         ['09:05:07', '04:05:07', '14:35:07'])
+        self.assertEqual(os.environ.get('TZ'), oldTZ)
+        # Times of replayed logs are read in the timezone of the meeting.
+        M = meetings[1]
+        self.assertEqual(M.timestamp(M.starttime), t + 7)
+        self.assertEqual(M.timeZone.localtime(t + 7), M.starttime)
+        self.assertEqual(meeting.TimeZone('No/Such_Zone').minute(t), 545)
+
+    def test_time_zones_replay(self):
+        """Replayed logs have 1900 dates, when the offsets of most
+        timezones were not whole minutes."""
+        for timeZone in ('Europe/Amsterdam', 'Asia/Kolkata'):
+            M = meeting.Meeting(channel='#chan', owner='a',
+                                extraConfig={'timeZone': timeZone,
+                                             'dontSave': True,
+                                             'update_realtime': False})
+            M.process_meeting("10:00:00 <a> #startmeeting\n"
+                              "10:00:30 <a> #info hi\n")
+            self.assertEqual(list(M.lines), ['10:00 <a> #startmeeting',
+                                             '10:00 <a> #info hi'])
+            self.assertEqual(M.minutes[0].time, '10:00')
+            self.assertEqual(time.strftime("%H:%M:%S", M.starttime),
+                             '10:00:00')
+
+    def test_supybot_config_proxy(self):
+        """With enableSupybotBasedConfig, the registry values for the
+        channel are taken once, and again when they change."""
+        import supybot.conf as conf
+        from .. import config
+        if not config.settable_attributes:
+            config.setup_config(meeting.Config)
+        group = conf.supybot.plugins.MeetBot
+        def registryValue(name, channel=None):
+            return group.get(name).getSpecific(channel=channel)()
+        logFileDir = tempfile.mkdtemp()
+        group.get('logFileDir').get('#proxychan').setValue(logFileDir)
+        config.use_supybot_config.setValue(True)
+        try:
+            M = meeting.Meeting(channel='#proxychan', owner='x',
+                                getRegistryValue=registryValue,
+                                extraConfig={'update_realtime': False})
+        finally:
+            config.use_supybot_config.setValue(False)
+        self.assertTrue(isinstance(M.config, config.SupybotConfigProxy))
+        self.assertEqual(M.config.logFileDir, logFileDir)
+        self.assertEqual(vars(M.config)['logFileDir'], logFileDir)
+        self.assertTrue(M.config.filename is M.config.filename)
+        M.addline('x', '#startmeeting')
+        # Values set on the config itself win over the registry.
+        M.config.pygmentizeStyle = 'mine'
+        group.get('timeZone').get('#proxychan').setValue('Asia/Kolkata')
+        group.get('pygmentizeStyle').get('#proxychan').setValue('default')
+        self.assertEqual(M.config.timeZone, 'UTC')
+        M.addline('x', '#save')
+        self.assertEqual(M.config.timeZone, 'Asia/Kolkata')
+        self.assertEqual(M.config.pygmentizeStyle, 'mine')
+        self.assertTrue(os.path.exists(M.config.filename() + '.html'))
+
+    def test_line_store(self):
+        """The LineStore gives the log lines in their text form, and
+        the HTML log renders its fields like it parses the text."""
+        M = meeting.Meeting(channel='#chan', owner='x',
+                            extraConfig={'update_realtime': False})
+        t = time.localtime(time.mktime((2020, 1, 1, 9, 5, 0, 0, 0, -1)))
+        said = [('x', 'hello'), ('x', '\x01ACTION  waves\x01'),
+                ('y<z', '  #topic <b>'), ('bob', 'alice: hi & bye'),
+                ('a b', 'odd nick'), ('a>b', 'odder'), ('', 'no nick'),
+                ('x', '\x01ACTION\x01'), ('a b', '\x01ACTION spaced\x01'),
+                ('x', '')]
+        for nick, line in said:
+            M.addrawline(nick, line, time_=t)
+        self.assertEqual(list(M.lines), [
+            '09:05 <x> hello', '09:05 * x waves', '09:05 <y<z>   #topic <b>',
+            '09:05 <bob> alice: hi & bye', '09:05 <a b> odd nick',
+            '09:05 <a>b> odder', '09:05 <> no nick', '09:05 * x ',
+            '09:05 * a b spaced', '09:05 <x> '])
+        self.assertEqual(M.lines[1:3], list(M.lines)[1:3])
+        self.assertEqual(M.lines[-1], '09:05 <x> ')
+        self.assertEqual(M.lines.record(1), (545, 'x', 'waves', True))
+        self.assertEqual(M.lines.nicks, ['x', 'y<z', 'bob', 'a b', 'a>b', ''])
+        writer = writers.HTMLlog2(M)
+        for n, l in enumerate(M.lines):
+            self.assertEqual(writer.formatRecord(n+1, *M.lines.record(n)),
+                             writer.formatLine(n+1, l), l)
+
+    def test_item_fields(self):
+        """Minutes items only hold their own fields."""
+        t = time.localtime(time.mktime((2020, 1, 1, 9, 5, 0, 0, 0, -1)))
+        link = items.Link(nick='a<b', line='http://x/"y" see <this>',
+                          linenum='7', time_=t)
+        self.assertFalse(hasattr(link, '__dict__'))
+        self.assertEqual((link.linenum, link.time), (7, '09:05'))
+        self.assertRaises(AttributeError, setattr, link, 'other', 1)
+        M = meeting.Meeting(channel='#chan', owner='a<b',
+                            extraConfig={'logFileDir': tempfile.mkdtemp(),
+                                         'update_realtime': False})
+        M.addline('a<b', '#startmeeting')
+        repl = link.get_replacements(M, writers.html)
+        self.assertEqual((repl['nick'], repl['line'], repl['url'],
+                          repl['url_quoteescaped'], repl['itemtype']),
+                         ('a&lt;b', 'see &lt;this&gt;', 'http://x/"y"',
+                          'http://x/%22y%22', 'LINK'))
+        self.assertEqual(sorted(link.template(M, writers.html)),
+                         ['anchor', 'itemtype', 'line', 'link', 'nick',
+                          'time', 'url', 'url_quoteescaped'])
+
     def test_filenamevars(self):
         def getM(fnamepattern):
             M = meeting.Meeting(channel='somechannel',
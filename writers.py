@@ -29,7 +29,13 @@
 ###
 
 import os, re, time
+import hashlib
+import itertools
 import textwrap
+import threading
+import multiprocessing
+import types
+from functools import cached_property
 
 from . import __version__
 
@@ -71,10 +77,210 @@ def replaceWRAP(item):
     return re_wrap.sub(repl, item)
 
 
+class RenderContext(object):
+    """What the writers need from a meeting, worked out once per save.
+
+    Config.save makes one of these at the start of each save, and the
+    writers (and items, through Config.filename) use it instead of
+    recomputing filenames, times, and the lists of action items,
+    votes and attendees for every output.  It must be treated as
+    read-only.  Most attributes are computed on first use, since
+    realtime updates only need a few of them.
+    """
+    def __init__(self, M):
+        self.M = M
+        self.filename = M.config.filename()
+        self.urlBasename = M.config.filename(url=True)
+        self.basename = os.path.basename(self.filename)
+        # The ReST minutes made by the save, by ReST writer class.
+        self.rst = { }
+
+    @cached_property
+    def configVersion(self):
+        return self.M.config.configVersion()
+
+    @cached_property
+    def pageTitle(self):
+        M = self.M
+        if M._meetingTopic:
+            title = "%s: %s" % (M.channel, M._meetingTopic)
+            if "meeting" not in M._meetingTopic.lower():
+                title += ' meeting'
+            return title
+        return "%s meeting" % M.channel
+
+    @cached_property
+    def replacements(self):
+        M = self.M
+        return types.MappingProxyType({
+                'pageTitle':self.pageTitle,
+                'owner':M.owner,
+                'starttime':time.strftime("%H:%M:%S", M.starttime),
+                'starttimeshort':time.strftime("%H:%M", M.starttime),
+                'startdate':time.strftime("%d %b", M.starttime),
+                'endtime':time.strftime("%H:%M:%S", M.endtime),
+                'endtimeshort':time.strftime("%H:%M", M.endtime),
+                'timeZone':M.config.timeZone,
+                'fullLogs':self.basename+'.log.html',
+                'fullLogsFullURL':self.urlBasename+'.log.html',
+                'MeetBotInfoURL':M.config.MeetBotInfoURL,
+                'MeetBotVersion':__version__,
+             })
+
+    @cached_property
+    def topicTree(self):
+        """The minutes grouped by topic: ((topic, items), ...).
+
+        The first group holds the items before the first topic, and
+        has None as its topic."""
+        tree = [ ]
+        topic, items = None, [ ]
+        for m in self.M.minutes:
+            if m.itemtype == "TOPIC":
+                tree.append((topic, tuple(items)))
+                topic, items = m, [ ]
+            else:
+                items.append(m)
+        tree.append((topic, tuple(items)))
+        return tuple(tree)
+
+    @cached_property
+    def actions(self):
+        return tuple(m for m in self.M.minutes if m.itemtype == "ACTION")
+
+    @cached_property
+    def done(self):
+        return tuple(m for m in self.M.minutes if m.itemtype == "DONE")
+
+    @cached_property
+    def votes(self):
+        """((vote, summary, startline, public voters), ...)"""
+        return tuple((vote.question, vote.summary, vote.startLine,
+                      tuple(vote.publicVoters))
+                     for vote in self.M.voteTallies.values())
+
+    @cached_property
+    def nickCounts(self):
+        """((nick, lines said), ...), most talkative first."""
+        nicks = [ (n,c) for (n,c) in list(self.M.attendees.items()) ]
+        nicks.sort(key=lambda x: x[1], reverse=True)
+        return tuple(nicks)
+
+    @cached_property
+    def nicks(self):
+        """The attendees, in case-insensitive alphabetical order."""
+        return tuple(sorted(list(self.M.attendees.keys()),
+                            key=lambda x: x.lower()))
+
+    @cached_property
+    def assignments(self):
+        return ActionAssignments(self.nicks, self.actions)
+
+    @cached_property
+    def templateData(self):
+        # What the genshi templates get, the same for all of them.
+        return _BaseWriter(self.M).get_template2()
+
+
+def joinChunks(strings, sep, count=1000):
+    """Yield sep.join(strings), in pieces of up to `count` strings."""
+    chunk = [ ]
+    first = True
+    for string in strings:
+        chunk.append(string)
+        if len(chunk) == count:
+            yield ('' if first else sep) + sep.join(chunk)
+            first = False
+            chunk = [ ]
+    if chunk or first:
+        yield ('' if first else sep) + sep.join(chunk)
+
+
+def _foldcase(text):
+    """Lowercase text, keeping its length (so indexes still match)."""
+    if text.isascii():
+        return text.lower()
+    return ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+class ActionAssignments(object):
+    """Which action items name which attendees.
+
+    An action item is assigned to every attendee whose nick appears
+    in it as a whole word, ignoring case (the same as matching
+    r'\bnick\b' with re.I).  All the nicks go into one trie, so each
+    action is scanned once instead of once per attendee.
+
+    byNick is ((nick, (action, ...)), ...) for all the nicks given, in
+    that order, and unassigned is the actions naming nobody.
+    """
+    def __init__(self, nicks, actions):
+        trie = { }
+        for nick in nicks:
+            if not nick: continue
+            node = trie
+            for c in _foldcase(nick):
+                node = node.setdefault(c, { })
+            node.setdefault(None, [ ]).append(nick)
+        self._trie = trie
+        byNick = dict((nick, [ ]) for nick in nicks)
+        unassigned = [ ]
+        for m in actions:
+            found = self.find(m.line)
+            for nick in found:
+                byNick[nick].append(m)
+            if not found:
+                unassigned.append(m)
+        self.byNick = tuple((nick, tuple(byNick[nick])) for nick in nicks)
+        self.unassigned = tuple(unassigned)
+
+    def find(self, line):
+        """Return the set of nicks named in line."""
+        trie = self._trie
+        text = _foldcase(line)
+        n = len(line)
+        # \b is where a word character meets a non-word one (or an end).
+        word = [c.isalnum() or c == '_' for c in line] + [False]
+        found = set()
+        before = False
+        for i in range(n):
+            here = word[i]
+            if here != before:
+                node = trie
+                j = i
+                while j < n:
+                    node = node.get(text[j])
+                    if node is None:
+                        break
+                    j += 1
+                    if None in node and word[j-1] != word[j]:
+                        found.update(node[None])
+            before = here
+        return found
+
+
 class _BaseWriter(object):
+    # The parts of Meeting.versions the output depends on, None
+    # meaning all of them.  Config.save only renders a writer again
+    # when one of them has changed.
+    depends = None
+    # Writers which can yield their output piece by piece set this,
+    # and implement iterformat().  Config.save can then write the
+    # pieces out as they come, when it doesn't need the whole text.
+    streaming = False
+
     def __init__(self, M, **kwargs):
         self.M = M
 
+    @property
+    def context(self):
+        """The RenderContext of the save in progress.
+
+        Outside of Config.save, a new one is made on each access."""
+        context = self.M.config._renderContext
+        if context is None:
+            context = RenderContext(self.M)
+        return context
+
     def format(self, extension=None):
         """Override this method to implement the formatting.
 
@@ -87,74 +293,57 @@ class _BaseWriter(object):
         """
         raise NotImplementedError
 
+    def iterformat(self, extension=None, **kwargs):
+        """Yield the output of format() in pieces.
+
+        Streaming writers override this (and then format() is just
+        the pieces joined)."""
+        yield self.format(extension, **kwargs)
+
+    def inputFiles(self, extension=None, **kwargs):
+        """Return the files, other than the meeting, which the output
+        of format(extension, **kwargs) is made from.
+
+        Config.save renders the writer again when one of them has
+        changed."""
+        return ()
+
     @property
     def pagetitle(self):
-        if self.M._meetingTopic:
-            title = "%s: %s" % (self.M.channel, self.M._meetingTopic)
-            if "meeting" not in self.M._meetingTopic.lower():
-                title += ' meeting'
-            return title
-        return "%s meeting" % self.M.channel
+        return self.context.pageTitle
 
     def replacements(self):
-        return {'pageTitle':self.pagetitle,
-                'owner':self.M.owner,
-                'starttime':time.strftime("%H:%M:%S", self.M.starttime),
-                'starttimeshort':time.strftime("%H:%M", self.M.starttime),
-                'startdate':time.strftime("%d %b", self.M.starttime),
-                'endtime':time.strftime("%H:%M:%S", self.M.endtime),
-                'endtimeshort':time.strftime("%H:%M", self.M.endtime),
-                'timeZone':self.M.config.timeZone,
-                'fullLogs':self.M.config.basename+'.log.html',
-                'fullLogsFullURL':self.M.config.filename(url=True)+'.log.html',
-                'MeetBotInfoURL':self.M.config.MeetBotInfoURL,
-                'MeetBotVersion':__version__,
-             }
+        return dict(self.context.replacements)
 
     def iterNickCounts(self):
-        nicks = [ (n,c) for (n,c) in list(self.M.attendees.items()) ]
-        nicks.sort(key=lambda x: x[1], reverse=True)
-        return nicks
+        return self.context.nickCounts
 
     def iterActionItemsNick(self):
-        for nick in sorted(list(self.M.attendees.keys()), key=lambda x: x.lower()):
-            def nickitems():
-                for m in self.M.minutes:
-                    # The hack below is needed because of pickling problems
-                    if m.itemtype != "ACTION": continue
-                    if not re.match(r'.*\b%s\b.*' % re.escape(nick), m.line, re.I):
-                        continue
-                    m.assigned = True
-                    yield m
-            yield nick, nickitems()
+        return self.context.assignments.byNick
     def iterActionItemsUnassigned(self):
-        for m in self.M.minutes:
-            if m.itemtype != "ACTION": continue
-            if getattr(m, 'assigned', False): continue
-            yield m
+        return self.context.assignments.unassigned
 
     def get_template(self, escape=lambda s: s):
         M = self.M
         repl = self.replacements()
 
         MeetingItems = [ ]
-        # We can have initial items with NO initial topic.  This
-        # messes up the templating, so, have this null topic as a
-        # stopgap measure.
-        nextTopic = {'topic':{'itemtype':'TOPIC', 'topic':'Prologue',
-                              'nick':'',
-                              'time':'', 'link':'', 'anchor':''},
-                     'items':[]}
-        haveTopic = False
-        for m in M.minutes:
-            if m.itemtype == "TOPIC":
-                if nextTopic['topic']['nick'] or nextTopic['items']:
-                    MeetingItems.append(nextTopic)
-                nextTopic = {'topic':m.template(M, escape), 'items':[]}
-                haveTopic = True
+        topicTree = self.context.topicTree
+        for topic, items in topicTree:
+            if topic is None:
+                # We can have initial items with NO initial topic.
+                # This messes up the templating, so, have this null
+                # topic as a stopgap measure.
+                if not items and len(topicTree) > 1:
+                    continue
+                topic = {'itemtype':'TOPIC', 'topic':'Prologue',
+                         'nick':'',
+                         'time':'', 'link':'', 'anchor':''}
             else:
-                nextTopic['items'].append(m.template(M, escape))
-        MeetingItems.append(nextTopic)
+                topic = topic.template(M, escape)
+            MeetingItems.append({'topic':topic,
+                                 'items':[m.template(M, escape)
+                                          for m in items]})
         repl['MeetingItems'] = MeetingItems
         # Format of MeetingItems:
         # [ {'topic': {item_dict},
@@ -183,8 +372,7 @@ class _BaseWriter(object):
         #              'url_quoteescaped': 'url' but with " escaped for use in
         #                                  <a href="$url_quoteescaped">
         ActionItems = [ ]
-        for m in M.minutes:
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             ActionItems.append(escape(m.line))
         repl['ActionItems'] = ActionItems
         # Format of ActionItems: It's just a very simple list of lines.
@@ -250,6 +438,10 @@ class _BaseWriter(object):
         return repl
 
 
+# The genshi templates parsed by Template, by path, with the version
+# (mtime, size, inode) of the file they were parsed from.
+_compiledTemplates = { }
+
 class Template(_BaseWriter):
     """Format a notes file using the genshi templating engine
 
@@ -266,18 +458,39 @@ class Template(_BaseWriter):
     If a template ends in .txt, parse with a text-based genshi
     templater.  Otherwise, parse with a HTML-based genshi templater.
     """
+    depends = ('attendees', 'minutes', 'meta')
     def format(self, extension=None, template='+template.html'):
-        repl = self.get_template2()
+        repl = self.context.templateData
+        tmpl = self.compiledTemplate(self.templatePath(template))
+        stream = tmpl.generate(**repl)
+        return stream.render()
 
+    def inputFiles(self, extension=None, template='+template.html'):
+        return (self.templatePath(template),)
+
+    @staticmethod
+    def templatePath(template):
         # If `template` begins in '+', then it in relative to the
         # MeetBot source directory.
         if template[0] == '+':
             template = os.path.join(os.path.dirname(__file__), template[1:])
-        # If we don't test here, it might fail in the try: block
-        # below, then f.close() will fail and mask the original
-        # exception
-        if not os.access(template, os.F_OK):
+        return template
+
+    @staticmethod
+    def compiledTemplate(template):
+        """Return the genshi template in the file `template`.
+
+        Parsed templates are kept, and only parsed again if their
+        file is changed."""
+        path = os.path.realpath(template)
+        try:
+            st = os.stat(path)
+        except OSError:
             raise IOError('File not found: %s'%template)
+        version = (st.st_mtime_ns, st.st_size, st.st_ino)
+        cached = _compiledTemplates.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
 
         # Do we want to use a text template or HTML ?
         import genshi.template
@@ -287,14 +500,30 @@ class Template(_BaseWriter):
             Template = genshi.template.MarkupTemplate    # HTML-like
 
         # Do the actual templating work
-        try:
-            f = open(template, 'r')
+        with open(path, 'r') as f:
             tmpl = Template(f.read())
-            stream = tmpl.generate(**repl)
-        finally:
-            f.close()
+        _compiledTemplates[path] = (version, tmpl)
+        return tmpl
 
-        return stream.render()
+
+# Stylesheets read by _CSSmanager, by path: (version, css, digest),
+# version being the (mtime, size, inode) of the file when read.
+_stylesheets = { }
+
+def readCSS(filename):
+    """Return (css, digest) of the stylesheet filename.
+
+    Files are only read again when they change."""
+    st = os.stat(filename)
+    version = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _stylesheets.get(filename)
+    if cached is not None and cached[0] == version:
+        return cached[1:]
+    with open(filename) as f:
+        css = f.read()
+    digest = hashlib.sha1(css.encode('utf-8')).hexdigest()
+    _stylesheets[filename] = (version, css, digest)
+    return css, digest
 
 
 class _CSSmanager(object):
@@ -303,28 +532,33 @@ class _CSSmanager(object):
         %s
         </style>
         ''')
+    _css_link = '''<link rel="stylesheet" type="text/css" href="%s">'''
+    def cssFilename(self, name):
+        """Return the name of the stylesheet file of cssFile_<name>."""
+        cssfile = getattr(self.M.config, 'cssFile_'+name, '')
+        if cssfile in ('', 'default'):
+            # default CSS file
+            return os.path.join(os.path.dirname(__file__),
+                                'css-'+name+'-default.css')
+        return cssfile
+
     def getCSS(self, name):
         cssfile = getattr(self.M.config, 'cssFile_'+name, '')
         if cssfile.lower() == 'none':
             # special string 'None' means no style at all
             return ''
-        elif cssfile in ('', 'default'):
-            # default CSS file
-            css_fname = os.path.join(os.path.dirname(__file__),
-                                     'css-'+name+'-default.css')
-        else:
-            css_fname = cssfile
+        css_fname = self.cssFilename(name)
         try:
             # Stylesheet specified
             if getattr(self.M.config, 'cssEmbed_'+name, True):
                 # external stylesheet
-                with open(css_fname) as f:
-                    css = f.read()
+                css, digest = readCSS(css_fname)
+                if getattr(self.M.config, 'cssAssets', False):
+                    return self._css_link%self.cssAsset(name, css, digest)
                 return self._css_head%css
             else:
                 # linked stylesheet
-                css_head = ('''<link rel="stylesheet" type="text/css" '''
-                            '''href="%s">'''%cssfile)
+                css_head = self._css_link%cssfile
                 return css_head
         except Exception as exc:
             if not self.M.config.safeMode:
@@ -335,7 +569,7 @@ class _CSSmanager(object):
             try:
                 css_fname = os.path.join(os.path.dirname(__file__),
                                          'css-'+name+'-default.css')
-                css = open(css_fname).read()
+                css = readCSS(css_fname)[0]
                 return self._css_head%css
             except:
                 if not self.M.config.safeMode:
@@ -343,44 +577,109 @@ class _CSSmanager(object):
                 traceback.print_exc()
                 return ''
 
+    def cssAsset(self, name, css, digest):
+        """Write the stylesheet css as an asset shared by all meetings
+        (if not there already), and return its URL relative to the
+        output.
+
+        Assets are named after their content, so they are only written
+        once, and can be cached by browsers forever.  They are for all
+        meetings, so they never get the permissions of #restrictlogs."""
+        config = self.M.config
+        asset = os.path.join(config.logFileDir,
+                             'css-%s-%s.css' % (name, digest[:16]))
+        if not os.path.exists(asset) and \
+               not getattr(config, "dontSave", False):
+            config.writeToFile(config.enc(css), asset, restrict=False)
+        outputDir = os.path.dirname(self.context.filename)
+        return os.path.relpath(asset, outputDir).replace(os.sep, '/')
+
 
 class TextLog(_BaseWriter):
     def format(self, extension=None):
-        M = self.M
         """Write raw text logs."""
-        return "\n".join(M.lines)
+        return "".join(self.iterformat(extension))
+    def iterformat(self, extension=None):
+        return self.iterformatAppend(0)[0]
+    def formatAppend(self, start):
+        """Return the text following the first `start` lines.
+
+        Returns a (text, position) tuple, where position is what to
+        pass as `start` next time."""
+        chunks, position = self.iterformatAppend(start)
+        return "".join(chunks), position
+    def iterformatAppend(self, start):
+        """Like formatAppend(), with the text as an iterator of pieces."""
+        M = self.M
+        end = len(M.lines)
+        chunks = joinChunks((M.lines[i] for i in range(start, end)), "\n")
+        if start and end > start:
+            chunks = itertools.chain(("\n",), chunks)
+        return chunks, end
     update_realtime = True
+    update_append = True
+    streaming = True
+    depends = ('lines',)
+
+
+# The pygments lexer and formatter of HTMLlog1, by style.  Both are
+# made once and reused by every save.
+_pygmentsPipelines = { }
+
+def _pygmentsPipeline(style):
+    """Return the (lexer, formatter) for HTML logs in style."""
+    try:
+        return _pygmentsPipelines[style]
+    except KeyError:
+        pass
+    # pygments lexing setup:
+    # (pygments HTML formatter handles HTML escaping)
+    from pygments.lexers import IrcLogsLexer
+    from pygments.formatters import HtmlFormatter
+    import pygments.token as token
+    from pygments.lexer import bygroups
+    # Don't do any encoding with pygments.  That's only right before
+    # the i/o functions in the Config object.
+    formatter = HtmlFormatter(lineanchors='l', full=True, style=style)
+    class Lexer(IrcLogsLexer):
+        # IrcLogsLexer, highlighting our #commands.  The 'msg' state is
+        # redefined here: the IrcLogsLexer one is left alone.
+        tokens = {'msg': IrcLogsLexer.tokens['msg'][:1] + [
+            # match:   #topic commands
+            (r"(\#topic[ \t\f\v]*)(.*\n)",
+             bygroups(token.Keyword, token.Generic.Heading), '#pop'),
+             # match:   #command   (others)
+            (r"(\#[^\s]+[ \t\f\v]*)(.*\n)",
+             bygroups(token.Keyword, token.Generic.Strong), '#pop'),
+            ] + IrcLogsLexer.tokens['msg'][1:]}
+    pipeline = _pygmentsPipelines[style] = (Lexer(), formatter)
+    return pipeline
 
 
 class HTMLlog1(_BaseWriter):
+    depends = ('lines', 'meta')
+    # Lines lexed per pygments call.
+    chunkLines = 1000
+    streaming = True
     def format(self, extension=None):
         """Write pretty HTML logs."""
+        return "".join(self.iterformat(extension))
+
+    def iterformat(self, extension=None):
         M = self.M
-        # pygments lexing setup:
-        # (pygments HTML formatter handles HTML escaping)
-        import pygments
-        from pygments.lexers import IrcLogsLexer
-        from pygments.formatters import HtmlFormatter
-        import pygments.token as token
-        from pygments.lexer import bygroups
-        # Don't do any encoding in this function with pygments.
-        # That's only right before the i/o functions in the Config
-        # object.
-        formatter = HtmlFormatter(lineanchors='l',
-                                  full=True, style=M.config.pygmentizeStyle,
-                                  outencoding=self.M.config.output_codec)
-        Lexer = IrcLogsLexer
-        Lexer.tokens['msg'][1:1] = \
-           [ # match:   #topic commands
-            (r"(\#topic[ \t\f\v]*)(.*\n)",
-             bygroups(token.Keyword, token.Generic.Heading), '#pop'),
-             # match:   #command   (others)
-            (r"(\#[^\s]+[ \t\f\v]*)(.*\n)",
-             bygroups(token.Keyword, token.Generic.Strong), '#pop'),
-           ]
-        lexer = Lexer()
-        #from rkddp.interact import interact ; interact()
-        out = pygments.highlight("\n".join(M.lines), lexer, formatter)
+        lexer, formatter = _pygmentsPipeline(M.config.pygmentizeStyle)
+        # The log is lexed a chunk of lines at a time (the lexer
+        # starts over at each line anyway), into one formatter call.
+        chunks = (chunk+"\n" for chunk in
+                  joinChunks(M.lines, "\n", self.chunkLines))
+        tokens = itertools.chain.from_iterable(
+            lexer.get_tokens(chunk) for chunk in chunks)
+        # pygments writes all of its output in that one call: it is
+        # kept as the pieces written (and not joined), which are let go
+        # of as they are yielded.
+        pieces = [ ]
+        formatter.format(tokens, types.SimpleNamespace(write=pieces.append))
+        pieces.reverse()
         # Hack it to add "pre { white-space: pre-wrap; }", which make
         # it wrap the pygments html logs.  I think that in a newer
         # version of pygmetns, the "prestyles" HTMLFormatter option
@@ -389,94 +688,172 @@ class HTMLlog1(_BaseWriter):
         # format in.  Thanks to a comment on the blog of Francis
         # Giannaros (http://francis.giannaros.org) for the suggestion
         # and instructions for how.
-        out,n = re.subn(r"(\n\s*pre\s*\{[^}]+;\s*)(\})",
-                        r"\1\n      white-space: pre-wrap;\2",
-                        out, count=1)
+        # Only the head, with the style, can match.
+        head = [ ]
+        body = ''
+        while pieces:
+            piece = pieces.pop()
+            end = piece.find('</style>')
+            if end < 0:
+                head.append(piece)
+                continue
+            end += len('</style>')
+            head.append(piece[:end])
+            body = piece[end:]
+            break
+        head = "".join(head)
+        head,n = re.subn(r"(\n\s*pre\s*\{[^}]+;\s*)(\})",
+                         r"\1\n      white-space: pre-wrap;\2",
+                         head, count=1)
         if n == 0:
-            out = re.sub(r"(\n\s*</style>)",
-                         r"\npre { white-space: pre-wrap; }\1",
-                         out, count=1)
-        return out
+            head = re.sub(r"(\n\s*</style>)",
+                          r"\npre { white-space: pre-wrap; }\1",
+                          head, count=1)
+        yield head + body
+        while pieces:
+            yield pieces.pop()
 
 
 class HTMLlog2(_BaseWriter, _CSSmanager):
+    line_re = re.compile(r"""\s*
+        (?P<time> \[?[0-9:\s]*\]?)\s*
+        (?P<nick>\s+<[@+\s]?[^>]+>)\s*
+        (?P<line>.*)
+    """, re.VERBOSE)
+    action_re = re.compile(r"""\s*
+        (?P<time> \[?[0-9:\s]*\]?)\s*
+        (?P<nick>\*\s+[@+\s]?[^\s]+)\s*
+        (?P<line>.*)
+    """,re.VERBOSE)
+    command_re = re.compile(r"(#[^\s]+[ \t\f\v]*)(.*)")
+    command_topic_re = re.compile(r"(#topic[ \t\f\v]*)(.*)")
+    hilight_re = re.compile(r"([^\s]+:)( .*)")
+    # Nicks which the regular expressions above would parse back.
+    simplenick_re = re.compile(r"[^\s>]+$")
+
+    # Lines never change once said, so their HTML is kept in
+    # _fragments and each save only renders the lines added since the
+    # last one.  _lines is the M.lines they were rendered from.
+    # _nickHTML holds the nicks seen so far, escaped.
+    _lines = None
+    _fragments = ()
+    _nickHTML = None
+
+    def formatMessage(self, line):
+        """Return the HTML of the text of a regular line."""
+        # Match #topic
+        m2 = self.command_topic_re.match(line)
+        if m2:
+            return ('<span class="topic">%s</span>'
+                    '<span class="topicline">%s</span>' %
+                    (html(m2.group(1)), html(m2.group(2))))
+        # Match other #commands
+        m2 = self.command_re.match(line)
+        if m2:
+            return ('<span class="cmd">%s</span>'
+                    '<span class="cmdline">%s</span>' %
+                    (html(m2.group(1)), html(m2.group(2))))
+        # match hilights
+        m2 = self.hilight_re.match(line)
+        if m2:
+            return ('<span class="hi">%s</span>' '%s' %
+                    (html(m2.group(1)), html(m2.group(2))))
+        return html(line)
+
+    # These take the time and nick already HTML-escaped.
+    def formatRegular(self, lineNumber, time_, nick, line):
+        return ('<a href="#l-%(lineno)s" name="l-%(lineno)s">'
+                '<span class="tm">%(time)s</span></a>'
+                '<span class="nk">%(nick)s</span> '
+                '%(line)s'%{'lineno':lineNumber,
+                            'time':time_,
+                            'nick':nick,
+                            'line':self.formatMessage(line),
+                            })
+
+    def formatAction(self, lineNumber, time_, nick, line):
+        return ('<a name="l-%(lineno)s"></a>'
+                '<span class="tm">%(time)s</span>'
+                '<span class="nka">%(nick)s</span> '
+                '<span class="ac">%(line)s</span>'%
+                  {'lineno':lineNumber,
+                   'time':time_,
+                   'nick':nick,
+                   'line':html(line),
+                   })
+
+    def formatLine(self, lineNumber, l):
+        """Return the HTML of line number lineNumber (from 1), l.
+
+        Returns None for lines which can't be parsed."""
+        # is it a regular line?
+        m = self.line_re.match(l)
+        if m:
+            return self.formatRegular(lineNumber, html(m.group('time')),
+                                      html(m.group('nick')), m.group('line'))
+        m = self.action_re.match(l)
+        # is it a action line?
+        if m:
+            return self.formatAction(lineNumber, html(m.group('time')),
+                                     html(m.group('nick')), m.group('line'))
+        print("**error**", l)
+        return None
+
+    def formatRecord(self, lineNumber, minute, nick, text, action):
+        """Return the HTML of line number lineNumber (from 1), given
+        its fields in the LineStore.
+
+        This gives the same as formatLine() on the text form of the
+        line, without parsing it."""
+        if self._nickHTML is None:
+            self._nickHTML = { }
+        nickHTML = self._nickHTML.get(nick)
+        if nickHTML is None:
+            if not self.simplenick_re.match(nick):
+                return self.formatLine(lineNumber, self.M.lines.formatLine(
+                    minute, nick, text, action))
+            nickHTML = self._nickHTML[nick] = html(nick)
+        time_ = "%02d:%02d" % (minute//60, minute%60)
+        if action:
+            # (the time of action lines was parsed with its space)
+            return self.formatAction(lineNumber, time_+' ', '* '+nickHTML,
+                                     text)
+        return self.formatRegular(lineNumber, time_,
+                                  ' &lt;%s&gt;' % nickHTML, text.lstrip())
+
     def format(self, extension=None):
         """Write pretty HTML logs."""
+        return "".join(self.iterformat(extension))
+
+    def iterformat(self, extension=None):
         M = self.M
-        lines = [ ]
-        line_re = re.compile(r"""\s*
-            (?P<time> \[?[0-9:\s]*\]?)\s*
-            (?P<nick>\s+<[@+\s]?[^>]+>)\s*
-            (?P<line>.*)
-        """, re.VERBOSE)
-        action_re = re.compile(r"""\s*
-            (?P<time> \[?[0-9:\s]*\]?)\s*
-            (?P<nick>\*\s+[@+\s]?[^\s]+)\s*
-            (?P<line>.*)
-        """,re.VERBOSE)
-        command_re = re.compile(r"(#[^\s]+[ \t\f\v]*)(.*)")
-        command_topic_re = re.compile(r"(#topic[ \t\f\v]*)(.*)")
-        hilight_re = re.compile(r"([^\s]+:)( .*)")
-        lineNumber = 0
-        for l in M.lines:
-            lineNumber += 1  # starts from 1
-            # is it a regular line?
-            m = line_re.match(l)
-            if m:
-                line = m.group('line')
-                # Match #topic
-                m2 = command_topic_re.match(line)
-                if m2:
-                    outline = ('<span class="topic">%s</span>'
-                               '<span class="topicline">%s</span>' %
-                               (html(m2.group(1)), html(m2.group(2))))
-                # Match other #commands
-                if not m2:
-                    m2 = command_re.match(line)
-                    if m2:
-                        outline = ('<span class="cmd">%s</span>'
-                                   '<span class="cmdline">%s</span>' %
-                                   (html(m2.group(1)), html(m2.group(2))))
-                # match hilights
-                if not m2:
-                    m2 = hilight_re.match(line)
-                    if m2:
-                        outline = ('<span class="hi">%s</span>' '%s' %
-                                   (html(m2.group(1)), html(m2.group(2))))
-                if not m2:
-                    outline = html(line)
-                lines.append('<a href="#l-%(lineno)s" name="l-%(lineno)s">'
-                             '<span class="tm">%(time)s</span></a>'
-                             '<span class="nk">%(nick)s</span> '
-                             '%(line)s'%{'lineno':lineNumber,
-                                         'time':html(m.group('time')),
-                                         'nick':html(m.group('nick')),
-                                         'line':outline,
-                                         })
-                continue
-            m = action_re.match(l)
-            # is it a action line?
-            if m:
-                lines.append('<a name="l-%(lineno)s"></a>'
-                             '<span class="tm">%(time)s</span>'
-                             '<span class="nka">%(nick)s</span> '
-                             '<span class="ac">%(line)s</span>'%
-                               {'lineno':lineNumber,
-                                'time':html(m.group('time')),
-                                'nick':html(m.group('nick')),
-                                'line':html(m.group('line')),
-                                })
-                continue
-            print(l)
-            print(m.groups())
-            print("**error**", l)
+        if M.lines is not self._lines or \
+               len(M.lines) < len(self._fragments):
+            # A different log: start over.
+            self._lines = M.lines
+            self._fragments = [ ]
+        fragments = self._fragments
+        for record in M.lines.records(len(fragments)):
+            fragments.append(self.formatRecord(len(fragments)+1, *record))
+        lines = ( l for l in fragments if l is not None )
 
         css = self.getCSS(name='log')
-        return html_template%{'pageTitle':"%s log"%html(M.channel),
-                              #'body':"<br>\n".join(lines),
-                              'body':"<pre>"+("\n".join(lines))+"</pre>",
-                              'headExtra':css,
-                              }
+        # The template, around the body, which is yielded in pieces.
+        head, tail = html_template.split('%(body)s')
+        yield head%{'pageTitle':"%s log"%html(M.channel),
+                    'headExtra':css,
+                    }
+        yield "<pre>"
+        for chunk in joinChunks(lines, "\n"):
+            yield chunk
+        yield "</pre>"
+        yield tail
+
+    def inputFiles(self, extension=None):
+        return (self.cssFilename('log'),)
+    update_realtime = True
+    streaming = True
+    depends = ('lines', 'meta')
 
 HTMLlog = HTMLlog2
 
@@ -498,6 +875,7 @@ html_template = textwrap.dedent('''\
 
 
 class HTML1(_BaseWriter):
+    depends = ('attendees', 'minutes', 'meta')
     body = textwrap.dedent('''\
     <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">
     <html>
@@ -555,15 +933,13 @@ class HTML1(_BaseWriter):
 
         # Action Items
         ActionItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             ActionItems.append(wrapList("<li>%s</li>" % html(m.line), 2))
         if not ActionItems:
             ActionItems.append(indentItem("<li>(None)</li>", 2))
         ActionItems = "\n".join(ActionItems)
 
-        # Action Items, by person (This could be made lots more efficient)
+        # Action Items, by person
         ActionItemsPerson = [ ]
         for nick, items in self.iterActionItemsNick():
             headerPrinted = False
@@ -610,6 +986,7 @@ class HTML1(_BaseWriter):
 
 class HTML2(_BaseWriter, _CSSmanager):
     """HTML formatter without tables."""
+    depends = ('attendees', 'minutes', 'votes', 'meta')
     def meetingItems(self):
         """Return the main 'Meeting minutes' block."""
         M = self.M
@@ -681,14 +1058,14 @@ class HTML2(_BaseWriter, _CSSmanager):
         M = self.M
         # Votes
         Votes = [ ]
+        voteLink = self.context.replacements['fullLogs']
         # reversed to show the oldest first
-        for v, (vsum, vline) in list(M.votes.items()):
-            voteLink = "%(fullLogs)s" % self.replacements()
+        for v, vsum, vline, voters in self.context.votes:
             Votes.append(wrapList("<li><a href='%s#%d'>%s</a>" % (voteLink, vline, html(v)), 2))
             # differentiate denied votes somehow, strikethrough perhaps?
             Votes.append(wrapList("<ul><li>%s" % html(vsum), 4))
-            if M.publicVoters[v]:
-                publicVoters = ', '.join(M.publicVoters[v])
+            if voters:
+                publicVoters = ', '.join(voters)
                 Votes.append(wrapList("<ul><li>Voters: %s</li></ul>" % html(publicVoters), 6))
         if not Votes:
             return None
@@ -705,9 +1082,7 @@ class HTML2(_BaseWriter, _CSSmanager):
         M = self.M
         # Action Items
         ActionItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             ActionItems.append(wrapList("<li>%s</li>" % html(m.line), 2))
         if not ActionItems:
             return None
@@ -720,7 +1095,7 @@ class HTML2(_BaseWriter, _CSSmanager):
     def actionItemsPerson(self):
         """Return the 'Action items, by person' block."""
         M = self.M
-        # Action Items, by person (This could be made lots more efficient)
+        # Action Items, by person
         ActionItemsPerson = [ ]
         for nick, items in self.iterActionItemsNick():
             headerPrinted = False
@@ -753,9 +1128,7 @@ class HTML2(_BaseWriter, _CSSmanager):
         M = self.M
         # Done Items
         DoneItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "DONE": continue
+        for m in self.context.done:
             #already escaped
             DoneItems.append(wrapList("<li>%s</li>" % html(m.line), 2))
         if not DoneItems:
@@ -817,10 +1190,14 @@ class HTML2(_BaseWriter, _CSSmanager):
 
         return html
 
+    def inputFiles(self, extension=None):
+        return (self.cssFilename('minutes'),)
+
 HTML = HTML2
 
 
 class ReST(_BaseWriter):
+    depends = ('attendees', 'minutes', 'meta')
     body = textwrap.dedent("""\
     %(titleBlock)s
     %(pageTitle)s
@@ -873,15 +1250,25 @@ class ReST(_BaseWriter):
     """)
 
     def format(self, extension=None):
+        """Return the ReST minutes.
+
+        They are only made once per save: HTMLfromReST converts the
+        same text."""
+        rst = self.context.rst.get(type(self))
+        if rst is None:
+            rst = self.context.rst[type(self)] = self.render()
+        return rst
+
+    def render(self):
         """Return a ReStructured Text minutes summary."""
         M = self.M
         # Agenda items
         MeetingItems = [ ]
-        M.rst_urls = [ ]
-        M.rst_refs = { }
+        rst_urls = [ ]
+        rst_refs = { }
         haveTopic = False
         for m in M.minutes:
-            item = "* "+m.rst(M)
+            item = "* "+m.rst(M, rst_refs, rst_urls)
             if m.itemtype == "TOPIC":
                 if haveTopic:
                     MeetingItems.append("")
@@ -892,43 +1279,33 @@ class ReST(_BaseWriter):
                 else:         item = wrapList(item, 0)
             MeetingItems.append(item)
         MeetingItems = "\n\n".join(MeetingItems)
-        MeetingURLs = "\n".join(M.rst_urls)
-        del M.rst_urls, M.rst_refs
+        MeetingURLs = "\n".join(rst_urls)
         MeetingItems += "\n\n"+MeetingURLs
 
         # Action Items
         ActionItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             #already escaped
             ActionItems.append(wrapList("* %s"%rst(m.line), 0))
         if not ActionItems:
             ActionItems.append("* (None)")
         ActionItems = "\n\n".join(ActionItems)
 
-        # Action Items, by person (This could be made lots more efficient)
+        # Action Items, by person
         ActionItemsPerson = [ ]
-        for nick in sorted(list(M.attendees.keys()), key=lambda x: x.lower()):
+        for nick, items in self.iterActionItemsNick():
             headerPrinted = False
-            for m in M.minutes:
-                # The hack below is needed because of pickling problems
-                if m.itemtype != "ACTION": continue
-                if not re.match(r'.*\b%s\b.*' % re.escape(nick), m.line, re.I):
-                    continue
+            for m in items:
                 if not headerPrinted:
                     ActionItemsPerson.append("* %s"%rst(nick))
                     headerPrinted = True
                 ActionItemsPerson.append(wrapList("* %s"%rst(m.line), 2))
-                m.assigned = True
         if not ActionItemsPerson:
             ActionItemsPerson.append("* (None)")
         else:
             # Unassigned items
             Unassigned = [ ]
-            for m in M.minutes:
-                if m.itemtype != "ACTION": continue
-                if getattr(m, 'assigned', False): continue
+            for m in self.iterActionItemsUnassigned():
                 Unassigned.append(wrapList("* %s"%rst(m.line), 2))
             if Unassigned:
                 Unassigned.insert(0, "* **UNASSIGNED**")
@@ -956,19 +1333,74 @@ class ReST(_BaseWriter):
         return body
 
 
+# The worker process running docutils for HTMLfromReST, and the pid
+# of the process it belongs to (a forked child needs its own).
+_docutilsPool = None
+_docutilsPoolPid = None
+_docutilsLock = threading.Lock()
+
+def publishHTML(rst, timeout, **settings):
+    """Convert the ReST text rst to HTML with docutils.
+
+    With a timeout of 0, docutils is run here, without a time limit.
+    Otherwise it is run in a worker process, kept for the next calls
+    until stopDocutils().  The worker is spawned rather than forked,
+    as forking the bot, which runs threads of its own, could deadlock.
+    If it takes more than `timeout` seconds, the worker is killed (a
+    new one is started next time) and TimeoutError is raised."""
+    global _docutilsPool, _docutilsPoolPid
+    import docutils.core
+    kwargs = {'writer_name': 'html', 'settings_overrides': settings}
+    if not timeout:
+        return docutils.core.publish_string(rst, **kwargs)
+    with _docutilsLock:
+        if _docutilsPool is None or _docutilsPoolPid != os.getpid():
+            _docutilsPool = multiprocessing.get_context('spawn').Pool(1)
+            _docutilsPoolPid = os.getpid()
+        pool = _docutilsPool
+    result = pool.apply_async(docutils.core.publish_string, (rst,), kwargs)
+    try:
+        return result.get(timeout)
+    except multiprocessing.TimeoutError:
+        with _docutilsLock:
+            if _docutilsPool is pool:
+                _docutilsPool = None
+        pool.terminate()
+        raise TimeoutError("docutils took more than %s seconds" % timeout)
+
+def stopDocutils():
+    """Stop the docutils worker process of publishHTML(), if any."""
+    global _docutilsPool
+    with _docutilsLock:
+        pool, _docutilsPool = _docutilsPool, None
+    if pool is not None and _docutilsPoolPid == os.getpid():
+        pool.terminate()
+
+
 class HTMLfromReST(_BaseWriter):
+    depends = ReST.depends
     def format(self, extension=None):
         M = self.M
-        import docutils.core
         rst = ReST(M).format(extension)
-        rstToHTML = docutils.core.publish_string(rst, writer_name='html',
-                             settings_overrides={'file_insertion_enabled': 0,
-                                                 'raw_enabled': 0,
-                                'output_encoding':self.M.config.output_codec})
-        return rstToHTML
+        try:
+            rstToHTML = publishHTML(rst, M.config.rstTimeout,
+                                    file_insertion_enabled=0,
+                                    raw_enabled=0,
+                                    output_encoding=M.config.output_codec)
+        except TimeoutError:
+            if not M.config.safeMode:
+                raise
+            # Leave the last output in place.
+            import traceback
+            traceback.print_exc()
+            return None
+        # docutils encodes, for its charset declaration to be right,
+        # but Config writes text.
+        return rstToHTML.decode(M.config.output_codec)
 
 
 class Text(_BaseWriter):
+    depends = ('attendees', 'minutes', 'meta')
     def meetingItems(self):
         M = self.M
         # Agenda items
@@ -993,9 +1425,7 @@ class Text(_BaseWriter):
         M = self.M
         # Action Items
         ActionItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             #already escaped
             ActionItems.append(wrapList("* %s"%text(m.line), 0))
         if not ActionItems:
@@ -1006,28 +1436,21 @@ class Text(_BaseWriter):
 
     def actionItemsPerson(self):
         M = self.M
-        # Action Items, by person (This could be made lots more efficient)
+        # Action Items, by person
         ActionItemsPerson = [ ]
-        for nick in sorted(list(M.attendees.keys()), key=lambda x: x.lower()):
+        for nick, items in self.iterActionItemsNick():
             headerPrinted = False
-            for m in M.minutes:
-                # The hack below is needed because of pickling problems
-                if m.itemtype != "ACTION": continue
-                if not re.match(r'.*\b%s\b.*' % re.escape(nick), m.line, re.I):
-                    continue
+            for m in items:
                 if not headerPrinted:
                     ActionItemsPerson.append("* %s"%text(nick))
                     headerPrinted = True
                 ActionItemsPerson.append(wrapList("* %s"%text(m.line), 2))
-                m.assigned = True
         if not ActionItemsPerson:
             return None
 
         # Unassigned items
         Unassigned = [ ]
-        for m in M.minutes:
-            if m.itemtype != "ACTION": continue
-            if getattr(m, 'assigned', False): continue
+        for m in self.iterActionItemsUnassigned():
             Unassigned.append(wrapList("* %s"%text(m.line), 2))
         if Unassigned:
             Unassigned.insert(0, "* **UNASSIGNED**")
@@ -1087,6 +1510,7 @@ class Text(_BaseWriter):
 
 class MediaWiki(_BaseWriter):
     """Outputs MediaWiki formats."""
+    depends = ('attendees', 'minutes', 'meta')
     def meetingItems(self):
         M = self.M
         # Agenda items
@@ -1109,9 +1533,7 @@ class MediaWiki(_BaseWriter):
         M = self.M
         # Action Items
         ActionItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             #already escaped
             ActionItems.append("* %s"%mw(m.line))
         if not ActionItems:
@@ -1122,30 +1544,23 @@ class MediaWiki(_BaseWriter):
 
     def actionItemsPerson(self):
         M = self.M
-        # Action Items, by person (This could be made lots more efficient)
+        # Action Items, by person
         ActionItemsPerson = [ ]
         numberAssigned = 0
-        for nick in sorted(list(M.attendees.keys()), key=lambda x: x.lower()):
+        for nick, items in self.iterActionItemsNick():
             headerPrinted = False
-            for m in M.minutes:
-                # The hack below is needed because of pickling problems
-                if m.itemtype != "ACTION": continue
-                if not re.match(r'.*\b%s\b.*' % re.escape(nick), m.line, re.I):
-                    continue
+            for m in items:
                 if not headerPrinted:
                     ActionItemsPerson.append("* %s"%mw(nick))
                     headerPrinted = True
                 ActionItemsPerson.append("** %s"%mw(m.line))
                 numberAssigned += 1
-                m.assigned = True
         if not ActionItemsPerson:
             return None
 
         # Unassigned items
         Unassigned = [ ]
-        for m in M.minutes:
-            if m.itemtype != "ACTION": continue
-            if getattr(m, 'assigned', False): continue
+        for m in self.iterActionItemsUnassigned():
             Unassigned.append("** %s"%mw(m.line))
         if Unassigned:
             Unassigned.insert(0, "* **UNASSIGNED**")
@@ -1207,14 +1622,18 @@ class PmWiki(MediaWiki, object):
     def heading(self, name, level=1):
         return '%s %s\n'%('!'*(level+1), name)
     def replacements(self):
-        #repl = super(PmWiki, self).replacements(self) # fails, type checking
-        repl = MediaWiki.replacements.__func__(self)
+        # not super(): the classes in Config.writer_map may be from
+        # before writers was reloaded.
+        repl = MediaWiki.replacements(self)
         repl['pageTitleHeading'] = self.heading(repl['pageTitle'],level=0)
         return repl
 
 
 class Moin(_BaseWriter):
     """Outputs MoinMoin formats."""
+    # The full log is included, with moinFullLogs.
+    depends = ('lines', 'attendees', 'minutes', 'votes', 'meta')
+    streaming = True
     def meetingItems(self):
         M = self.M
         # Agenda items
@@ -1243,26 +1662,25 @@ class Moin(_BaseWriter):
         return MeetingItems
 
     def fullLog(self):
-        M = self.M
-        Lines = [ ]
-        Lines.append(self.heading('Full log'))
-        for l in M.lines:
-            Lines.append(' '+l)
-        Lines = "\n\n".join(Lines)
-        return Lines
+        return "".join(self.iterFullLog())
+
+    def iterFullLog(self):
+        lines = itertools.chain([self.heading('Full log')],
+                                (' '+l for l in self.M.lines))
+        return joinChunks(lines, "\n\n")
 
     def votes(self):
         M = self.M
         # Votes
         Votes = [ ]
+        voteLink = self.context.replacements['fullLogsFullURL']
         # reversed to show the oldest first
-        for v, (vsum, vline) in list(M.votes.items()):
-            voteLink = "%(fullLogsFullURL)s" % self.replacements()
+        for v, vsum, vline, voters in self.context.votes:
             Votes.append(" * [[%s#%d|%s]]" % (voteLink, vline, v))
             # differentiate denied votes somehow, strikethrough perhaps?
             Votes.append("  * " + vsum)
-            if M.publicVoters[v]:
-                publicVoters = ', '.join(M.publicVoters[v])
+            if voters:
+                publicVoters = ', '.join(voters)
                 Votes.append("   * Voters: " + publicVoters)
         if not Votes:
             return None
@@ -1274,9 +1692,7 @@ class Moin(_BaseWriter):
         M = self.M
         # Action Items
         ActionItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "ACTION": continue
+        for m in self.context.actions:
             #already escaped
             ActionItems.append(" * %s"%moin(m.line))
         if not ActionItems:
@@ -1287,28 +1703,21 @@ class Moin(_BaseWriter):
 
     def actionItemsPerson(self):
         M = self.M
-        # Action Items, by person (This could be made lots more efficient)
+        # Action Items, by person
         ActionItemsPerson = [ ]
-        for nick in sorted(list(M.attendees.keys()), key=lambda x: x.lower()):
+        for nick, items in self.iterActionItemsNick():
             headerPrinted = False
-            for m in M.minutes:
-                # The hack below is needed because of pickling problems
-                if m.itemtype != "ACTION": continue
-                if not re.match(r'.*\b%s\b.*' % re.escape(nick), m.line, re.I):
-                    continue
+            for m in items:
                 if not headerPrinted:
                     ActionItemsPerson.append(" * %s"%moin(nick))
                     headerPrinted = True
                 ActionItemsPerson.append("  * %s"%moin(m.line))
-                m.assigned = True
         if not ActionItemsPerson:
             return None
 
         # Unassigned items
         Unassigned = [ ]
-        for m in M.minutes:
-            if m.itemtype != "ACTION": continue
-            if getattr(m, 'assigned', False): continue
+        for m in self.iterActionItemsUnassigned():
             Unassigned.append("  * %s"%moin(m.line))
         if Unassigned:
             Unassigned.insert(0, " * **UNASSIGNED**")
@@ -1322,9 +1731,7 @@ class Moin(_BaseWriter):
         M = self.M
         # Done Items
         DoneItems = [ ]
-        for m in M.minutes:
-            # The hack below is needed because of pickling problems
-            if m.itemtype != "DONE": continue
+        for m in self.context.done:
             #already escaped
             DoneItems.append(" * %s"%moin(m.line))
         if not DoneItems:
@@ -1355,6 +1762,9 @@ class Moin(_BaseWriter):
              * Full logs at %(fullLogsFullURL)s""")
     def format(self, extension=None):
         """Return a MoinMoin formatted minutes summary."""
+        return "".join(self.iterformat(extension))
+
+    def iterformat(self, extension=None):
         M = self.M
 
         # Actual formatting and replacement
@@ -1370,12 +1780,19 @@ class Moin(_BaseWriter):
         body.append(self.actionItemsPerson())
         body.append(self.doneItems())
         body.append(self.peoplePresent())
-        if M.config.moinFullLogs:
-            body.append(self.fullLog())
-        body.append(textwrap.dedent("""\
-            Generated by MeetBot %(MeetBotVersion)s (%(MeetBotInfoURL)s)"""%repl))
         body = [ b for b in body if b is not None ]
-        body = "\n\n\n\n".join(body)
-        body = replaceWRAP(body)
-
-        return body
+        footer = textwrap.dedent("""\
+            Generated by MeetBot %(MeetBotVersion)s (%(MeetBotInfoURL)s)"""%repl)
+        if not M.config.moinFullLogs:
+            yield replaceWRAP("\n\n\n\n".join(body + [footer]))
+            return
+        # The full log is yielded in pieces, unless it has WRAP marks:
+        # replaceWRAP() may then join it with the rest.
+        if any('sWRAPs' in l or 'eWRAPe' in l for l in M.lines):
+            yield replaceWRAP("\n\n\n\n".join(
+                body + [self.fullLog(), footer]))
+            return
+        yield replaceWRAP("\n\n\n\n".join(body)) + "\n\n\n\n"
+        for chunk in self.iterFullLog():
+            yield chunk
+        yield "\n\n\n\n" + replaceWRAP(footer)